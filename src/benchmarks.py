@@ -0,0 +1,387 @@
+"""
+Benchmarks for building and evaluating the model equations.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import time
+
+import numpy as np
+
+import counterfactuals
+import models
+import solvers
+import sweeps
+
+
+class UncachedModel(models.Model):
+
+    @property
+    def economic_distances(self):
+        """
+        Square matrix of pairwise measures of economic distance between cities
+        recomputed on every access (i.e., without the cache used by Model).
+
+        :getter: Return the matrix of economic distances.
+        :type: sympy.Basic
+
+        """
+        return np.exp(self.physical_distances)**models.tau
+
+
+def time_symbolic_build(model, number_cities):
+    """
+    Time construction of the symbolic model equations.
+
+    Parameters
+    ----------
+    model : models.Model
+        An instance of the models.Model class.
+    number_cities : int
+        Number of cities for which to build the model equations.
+
+    Returns
+    -------
+    elapsed : float
+        Wall clock time (in seconds) needed to build the equations.
+
+    """
+    model.number_cities = number_cities
+    start = time.time()
+    model._symbolic_equations
+    return time.time() - start
+
+
+def time_evaluation(solver, X, number=100):
+    """
+    Time evaluation of the model residual and Jacobian.
+
+    Parameters
+    ----------
+    solver : solvers.Solver
+        An instance of the solvers.Solver class.
+    X : numpy.ndarray (shape=(4N-1,) or (K,4N-1))
+        Array containing values of the endogenous variables. If X is a
+        two-dimensional array, then the evaluations cycle through its rows
+        (so that results cached for the previous point are not reused).
+    number : int (default=100)
+        Number of evaluations over which to average.
+
+    Returns
+    -------
+    system_time, jacobian_time : tuple
+        Average wall clock time (in seconds) for a single evaluation of the
+        residual and of the Jacobian.
+
+    """
+    points = np.atleast_2d(X)
+
+    # first evaluation builds (or loads) the kernels
+    solver.system(points[0])
+    solver.jacobian(points[0])
+
+    start = time.time()
+    for i in range(number):
+        solver.system(points[i % points.shape[0]])
+    system_time = (time.time() - start) / number
+
+    start = time.time()
+    for i in range(number):
+        solver.jacobian(points[i % points.shape[0]])
+    jacobian_time = (time.time() - start) / number
+
+    return system_time, jacobian_time
+
+
+def time_batched_evaluation(solver, X, number=10):
+    """
+    Time evaluation of the model residual and Jacobian at a stack of points.
+
+    Parameters
+    ----------
+    solver : solvers.Solver
+        An instance of the solvers.Solver class.
+    X : numpy.ndarray (shape=(K,4N-1))
+        Array whose rows contain values of the endogenous variables.
+    number : int (default=10)
+        Number of evaluations over which to average.
+
+    Returns
+    -------
+    batched_time, serial_time : tuple
+        Average wall clock time (in seconds) per point for evaluating the
+        residual and Jacobian at all K points in a single call and in K
+        separate calls.
+
+    """
+    K = X.shape[0]
+    solver.system(X)
+    solver.jacobian(X)
+
+    start = time.time()
+    for i in range(number):
+        solver.system(X)
+        solver.jacobian(X)
+    batched_time = (time.time() - start) / (number * K)
+
+    start = time.time()
+    for i in range(number):
+        for k in range(K):
+            solver.system(X[k])
+            solver.jacobian(X[k])
+    serial_time = (time.time() - start) / (number * K)
+
+    return batched_time, serial_time
+
+
+def time_solve(solver, initial_guess, method, **kwargs):
+    """
+    Time solving the model using some method.
+
+    Parameters
+    ----------
+    solver : solvers.Solver
+        An instance of the solvers.Solver class.
+    initial_guess : numpy.ndarray (shape=(4N-1,))
+        Initial guess for the model equilibrium.
+    method : str
+        Method passed to solvers.Solver.solve.
+    kwargs : dict
+        Additional keyword arguments passed to solvers.Solver.solve.
+
+    Returns
+    -------
+    elapsed, result : tuple
+        Wall clock time (in seconds) needed to solve the model and the
+        resulting scipy.optimize.OptimizeResult.
+
+    """
+    start = time.time()
+    result = solver.solve(initial_guess, method=method, **kwargs)
+    return time.time() - start, result
+
+
+def time_truncated_solve(solver, dense_solution, **kwargs):
+    """
+    Time solving the model with trade restricted to a sparse trade network
+    and compute the approximation error relative to the dense solution.
+
+    Parameters
+    ----------
+    solver : solvers.Solver
+        An instance of the solvers.Solver class.
+    dense_solution : numpy.ndarray (shape=(4N-1,))
+        Solution of the model in which all pairs of cities trade. This is
+        also used as the initial guess, so that the truncated solution is
+        the equilibrium nearest to the dense solution.
+    kwargs : dict
+        Keyword arguments passed to models.Model.compute_trade_network.
+
+    Returns
+    -------
+    elapsed, density, error, result : tuple
+        Wall clock time (in seconds) needed to build the trade network and
+        solve the model, the fraction of pairs of cities in the trade
+        network, the largest relative difference between the truncated and
+        dense solutions, and the resulting scipy.optimize.OptimizeResult.
+
+    """
+    model = solver.model
+    start = time.time()
+    model.trade_network = model.compute_trade_network(model.params['tau'],
+                                                      model.params['theta'],
+                                                      **kwargs)
+    result = solver.solve(dense_solution, method='sparse_newton')
+    elapsed = time.time() - start
+
+    density = model.trade_network.nnz / float(model.number_cities**2)
+    error = np.max(np.abs(result.x / dense_solution - 1))
+    return elapsed, density, error, result
+
+
+def time_counterfactuals(counterfactual, shocks):
+    """
+    Time solving a batch of single city counterfactuals.
+
+    Parameters
+    ----------
+    counterfactual : counterfactuals.Counterfactual
+        An instance of the counterfactuals.Counterfactual class.
+    shocks : list
+        List of (method, city, value) tuples where method is either
+        'solve_population' or 'solve_distances'.
+
+    Returns
+    -------
+    elapsed, results : tuple
+        Wall clock time (in seconds) needed to solve all counterfactuals
+        (including factoring the baseline Jacobian) and a list of the
+        resulting scipy.optimize.OptimizeResult objects.
+
+    """
+    start = time.time()
+    results = [getattr(counterfactual, method)(city, value)
+               for method, city, value in shocks]
+    elapsed = time.time() - start
+    return elapsed, results
+
+
+def time_sweep(params, physical_distances, population, number_cities,
+               processes=None, **solver_kwargs):
+    """
+    Time solving the model over a grid of parameter values.
+
+    Parameters
+    ----------
+    params : list
+        List of parameter dictionaries (see sweeps.parameter_grid).
+    physical_distances : numpy.ndarray (shape=(N,N))
+        Square array of pairwise measures of physical distance between cities.
+    population : numpy.ndarray (shape=(N,))
+        Array of total population for each city.
+    number_cities : int
+        Number of cities in the economy.
+    processes : int (default=None)
+        Number of worker processes passed to sweeps.sweep. If None, then the
+        model is instead solved in a serial loop that creates a new Model and
+        Solver for each parameter dictionary.
+    solver_kwargs : dict
+        Additional keyword arguments passed to Solver.solve.
+
+    Returns
+    -------
+    elapsed, throughput : tuple
+        Wall clock time (in seconds) needed to solve the model for every
+        parameter dictionary and the number of solves per second.
+
+    """
+    start = time.time()
+    if processes is None:
+        for tmp_params in params:
+            tmp_params = dict(tmp_params)
+            tmp_params['theta'] = np.repeat(tmp_params['theta'], number_cities)
+            tmp_model = models.Model(params=tmp_params,
+                                     physical_distances=physical_distances,
+                                     population=population)
+            tmp_model.number_cities = number_cities
+            tmp_solver = solvers.Solver(tmp_model, backend='numpy')
+            tmp_solver.solve(solvers.IslandsGuess(tmp_model).guess,
+                             **solver_kwargs)
+    else:
+        sweeps.sweep(params, physical_distances, population, number_cities,
+                     processes=processes, **solver_kwargs)
+    elapsed = time.time() - start
+    return elapsed, len(params) / elapsed
+
+
+if __name__ == '__main__':
+    import master_data
+
+    # grab data on physical distances
+    physical_distances = np.load('../data/google/normed_vincenty_distance.npy')
+
+    # compute the effective labor supply
+    raw_data = master_data.panel.minor_xs(2010)
+    clean_data = raw_data.sort('GDP_MP', ascending=False).drop([998, 48260])
+    population = clean_data['POP_MI'].values
+
+    # define some parameters
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, physical_distances.shape[0])}
+
+    model = models.Model(params=params,
+                         physical_distances=physical_distances,
+                         population=population)
+
+    uncached_model = UncachedModel(params=params,
+                                   physical_distances=physical_distances,
+                                   population=population)
+    for N in [25, 50]:
+        mesg = ("Symbolic build with {} cities: {:.3f} seconds (cached " +
+                "economic distances), {:.3f} seconds (uncached)")
+        print(mesg.format(N, time_symbolic_build(model, N),
+                          time_symbolic_build(uncached_model, N)))
+
+    for backend in ['sympy', 'autowrap', 'numpy', 'numba']:
+        model.number_cities = 5
+        solver = solvers.Solver(model, backend=backend)
+        initial_guess = solvers.IslandsGuess(model)
+        mesg = ("Evaluation with {} backend: {:.2e} seconds (system), " +
+                "{:.2e} seconds (jacobian)")
+        print(mesg.format(backend, *time_evaluation(solver, initial_guess.guess)))
+
+    model.number_cities = 25
+    solver = solvers.Solver(model, backend='numpy')
+    initial_guess = solvers.IslandsGuess(model).guess
+    for K in [10, 100, 1000]:
+        X = initial_guess * np.random.uniform(0.9, 1.1, (K, initial_guess.size))
+        mesg = ("Evaluation at {} points: {:.2e} seconds per point (batched), " +
+                "{:.2e} seconds per point (serial)")
+        print(mesg.format(K, *time_batched_evaluation(solver, X)))
+
+    for N in [50, 150, 380]:
+        model.number_cities = N
+        initial_guess = solvers.IslandsGuess(model).guess
+        X = initial_guess * np.random.uniform(0.9, 1.1, (10, initial_guess.size))
+        for backend in ['numpy', 'numba']:
+            solver = solvers.Solver(model, backend=backend)
+            mesg = ("Evaluation with {} backend and {} cities: {:.2e} " +
+                    "seconds (system), {:.2e} seconds (jacobian)")
+            print(mesg.format(backend, N, *time_evaluation(solver, X, 20)))
+
+    for N in [100, 200, 380]:
+        model.number_cities = N
+        solver = solvers.Solver(model, backend='numpy')
+        initial_guess = solvers.IslandsGuess(model).guess
+        for method, kwargs in [('hybr', {'tol': 1e-12}),
+                               ('newton_krylov', {'tol': 1e-9})]:
+            elapsed, result = time_solve(solver, initial_guess, method, **kwargs)
+            mesg = ("Solve using {} with {} cities: {:.2f} seconds, {} " +
+                    "iterations, {} function evaluations (success: {})")
+            print(mesg.format(method, N, elapsed, result.get('nit', '-'),
+                              result.nfev, result.success))
+
+    grid = sweeps.parameter_grid(f=np.logspace(-1, 1, 4),
+                                 beta=[1.31],
+                                 phi=[1.0 / 1.31],
+                                 tau=np.logspace(-2, -1, 4),
+                                 theta=np.linspace(5.0, 15.0, 4))
+    for processes in [None, 1, 2, 4]:
+        elapsed, throughput = time_sweep(grid, physical_distances, population,
+                                         25, processes, tol=1e-10)
+        mesg = ("Sweep of {} points with {} processes: {:.2f} seconds, " +
+                "{:.1f} solves per second")
+        print(mesg.format(len(grid), processes or 'no (serial loop)',
+                          elapsed, throughput))
+
+    model.number_cities = 380
+    model.params = dict(params, tau=2.0)
+    solver = solvers.Solver(model, backend='numpy')
+    initial_guess = solvers.IslandsGuess(model).guess
+    dense_result = solver.solve(initial_guess, method='newton_krylov', tol=1e-9)
+    for kwargs in [{'min_trade_share': 1e-4}, {'min_trade_share': 1e-3},
+                   {'max_distance': 0.2}, {'max_distance': 0.1}]:
+        elapsed, density, error, result = time_truncated_solve(solver,
+                                                               dense_result.x,
+                                                               **kwargs)
+        mesg = ("Sparse solve with {}: {:.2f} seconds, {:.1%} of pairs, " +
+                "{:.2e} max relative error (success: {})")
+        print(mesg.format(kwargs, elapsed, density, error, result.success))
+
+    model.number_cities = 380
+    model.params = params
+    solver = solvers.Solver(model, backend='numpy')
+    initial_guess = solvers.IslandsGuess(model).guess
+    baseline_elapsed, baseline_result = time_solve(solver, initial_guess, 'hybr',
+                                                   tol=1e-10)
+    counterfactual = counterfactuals.Counterfactual(solver, baseline_result.x)
+    for method, values in [('solve_population', 1.1 * population),
+                           ('solve_distances', 0.9 * physical_distances)]:
+        shocks = [(method, h, values[h]) for h in range(model.number_cities)]
+        elapsed, results = time_counterfactuals(counterfactual, shocks)
+        mesg = ("{} counterfactuals using {}: {:.2f} seconds ({:.2f} seconds " +
+                "to re-solve baseline), {} max iterations (success: {})")
+        print(mesg.format(len(shocks), method, elapsed, baseline_elapsed,
+                          max(result.nit for result in results),
+                          all(result.success for result in results)))
@@ -0,0 +1,258 @@
+"""
+Classes for tracing the model equilibrium along a path of parameter values.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import time
+
+import numpy as np
+
+
+class ParameterContinuation(object):
+
+    _valid_params = ['f', 'beta', 'phi', 'tau', 'theta']
+
+    def __init__(self, solver, param):
+        """
+        Create an instance of the ParameterContinuation class.
+
+        Parameters
+        ----------
+        solver : solvers.Solver
+            An instance of the solvers.Solver class.
+        param : str
+            Name of the parameter to vary. Must be one of 'f', 'beta', 'phi',
+            'tau', or 'theta' (in which case the same elasticity of
+            substitution is used for every city).
+
+        """
+        self.solver = solver
+        self.param = param
+
+    @property
+    def model(self):
+        """
+        Model whose equilibrium is being traced.
+
+        :getter: Return the current model.
+        :type: models.Model
+
+        """
+        return self.solver.model
+
+    @property
+    def param(self):
+        """
+        Name of the parameter being varied.
+
+        :getter: Return the current parameter name.
+        :setter: Set a new parameter name.
+        :type: str
+
+        """
+        return self._param
+
+    @param.setter
+    def param(self, value):
+        """Set a new parameter name."""
+        self._param = self._validate_param(value)
+
+    @classmethod
+    def _validate_param(cls, value):
+        """Validate the param attribute."""
+        if value not in cls._valid_params:
+            mesg = "ParameterContinuation.param attribute must be one of {}, not {}"
+            raise AttributeError(mesg.format(cls._valid_params, value))
+        else:
+            return value
+
+    def _get_value(self):
+        """Return the current value of the parameter."""
+        value = self.model.params[self.param]
+        if self.param == 'theta':
+            value = value[0]
+        return value
+
+    def _set_value(self, value):
+        """Set a new value for the parameter."""
+        params = dict(self.model.params)
+        if self.param == 'theta':
+            params['theta'] = np.repeat(value, len(params['theta']))
+        else:
+            params[self.param] = value
+        self.model.params = params
+
+    def parameter_derivative(self, X):
+        """
+        Derivative of the model residual with respect to the parameter.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Array containing values of the endogenous variables.
+
+        Returns
+        -------
+        derivative : numpy.ndarray
+            Derivative of the residual with respect to the parameter, computed
+            using a central finite difference.
+
+        """
+        value = self._get_value()
+        step = 1e-6 * max(1.0, abs(value))
+
+        self._set_value(value + step)
+        forward = self.solver.system(X)
+        self._set_value(value - step)
+        backward = self.solver.system(X)
+        self._set_value(value)
+
+        return (forward - backward) / (2 * step)
+
+    def tangent(self, X):
+        """
+        Tangent to the solution path (i.e., dX/dparam) at an equilibrium.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Array containing equilibrium values of the endogenous variables.
+
+        Returns
+        -------
+        tangent : numpy.ndarray
+            Derivative of the equilibrium with respect to the parameter.
+
+        """
+        jac = self.solver.jacobian(X)
+        return -np.linalg.solve(jac, self.parameter_derivative(X))
+
+    def trace(self, values, initial_guess, initial_step=None, max_step=None,
+              min_step=1e-8, growth_nfev=10, **solver_kwargs):
+        """
+        Trace the equilibrium along a path of parameter values.
+
+        Each step is a predictor-corrector step: the tangent to the solution
+        path computed using the Jacobian at the previous point predicts the
+        new equilibrium, which is then corrected using Solver.solve. The step
+        length grows after corrections that converge quickly and shrinks
+        after corrections that fail.
+
+        Parameters
+        ----------
+        values : array_like
+            Monotonic sequence of parameter values. The first value is the
+            starting point of the path.
+        initial_guess : numpy.ndarray
+            Initial guess for the equilibrium at the first parameter value.
+        initial_step : float (default=None)
+            Initial step length (must be positive). Defaults to the distance
+            between the first two distinct parameter values.
+        max_step : float (default=None)
+            Maximum step length (must be positive). Defaults to no maximum.
+        min_step : float (default=1e-8)
+            Minimum step length. If a correction fails with a step of this
+            length, the path is abandoned after yielding the last parameter
+            value reached.
+        growth_nfev : int (default=10)
+            Corrections using at most this many function evaluations cause
+            the step length to double.
+        solver_kwargs : dict
+            Additional keyword arguments passed to Solver.solve.
+
+        Returns
+        -------
+        path : generator
+            Generator yielding a tuple (value, solution, diagnostics) for each
+            parameter value. Diagnostics is a dictionary with a success flag,
+            the number of accepted and rejected predictor-corrector steps, the
+            number of function and Jacobian evaluations used, and the wall
+            clock time taken to reach the parameter value. If the success
+            flag is False, then no further values are yielded (and the
+            value yielded is the last one at which the solver succeeded).
+
+        """
+        values = np.asarray(values, dtype=float)
+        if initial_step is not None and not initial_step > 0:
+            mesg = "initial_step must be positive, not {}"
+            raise ValueError(mesg.format(initial_step))
+        if max_step is not None and not max_step > 0:
+            mesg = "max_step must be positive, not {}"
+            raise ValueError(mesg.format(max_step))
+
+        # validate arguments when trace is called rather than when iterated
+        return self._trace(values, initial_guess, initial_step, max_step,
+                           min_step, growth_nfev, **solver_kwargs)
+
+    def _trace(self, values, initial_guess, initial_step, max_step, min_step,
+               growth_nfev, **solver_kwargs):
+        """Generator tracing the equilibrium along a path (see trace)."""
+        # solve for the equilibrium at the start of the path
+        start = time.time()
+        self._set_value(values[0])
+        result = self.solver.solve(initial_guess, **solver_kwargs)
+        X = result.x
+        diagnostics = {'success': result.success, 'steps': 0,
+                       'rejected': 0, 'nfev': result.get('nfev', 0),
+                       'njev': result.get('njev', 0),
+                       'time': time.time() - start}
+        yield values[0], X, diagnostics
+
+        # no path can be traced from a failed initial solve
+        if not result.success:
+            return
+
+        if initial_step is None:
+            # skip duplicate values (if all values are equal, no steps needed)
+            distances = np.abs(np.diff(values))
+            distances = distances[distances > 0]
+            step = distances[0] if distances.size > 0 else 1.0
+        else:
+            step = initial_step
+        value = values[0]
+
+        for target in values[1:]:
+            start = time.time()
+            direction = np.sign(target - value)
+            diagnostics = {'success': True, 'steps': 0, 'rejected': 0,
+                           'nfev': 0, 'njev': 0}
+
+            while value != target:
+                tangent = self.tangent(X)
+                diagnostics['njev'] += 1
+                step = step if max_step is None else min(step, max_step)
+                if abs(target - value) <= step:
+                    new_value = target
+                else:
+                    new_value = value + direction * step
+
+                # predictor...
+                predicted_X = X + (new_value - value) * tangent
+
+                # ...corrector
+                self._set_value(new_value)
+                result = self.solver.solve(predicted_X, **solver_kwargs)
+                diagnostics['nfev'] += result.get('nfev', 0)
+                diagnostics['njev'] += result.get('njev', 0)
+
+                if result.success:
+                    diagnostics['steps'] += 1
+                    X, value = result.x, new_value
+                    if result.get('nfev', 0) <= growth_nfev:
+                        step = 2 * step
+                else:
+                    diagnostics['rejected'] += 1
+                    self._set_value(value)
+                    step = step / 2
+                    if step < min_step:
+                        diagnostics['success'] = False
+                        break
+
+            # X is the solution at value, which is short of target on failure
+            diagnostics['time'] = time.time() - start
+            yield value, X, diagnostics
+
+            if not diagnostics['success']:
+                break
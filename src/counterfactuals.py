@@ -0,0 +1,328 @@
+"""
+Classes for solving counterfactuals in which the population or physical
+distances of a single city change relative to a baseline equilibrium.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import numpy as np
+from scipy import linalg, optimize
+
+import models
+import solvers
+
+
+class Counterfactual(object):
+
+    _options = {'maxiter': 50, 'max_backtracks': 10}
+
+    def __init__(self, solver, baseline):
+        """
+        Create an instance of the Counterfactual class.
+
+        Parameters
+        ----------
+        solver : solvers.Solver
+            An instance of the solvers.Solver class whose model has been
+            solved for the baseline equilibrium.
+        baseline : numpy.ndarray (shape=(4N-1,))
+            Array containing baseline equilibrium values of the endogenous
+            variables.
+
+        """
+        self.solver = solver
+        self.baseline = baseline
+
+    @property
+    def _counterfactual_solver(self):
+        """
+        Solver for a copy of the model whose population and physical
+        distances are modified by each counterfactual.
+
+        :getter: Return the current counterfactual solver.
+        :type: solvers.Solver
+
+        """
+        if self.__counterfactual_solver is None:
+            model = models.Model(params=self.model.params,
+                                 physical_distances=self._physical_distances,
+                                 population=self._population)
+            model.number_cities = self.model.number_cities
+            self.__counterfactual_solver = solvers.Solver(model, backend='numpy')
+        return self.__counterfactual_solver
+
+    @property
+    def _factorization(self):
+        """
+        LU factorization of the Jacobian at the baseline equilibrium.
+
+        :getter: Return the current factorization.
+        :type: tuple
+
+        """
+        if self.__factorization is None:
+            jac = self.solver.jacobian(self.baseline)
+            self.__factorization = linalg.lu_factor(jac)
+        return self.__factorization
+
+    @property
+    def _physical_distances(self):
+        """Dense copy of the baseline physical distances."""
+        return np.array(self.model.physical_distances, dtype=np.float64)
+
+    @property
+    def _population(self):
+        """Copy of the baseline population."""
+        return np.array(self.model.population[:self.model.number_cities],
+                        dtype=np.float64)
+
+    @property
+    def baseline(self):
+        """
+        Baseline equilibrium values of the endogenous variables.
+
+        :getter: Return the current baseline equilibrium.
+        :setter: Set a new baseline equilibrium.
+        :type: numpy.ndarray
+
+        """
+        return self._baseline
+
+    @baseline.setter
+    def baseline(self, value):
+        """Set a new baseline equilibrium."""
+        self._baseline = self._validate_baseline(value)
+
+        # don't forget to clear cache!
+        self._clear_cache()
+
+    @property
+    def model(self):
+        """
+        Model whose baseline equilibrium is being shocked.
+
+        :getter: Return the current model.
+        :type: models.Model
+
+        """
+        return self.solver.model
+
+    def _clear_cache(self):
+        """Clear all cached values."""
+        self.__counterfactual_solver = None
+        self.__factorization = None
+        self.__shocked_distances = False
+
+    def _update_counterfactual_model(self, population, physical_distances=None):
+        """Set the population and physical distances of the counterfactual."""
+        counterfactual_model = self._counterfactual_solver.model
+        counterfactual_model.params = self.model.params
+        counterfactual_model.population = population
+
+        # only pay for copying distances when leaving or entering a shock
+        if physical_distances is not None:
+            counterfactual_model.physical_distances = physical_distances
+            self.__shocked_distances = True
+        elif self.__shocked_distances:
+            counterfactual_model.physical_distances = self._physical_distances
+            self.__shocked_distances = False
+
+    def _validate_baseline(self, value):
+        """Validate the baseline attribute."""
+        value = np.asarray(value, dtype=np.float64)
+        if value.shape != (4 * self.model.number_cities - 1,):
+            mesg = ("Counterfactual.baseline attribute must have shape {}, " +
+                    "not {}.")
+            raise AttributeError(mesg.format((4 * self.model.number_cities - 1,),
+                                             value.shape))
+        else:
+            return value
+
+    def _validate_city(self, city):
+        """Validate the index of the shocked city."""
+        if not 0 <= city < self.model.number_cities:
+            mesg = "City must be an integer in [0, {}), not {}."
+            raise ValueError(mesg.format(self.model.number_cities, city))
+        else:
+            return city
+
+    def _solve(self, updates=None, tol=1e-10, options=None):
+        """
+        Solve the counterfactual model starting from the baseline equilibrium
+        using Broyden's method.
+
+        The inverse Jacobian is approximated by the inverse of the baseline
+        Jacobian (applied using its LU factorization) plus a sum of rank one
+        terms. The terms are updated using the Sherman-Morrison formula so
+        that each iteration costs O(N^2) rather than the O(N^3) of a new
+        factorization.
+
+        """
+        options = dict(self._options, **(options or {}))
+        system = self._counterfactual_solver.system
+        factorization = self._factorization
+
+        # inverse Jacobian is H = inv(J_0) + sum_i u_i w_i'
+        updates = list(updates or [])
+
+        def apply_inverse(v):
+            x = linalg.lu_solve(factorization, v)
+            for u, w in updates:
+                x += u * w.dot(v)
+            return x
+
+        def apply_inverse_transpose(v):
+            x = linalg.lu_solve(factorization, v, trans=1)
+            for u, w in updates:
+                x += w * u.dot(v)
+            return x
+
+        X = self.baseline.copy()
+        residual = system(X)
+        norm = np.linalg.norm(residual)
+        nfev = 1
+
+        for nit in range(options['maxiter'] + 1):
+            if np.max(np.abs(residual)) < tol:
+                success, status = True, 1
+                message = "The residual is less than tol."
+                break
+            elif nit == options['maxiter']:
+                success, status = False, 2
+                message = "The maximum number of iterations was reached."
+                break
+
+            step = -apply_inverse(residual)
+
+            # backtrack until variables are positive and the residual decreases
+            for backtrack in range(options['max_backtracks'] + 1):
+                new_X = X + step
+                if (new_X > 0).all():
+                    new_residual = system(new_X)
+                    new_norm = np.linalg.norm(new_residual)
+                    nfev += 1
+                    if new_norm < norm:
+                        break
+                step = step / 2
+            else:
+                success, status = False, 3
+                message = "The line search failed to reduce the residual."
+                break
+
+            # Broyden update of the inverse Jacobian
+            change = new_residual - residual
+            inverse_change = apply_inverse(change)
+            w = apply_inverse_transpose(step)
+            denominator = w.dot(change)
+            if denominator != 0:
+                updates.append(((step - inverse_change) / denominator, w))
+
+            X, residual, norm = new_X, new_residual, new_norm
+
+        return optimize.OptimizeResult(x=X, fun=residual, success=success,
+                                       status=status, message=message,
+                                       nit=nit, nfev=nfev)
+
+    def solve_distances(self, city, distances, tol=1e-10, options=None):
+        """
+        Solve for the equilibrium after the physical distances between a
+        single city and every other city change.
+
+        Parameters
+        ----------
+        city : int
+            Index of the city whose physical distances change.
+        distances : numpy.ndarray (shape=(N,))
+            New physical distances between the city and every city (the
+            distance between the city and itself should be zero).
+        tol : float (default=1e-10)
+            Iteration stops once the largest absolute value of the model
+            residual is less than tol.
+        options : dict (default=None)
+            Dictionary of options. May specify maxiter (default 50) and
+            max_backtracks (default 10).
+
+        Returns
+        -------
+        result : scipy.optimize.OptimizeResult
+            Result with the counterfactual equilibrium, the model residual, a
+            success flag, and the number of iterations and function
+            evaluations.
+
+        Notes
+        -----
+        The change in the physical distances is a rank two update of the
+        baseline distances. The first iteration is a Newton step using the
+        factorized baseline Jacobian and later iterations correct the
+        Jacobian using rank one Broyden updates.
+
+        """
+        city = self._validate_city(city)
+        distances = np.asarray(distances, dtype=np.float64)
+        if distances.shape != (self.model.number_cities,):
+            mesg = "Distances must have shape {}, not {}."
+            raise ValueError(mesg.format((self.model.number_cities,),
+                                         distances.shape))
+
+        physical_distances = self._physical_distances
+        physical_distances[city, :] = distances
+        physical_distances[:, city] = distances
+        self._update_counterfactual_model(self._population, physical_distances)
+
+        return self._solve(tol=tol, options=options)
+
+    def solve_population(self, city, population, tol=1e-10, options=None):
+        """
+        Solve for the equilibrium after the population of a single city
+        changes.
+
+        Parameters
+        ----------
+        city : int
+            Index of the city whose population changes.
+        population : float
+            New population of the city.
+        tol : float (default=1e-10)
+            Iteration stops once the largest absolute value of the model
+            residual is less than tol.
+        options : dict (default=None)
+            Dictionary of options. May specify maxiter (default 50) and
+            max_backtracks (default 10).
+
+        Returns
+        -------
+        result : scipy.optimize.OptimizeResult
+            Result with the counterfactual equilibrium, the model residual, a
+            success flag, and the number of iterations and function
+            evaluations.
+
+        Notes
+        -----
+        Population only enters the Jacobian through the derivative of the
+        city's resource constraint with respect to its nominal wage. The
+        Jacobian of the counterfactual model is therefore a rank one update
+        of the baseline Jacobian whose inverse is applied exactly using the
+        Sherman-Morrison formula.
+
+        """
+        city = self._validate_city(city)
+        N = self.model.number_cities
+
+        counterfactual_population = self._population
+        change = population - counterfactual_population[city]
+        counterfactual_population[city] = population
+
+        self._update_counterfactual_model(counterfactual_population)
+
+        # d(Y - beta * L * W) / dW changes by -beta * change
+        row, col = 3 * N - 1 + city, 2 * N - 1 + city
+        scale = -self.model.params['beta'] * change
+        unit_vectors = np.zeros((2, 4 * N - 1))
+        unit_vectors[0, row] = unit_vectors[1, col] = 1.0
+        column = linalg.lu_solve(self._factorization, unit_vectors[0])
+        row_of_inverse = linalg.lu_solve(self._factorization, unit_vectors[1],
+                                         trans=1)
+        u = -scale * column / (1 + scale * column[col])
+
+        return self._solve([(u, row_of_inverse)], tol, options)
@@ -0,0 +1,457 @@
+"""
+Storage for large matrices of pairwise distances between cities, either
+memory-mapped or in condensed (triangular) form.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import numpy as np
+
+
+class DistanceStore(object):
+
+    _block_size = 1024
+
+    _valid_dtypes = [np.dtype('float32'), np.dtype('float64')]
+
+    def __init__(self, path, mode='r'):
+        """
+        Create an instance of the DistanceStore class.
+
+        Parameters
+        ----------
+        path : str
+            Path to a .npy file containing a square array of pairwise
+            measures of physical distance between cities.
+        mode : str (default='r')
+            Mode used to memory-map the file. Must be one of 'r' (read only),
+            'r+' (read and write), or 'c' (copy on write).
+
+        """
+        self.path = path
+        self._array = np.load(path, mmap_mode=mode)
+
+    def __getitem__(self, key):
+        """Return a (memory-mapped) view of some of the distances."""
+        return np.asarray(self._array[key])
+
+    def __setitem__(self, key, value):
+        """Write some of the distances."""
+        self._array[key] = value
+
+    @property
+    def block_size(self):
+        """
+        Number of rows of distances returned by each block of row_blocks.
+
+        :getter: Return the current block size.
+        :setter: Set a new block size.
+        :type: int
+
+        """
+        return self._block_size
+
+    @block_size.setter
+    def block_size(self, value):
+        """Set a new block size."""
+        self._block_size = self._validate_block_size(value)
+
+    @property
+    def dtype(self):
+        """
+        Data type used to store the distances.
+
+        :getter: Return the current data type.
+        :type: numpy.dtype
+
+        """
+        return self._array.dtype
+
+    @property
+    def shape(self):
+        """
+        Shape of the stored array of distances.
+
+        :getter: Return the current shape.
+        :type: tuple
+
+        """
+        return self._array.shape
+
+    @classmethod
+    def _validate_block_size(cls, value):
+        """Validate the block_size attribute."""
+        if not isinstance(value, int):
+            mesg = "DistanceStore.block_size attribute must have type int, not {}"
+            raise AttributeError(mesg.format(value.__class__))
+        elif value < 1:
+            mesg = ("DistanceStore.block_size attribute must be greater " +
+                    "than or equal to 1.")
+            raise AttributeError(mesg)
+        else:
+            return value
+
+    @classmethod
+    def _validate_dtype(cls, value):
+        """Validate the dtype of a new store."""
+        dtype = np.dtype(value)
+        if dtype not in cls._valid_dtypes:
+            mesg = "DistanceStore dtype must be one of {}, not {}"
+            raise AttributeError(mesg.format(cls._valid_dtypes, dtype))
+        else:
+            return dtype
+
+    @classmethod
+    def create(cls, path, number_cities, dtype='float64'):
+        """
+        Create a new (zero-filled) store on disk.
+
+        Parameters
+        ----------
+        path : str
+            Path of the .npy file to create.
+        number_cities : int
+            Number of cities.
+        dtype : str (default='float64')
+            Data type used to store the distances. Must be one of 'float32'
+            or 'float64'.
+
+        Returns
+        -------
+        store : DistanceStore
+            Writeable store. Blocks of distances can be written using
+            slice assignment (i.e., store[i:j, :] = block).
+
+        """
+        array = np.lib.format.open_memmap(path, mode='w+',
+                                          dtype=cls._validate_dtype(dtype),
+                                          shape=(number_cities, number_cities))
+        del array  # flush the header and data to disk
+        return cls(path, mode='r+')
+
+    @classmethod
+    def from_array(cls, path, array, dtype='float64'):
+        """
+        Create a new store on disk containing some array of distances.
+
+        Parameters
+        ----------
+        path : str
+            Path of the .npy file to create.
+        array : numpy.ndarray (shape=(N,N))
+            Square array of pairwise distances.
+        dtype : str (default='float64')
+            Data type used to store the distances.
+
+        Returns
+        -------
+        store : DistanceStore
+
+        """
+        store = cls.create(path, array.shape[0], dtype)
+        for start in range(0, array.shape[0], store.block_size):
+            stop = start + store.block_size
+            store[start:stop] = array[start:stop]
+        store.flush()
+        return store
+
+    def flush(self):
+        """Write any changes to disk."""
+        self._array.flush()
+
+    def row_blocks(self, number_cities):
+        """
+        Iterate over blocks of rows of distances between the first
+        number_cities cities.
+
+        Parameters
+        ----------
+        number_cities : int
+            Number of cities.
+
+        Returns
+        -------
+        blocks : generator
+            Generator yielding a tuple (start, stop, distances) where
+            distances is a numpy.ndarray (shape=(stop-start, number_cities))
+            of double precision distances from cities start, ..., stop-1 to
+            each of the cities.
+
+        """
+        for start in range(0, number_cities, self.block_size):
+            stop = min(start + self.block_size, number_cities)
+            distances = np.asarray(self._array[start:stop, :number_cities],
+                                   dtype=np.float64)
+            yield start, stop, distances
+
+
+class CondensedDistances(object):
+
+    def __init__(self, distances):
+        """
+        Create an instance of the CondensedDistances class.
+
+        Parameters
+        ----------
+        distances : numpy.ndarray (shape=(N*(N-1)/2,))
+            Condensed array of pairwise measures of physical distance between
+            cities. The distance between cities i and j, with i > j, is
+            stored at index i*(i-1)/2 + j (i.e., the strictly lower triangle
+            of the square array is stored row by row).
+
+        Notes
+        -----
+        Unlike scipy.spatial.distance.pdist, this ordering does not depend on
+        the total number of cities: the distances between the first n cities
+        are always the first n*(n-1)/2 entries of the array.
+
+        """
+        self.distances = distances
+
+    def __getitem__(self, key):
+        """
+        Return some of the distances as a dense array.
+
+        Indexing works as for the equivalent square array: a pair of integers
+        returns a single distance, and slices or arrays of indices return the
+        corresponding rows and columns of the square array.
+
+        """
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        cities = np.arange(self.number_cities)
+        rows, cols = cities[rows], cities[cols]
+        if rows.ndim > 0 and cols.ndim > 0:
+            rows = rows[:, np.newaxis]
+        return self.lookup(rows, cols)
+
+    @property
+    def distances(self):
+        """
+        Condensed array of pairwise distances between cities.
+
+        :getter: Return the current condensed array.
+        :setter: Set a new condensed array.
+        :type: numpy.ndarray
+
+        """
+        return self._distances
+
+    @distances.setter
+    def distances(self, value):
+        """Set a new condensed array."""
+        self._distances = self._validate_distances(value)
+
+    @property
+    def dtype(self):
+        """
+        Data type used to store the distances.
+
+        :getter: Return the current data type.
+        :type: numpy.dtype
+
+        """
+        return self._distances.dtype
+
+    @property
+    def number_cities(self):
+        """
+        Number of cities.
+
+        :getter: Return the current number of cities.
+        :type: int
+
+        """
+        return self.compute_number_cities(self._distances.shape[-1])
+
+    @property
+    def shape(self):
+        """
+        Shape of the equivalent square array of distances.
+
+        :getter: Return the current shape.
+        :type: tuple
+
+        """
+        return (self.number_cities, self.number_cities)
+
+    @staticmethod
+    def compute_number_cities(size):
+        """Compute the number of cities given the size of a condensed array."""
+        return int(round((1 + np.sqrt(1 + 8 * size)) / 2))
+
+    @staticmethod
+    def compute_index(i, j):
+        """
+        Compute the index in a condensed array of the distance between cities
+        i and j.
+
+        Parameters
+        ----------
+        i, j : int or numpy.ndarray
+            Indices of two (distinct) cities.
+
+        Returns
+        -------
+        index : int or numpy.ndarray
+
+        """
+        i, j = np.maximum(i, j), np.minimum(i, j)
+        return i * (i - 1) // 2 + j
+
+    @classmethod
+    def _validate_distances(cls, value):
+        """Validate the distances attribute."""
+        if not isinstance(value, np.ndarray) or value.ndim != 1:
+            mesg = ("CondensedDistances.distances attribute must be a " +
+                    "one-dimensional numpy.ndarray.")
+            raise AttributeError(mesg)
+        N = cls.compute_number_cities(value.size)
+        if N * (N - 1) // 2 != value.size:
+            mesg = ("CondensedDistances.distances attribute has size {}, " +
+                    "which is not N*(N-1)/2 for any number of cities N.")
+            raise AttributeError(mesg.format(value.size))
+        else:
+            return value
+
+    @classmethod
+    def from_array(cls, array, dtype='float64'):
+        """
+        Create a condensed representation of a square array of distances.
+
+        Parameters
+        ----------
+        array : numpy.ndarray (shape=(N,N))
+            Square, symmetric array of pairwise distances with a zero
+            diagonal.
+        dtype : str (default='float64')
+            Data type used to store the distances. Must be one of 'float32'
+            or 'float64'.
+
+        Returns
+        -------
+        distances : CondensedDistances
+
+        """
+        dtype = DistanceStore._validate_dtype(dtype)
+        rows, cols = np.tril_indices(array.shape[0], -1)
+        return cls(np.asarray(array[rows, cols], dtype=dtype))
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """
+        Load a condensed array of distances from a .npy file.
+
+        Parameters
+        ----------
+        path : str
+            Path to a .npy file containing a condensed array of distances.
+        mmap_mode : str (default=None)
+            If not None, then the file is memory-mapped using the given mode
+            (see numpy.load).
+
+        Returns
+        -------
+        distances : CondensedDistances
+
+        """
+        return cls(np.load(path, mmap_mode=mmap_mode))
+
+    @classmethod
+    def squareform(cls, condensed, diagonal=0.0):
+        """
+        Expand (a stack of) condensed arrays into square arrays.
+
+        Parameters
+        ----------
+        condensed : numpy.ndarray (shape=(M,) or (K,M))
+            Condensed array(s) of length M = N*(N-1)/2.
+        diagonal : float or numpy.ndarray (default=0.0)
+            Value(s) to place on the diagonal of the square array(s).
+
+        Returns
+        -------
+        square : numpy.ndarray (shape=(N,N) or (K,N,N))
+            Symmetric square array(s).
+
+        """
+        N = cls.compute_number_cities(condensed.shape[-1])
+        square = np.empty(condensed.shape[:-1] + (N, N), dtype=condensed.dtype)
+        rows, cols = np.tril_indices(N, -1)
+        square[..., rows, cols] = condensed
+        square[..., cols, rows] = condensed
+        square[..., np.arange(N), np.arange(N)] = diagonal
+        return square
+
+    def condensed(self, number_cities):
+        """
+        Return the condensed array of distances between the first
+        number_cities cities.
+
+        Parameters
+        ----------
+        number_cities : int
+            Number of cities.
+
+        Returns
+        -------
+        distances : numpy.ndarray (shape=(number_cities*(number_cities-1)/2,))
+            Double precision condensed array of distances.
+
+        """
+        size = number_cities * (number_cities - 1) // 2
+        return np.asarray(self._distances[:size], dtype=np.float64)
+
+    def lookup(self, i, j):
+        """
+        Look up the distances between cities i and j.
+
+        Parameters
+        ----------
+        i, j : int or numpy.ndarray
+            Indices of cities. Arrays of indices are broadcast against one
+            another.
+
+        Returns
+        -------
+        distances : float or numpy.ndarray
+            Double precision distances between each pair of cities.
+
+        """
+        i, j = np.broadcast_arrays(i, j)
+        distances = np.zeros(i.shape)
+        off_diagonal = i != j
+        index = self.compute_index(i[off_diagonal], j[off_diagonal])
+        distances[off_diagonal] = self._distances[index]
+        return distances[()]
+
+    def row_blocks(self, number_cities, block_size=1024):
+        """
+        Iterate over blocks of rows of distances between the first
+        number_cities cities.
+
+        Parameters
+        ----------
+        number_cities : int
+            Number of cities.
+        block_size : int (default=1024)
+            Number of rows in each block.
+
+        Returns
+        -------
+        blocks : generator
+            Generator yielding a tuple (start, stop, distances) where
+            distances is a numpy.ndarray (shape=(stop-start, number_cities))
+            of double precision distances from cities start, ..., stop-1 to
+            each of the cities.
+
+        """
+        cities = np.arange(number_cities)
+        for start in range(0, number_cities, block_size):
+            stop = min(start + block_size, number_cities)
+            yield start, stop, self.lookup(cities[start:stop, np.newaxis],
+                                           cities)
+
+    def save(self, path):
+        """Save the condensed array of distances to a .npy file."""
+        np.save(path, self._distances)
@@ -0,0 +1,388 @@
+"""
+Persistent storage of converged model equilibria that are used as initial
+guesses for solving the model at nearby parameter values.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from scipy import spatial
+
+import solvers
+
+
+class EquilibriumStore(object):
+
+    __trees = None
+
+    _index_name = 'index.json'
+
+    _max_entries = 1000
+
+    def __init__(self, path, max_entries=1000):
+        """
+        Create an instance of the EquilibriumStore class.
+
+        Parameters
+        ----------
+        path : str
+            Path to a directory in which to keep the stored equilibria. The
+            directory is created if it does not exist.
+        max_entries : int (default=1000)
+            Maximum number of stored equilibria. Once the store is full,
+            saving a new equilibrium evicts the least recently used one.
+
+        Notes
+        -----
+        A store directory supports a single writer. The index is read once
+        when the store is created and every change (including the use of an
+        equilibrium by nearest) rewrites it, so several stores (e.g., in
+        different worker processes of a sweep or race) writing to the same
+        directory at once will overwrite each other's entries. Give each
+        writer its own directory.
+
+        """
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._index = self._load_index()
+        self.max_entries = max_entries
+
+    @property
+    def max_entries(self):
+        """
+        Maximum number of stored equilibria.
+
+        :getter: Return the current maximum number of equilibria.
+        :setter: Set a new maximum number of equilibria (evicting the least
+            recently used equilibria if necessary).
+        :type: int
+
+        """
+        return self._max_entries
+
+    @max_entries.setter
+    def max_entries(self, value):
+        """Set a new maximum number of equilibria."""
+        self._max_entries = self._validate_max_entries(value)
+        if self._evict():
+            self._save_index()
+
+    @property
+    def report(self):
+        """
+        Diagnostics for solves that used the store.
+
+        Lookups that find a stored equilibrium for the same model and data
+        are hits; all other lookups are misses and fall back to the islands
+        guess. Iteration savings are the difference between the average
+        number of function evaluations used by solves after a miss and after
+        a hit, multiplied by the number of hits.
+
+        :getter: Return a dictionary with the number of stored equilibria,
+            lookups, hits, and misses, the hit rate, the average number of
+            function evaluations after hits and misses, and the estimated
+            number of function evaluations saved.
+        :type: dict
+
+        """
+        stats = self._index['stats']
+        lookups = stats['hits'] + stats['misses']
+        hit_nfev = stats['hit_nfev'] / max(stats['hits'], 1)
+        miss_nfev = stats['miss_nfev'] / max(stats['misses'], 1)
+        if stats['hits'] > 0 and stats['misses'] > 0:
+            nfev_saved = stats['hits'] * (miss_nfev - hit_nfev)
+        else:
+            nfev_saved = None
+        return {'entries': len(self._index['entries']),
+                'lookups': lookups,
+                'hits': stats['hits'],
+                'misses': stats['misses'],
+                'hit_rate': stats['hits'] / float(max(lookups, 1)),
+                'hit_nfev': hit_nfev,
+                'miss_nfev': miss_nfev,
+                'nfev_saved': nfev_saved,
+                'evictions': stats['evictions']}
+
+    @staticmethod
+    def _data_hash(model):
+        """Hash of the model class, number of cities, and data."""
+        N = model.number_cities
+        digest = hashlib.sha1()
+        digest.update(model.__class__.__name__.encode())
+        digest.update(str(N).encode())
+        for array in [model.physical_distances, model.population[:N]]:
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def parameter_vector(model):
+        """
+        Vector of model parameters used to measure distances between stored
+        equilibria.
+
+        Parameters
+        ----------
+        model : models.Model
+            An instance of the models.Model class.
+
+        Returns
+        -------
+        params : numpy.ndarray (shape=(N+4,))
+            Array containing f, beta, phi, tau, and theta for each city.
+
+        """
+        N = model.number_cities
+        params = model.params
+        theta = params['theta']
+        theta = theta[:N] if np.ndim(theta) > 0 else np.repeat(theta, N)
+        return np.hstack((params['f'], params['beta'], params['phi'],
+                          params['tau'], theta))
+
+    def _entry_path(self, key):
+        """Path of the file containing a stored equilibrium."""
+        return os.path.join(self.path, key + '.npy')
+
+    def _evict(self):
+        """Evict least recently used equilibria until the store is not full."""
+        entries = self._index['entries']
+        evicted = sorted(entries, key=lambda key: entries[key]['last_used'])
+        evicted = evicted[:max(len(entries) - self.max_entries, 0)]
+        for key in evicted:
+            del entries[key]
+            if os.path.exists(self._entry_path(key)):
+                os.remove(self._entry_path(key))
+        self._index['stats']['evictions'] += len(evicted)
+        if evicted:
+            self.__trees = None
+        return len(evicted) > 0
+
+    def _key(self, group, params):
+        """Key of the equilibrium for some data and parameters."""
+        digest = hashlib.sha1(group.encode())
+        digest.update(np.ascontiguousarray(params, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def _load_index(self):
+        """Load the index of stored equilibria (or create an empty index)."""
+        path = os.path.join(self.path, self._index_name)
+        if os.path.exists(path):
+            with open(path) as index_file:
+                return json.load(index_file)
+        else:
+            return {'clock': 0,
+                    'entries': {},
+                    'stats': {'hits': 0, 'misses': 0, 'hit_nfev': 0,
+                              'miss_nfev': 0, 'evictions': 0}}
+
+    def _save_index(self):
+        """Atomically write the index of stored equilibria to disk."""
+        path = os.path.join(self.path, self._index_name)
+        with open(path + '.tmp', 'w') as index_file:
+            json.dump(self._index, index_file)
+        os.rename(path + '.tmp', path)
+
+    def _tree(self, group):
+        """KD-tree over log(1 + parameters) of the equilibria for some data."""
+        if self.__trees is None:
+            self.__trees = {}
+        if group not in self.__trees:
+            keys = [key for key, entry in self._index['entries'].items()
+                    if entry['group'] == group]
+            if keys:
+                points = [self._index['entries'][key]['params'] for key in keys]
+                tree = spatial.cKDTree(np.log1p(points))
+            else:
+                tree = None
+            self.__trees[group] = (keys, tree)
+        return self.__trees[group]
+
+    def _touch(self, key):
+        """Mark an equilibrium as the most recently used."""
+        self._index['clock'] += 1
+        self._index['entries'][key]['last_used'] = self._index['clock']
+
+    @classmethod
+    def _validate_max_entries(cls, value):
+        """Validate the max_entries attribute."""
+        if not isinstance(value, int):
+            mesg = ("EquilibriumStore.max_entries attribute must have type " +
+                    "int, not {}")
+            raise AttributeError(mesg.format(value.__class__))
+        elif value < 1:
+            mesg = ("EquilibriumStore.max_entries attribute must be greater " +
+                    "than or equal to 1.")
+            raise AttributeError(mesg)
+        else:
+            return value
+
+    def add(self, model, solution, nfev=None):
+        """
+        Store an equilibrium of the model at its current parameters.
+
+        Parameters
+        ----------
+        model : models.Model
+            An instance of the models.Model class.
+        solution : numpy.ndarray (shape=(4N-1,))
+            Array containing equilibrium values of the endogenous variables.
+        nfev : int (default=None)
+            Number of function evaluations used to find the equilibrium.
+
+        Raises
+        ------
+        ValueError
+            If any of the model parameters is negative or not finite.
+
+        """
+        group = self._data_hash(model)
+        params = self.parameter_vector(model)
+        if not (np.isfinite(params).all() and (params >= 0).all()):
+            mesg = "Stored parameters must be finite and non-negative, not {}"
+            raise ValueError(mesg.format(params))
+        key = self._key(group, params)
+
+        np.save(self._entry_path(key), np.asarray(solution, dtype=np.float64))
+        if key not in self._index['entries']:
+            self.__trees = None
+        self._index['entries'][key] = {'group': group,
+                                       'number_cities': model.number_cities,
+                                       'params': params.tolist(),
+                                       'nfev': nfev,
+                                       'last_used': 0}
+        self._touch(key)
+        self._evict()
+        self._save_index()
+
+    def clear(self):
+        """Remove all stored equilibria (and reset the diagnostics)."""
+        for key in self._index['entries']:
+            if os.path.exists(self._entry_path(key)):
+                os.remove(self._entry_path(key))
+        if os.path.exists(os.path.join(self.path, self._index_name)):
+            os.remove(os.path.join(self.path, self._index_name))
+        self._index = self._load_index()
+        self.__trees = None
+
+    def nearest(self, model):
+        """
+        Find the stored equilibrium nearest to the model's current parameters.
+
+        Only equilibria of the same model class with the same number of
+        cities, physical distances, and population are considered. Distance
+        between parameter vectors is measured using log(1 + param), so that
+        large parameters are compared in relative terms while parameters
+        equal to zero (e.g., tau=0 for free trade) remain finite.
+
+        Parameters
+        ----------
+        model : models.Model
+            An instance of the models.Model class.
+
+        Returns
+        -------
+        solution, distance : tuple
+            Stored equilibrium and the distance between its parameters and
+            those of the model. If no equilibrium has been stored for the
+            model and its data, then (None, inf).
+
+        """
+        keys, tree = self._tree(self._data_hash(model))
+        if tree is None:
+            return None, np.inf
+
+        distance, i = tree.query(np.log1p(self.parameter_vector(model)))
+        self._touch(keys[i])
+        self._save_index()
+        return np.load(self._entry_path(keys[i])), distance
+
+    def solve(self, solver, **solver_kwargs):
+        """
+        Solve the model using the nearest stored equilibrium as the initial
+        guess and store the result.
+
+        Parameters
+        ----------
+        solver : solvers.Solver
+            An instance of the solvers.Solver class.
+        solver_kwargs : dict
+            Additional keyword arguments passed to Solver.solve.
+
+        Returns
+        -------
+        result : scipy.optimize.OptimizeResult
+            Result returned by Solver.solve. Converged solutions are added
+            to the store.
+
+        """
+        initial_guess = StoreGuess(solver.model, self)
+        result = solver.solve(initial_guess.guess, **solver_kwargs)
+
+        stats = self._index['stats']
+        nfev = int(result.get('nfev', 0))
+        if initial_guess.hit:
+            stats['hits'] += 1
+            stats['hit_nfev'] += nfev
+        else:
+            stats['misses'] += 1
+            stats['miss_nfev'] += nfev
+
+        if result.success:
+            self.add(solver.model, result.x, nfev)
+        else:
+            self._save_index()
+        return result
+
+
+class StoreGuess(solvers.InitialGuess):
+
+    __hit = False
+
+    def __init__(self, model, store):
+        """
+        Create an instance of the StoreGuess class.
+
+        Parameters
+        ----------
+        model : models.Model
+            An instance of the models.Model class.
+        store : EquilibriumStore
+            Store in which to look for an equilibrium of the model.
+
+        """
+        super(StoreGuess, self).__init__(model)
+        self.store = store
+
+    @property
+    def guess(self):
+        """
+        The initial guess for the model equilibrium is the stored
+        equilibrium nearest to the model's current parameters (or the
+        analytic "island" solution if there is no such equilibrium).
+
+        :getter: Return current initial guess.
+        :type: numpy.ndarray
+
+        """
+        solution, _ = self.store.nearest(self.model)
+        self.__hit = solution is not None
+        if solution is None:
+            solution = solvers.IslandsGuess(self.model).guess
+        return solution
+
+    @property
+    def hit(self):
+        """
+        Whether the most recent guess came from the store.
+
+        :getter: Return True if the most recent guess was a stored
+            equilibrium, False otherwise.
+        :type: boolean
+
+        """
+        return self.__hit
@@ -0,0 +1,351 @@
+"""
+Process-wide registry of compiled functions used for numeric evaluation of
+the model.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import collections
+import glob
+import hashlib
+import importlib.machinery
+import importlib.util
+import inspect
+import json
+import os
+
+import numpy as np
+import sympy as sym
+from sympy.utilities import autowrap
+
+
+KernelInfo = collections.namedtuple('KernelInfo',
+                                    ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class KernelRegistry(object):
+
+    def __init__(self, maxsize=32):
+        """
+        Create an instance of the KernelRegistry class.
+
+        Parameters
+        ----------
+        maxsize : int (default=32)
+            Maximum number of kernels to store. Once this many kernels have
+            been stored the least recently used kernel is evicted.
+
+        """
+        self._kernels = collections.OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        """
+        Maximum number of kernels stored in the registry.
+
+        :getter: Return the current maximum size.
+        :setter: Set a new maximum size.
+        :type: int
+
+        """
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, value):
+        """Set a new maximum size."""
+        self._maxsize = self._validate_maxsize(value)
+        self._evict()
+
+    @classmethod
+    def _validate_maxsize(cls, value):
+        """Validate the maxsize attribute."""
+        if not isinstance(value, int):
+            mesg = "KernelRegistry.maxsize attribute must have type int, not {}"
+            raise AttributeError(mesg.format(value.__class__))
+        elif value < 1:
+            mesg = ("KernelRegistry.maxsize attribute must be greater than " +
+                    "or equal to 1.")
+            raise AttributeError(mesg)
+        else:
+            return value
+
+    def _evict(self):
+        """Evict least recently used kernels until registry is not too big."""
+        while len(self._kernels) > self.maxsize:
+            self._kernels.popitem(last=False)
+
+    def clear(self):
+        """Remove all kernels and reset the hit/miss statistics."""
+        self._kernels.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """
+        Return the kernel stored under some key, building it if necessary.
+
+        Parameters
+        ----------
+        key : tuple
+            Hashable key identifying the kernel.
+        build : function
+            Function of no arguments that returns the kernel. Only called if
+            the kernel is not already in the registry.
+
+        Returns
+        -------
+        kernel : function
+            The compiled kernel.
+
+        """
+        if key in self._kernels:
+            self.hits += 1
+            kernel = self._kernels.pop(key)
+        else:
+            self.misses += 1
+            kernel = build()
+        self._kernels[key] = kernel
+        self._evict()
+        return kernel
+
+    def info(self):
+        """
+        Return the hit/miss statistics for the registry.
+
+        Returns
+        -------
+        info : KernelInfo
+            Named tuple with hits, misses, maxsize and currsize fields.
+
+        """
+        return KernelInfo(self.hits, self.misses, self.maxsize,
+                          len(self._kernels))
+
+
+def model_key(model, name):
+    """
+    Key identifying a kernel for a particular model.
+
+    The symbolic equations depend on the model class, the number of cities,
+    and (through the economic distances) on the physical distances, but not
+    on the values of the parameters or the population, which are passed as
+    arguments to the compiled kernels.
+
+    Parameters
+    ----------
+    model : models.Model
+        An instance of the models.Model class.
+    name : str
+        Name of the kernel (i.e., 'system' or 'jacobian').
+
+    Returns
+    -------
+    key : tuple
+
+    """
+    distances = np.ascontiguousarray(model.physical_distances)
+    digest = hashlib.sha1(distances.tobytes()).hexdigest()
+    return (name, model.__class__, model.number_cities, digest)
+
+
+class CompiledKernelCache(object):
+
+    _valid_backends = ['cython', 'f2py']
+
+    _variables = ['P', 'Y', 'W', 'M', 'L', 'theta']
+
+    def __init__(self, cache_dir, backend='cython'):
+        """
+        Create an instance of the CompiledKernelCache class.
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory in which to store the generated extension modules.
+        backend : str (default='cython')
+            Backend used by sympy.utilities.autowrap to compile the generated
+            code. Must be one of 'cython' (C code) or 'f2py' (Fortran code).
+
+        """
+        self.cache_dir = cache_dir
+        self.backend = backend
+
+    @property
+    def backend(self):
+        """
+        Backend used to compile the generated code.
+
+        :getter: Return the current backend.
+        :setter: Set a new backend.
+        :type: str
+
+        """
+        return self._backend
+
+    @backend.setter
+    def backend(self, value):
+        """Set a new backend."""
+        self._backend = self._validate_backend(value)
+
+    @classmethod
+    def _validate_backend(cls, value):
+        """Validate the backend attribute."""
+        if value not in cls._valid_backends:
+            mesg = ("CompiledKernelCache.backend attribute must be one of " +
+                    "{}, not {}")
+            raise AttributeError(mesg.format(cls._valid_backends, value))
+        else:
+            return value
+
+    @staticmethod
+    def _names(function, kernel_dir):
+        """
+        Names of a compiled function and of its extension module.
+
+        Functions compiled using Cython know their name and module. The
+        fortran objects returned by f2py have names of the form 'function
+        autofunc' and no module, in which case the module name is taken
+        from the newest extension module in the kernel directory.
+
+        """
+        name = function.__name__.split()[-1]
+        if hasattr(function, '__module__'):
+            return name, function.__module__
+        extensions = [path for path in glob.glob(os.path.join(kernel_dir, '*'))
+                      if path.endswith(('.so', '.pyd'))]
+        newest = max(extensions, key=os.path.getmtime)
+        return name, os.path.basename(newest).split('.')[0]
+
+    def _kernel_dir(self, model, name):
+        """Directory in which the compiled kernel is stored."""
+        return os.path.join(self.cache_dir, self._kernel_digest(model, name))
+
+    def _kernel_digest(self, model, name):
+        """
+        Digest identifying the generated equations for a model.
+
+        The equations are fully determined by the source code of the model
+        class (and its parents), the number of cities, the physical distances,
+        and the version of SymPy used to generate the code. Hashing these
+        identifies the equations without having to build them.
+
+        """
+        sha = hashlib.sha1()
+        for cls in inspect.getmro(model.__class__):
+            if cls is not object:
+                sha.update(inspect.getsource(cls).encode('utf-8'))
+        key = (name, self.backend, sym.__version__, model.__class__.__name__,
+               model.number_cities)
+        sha.update(repr(key).encode('utf-8'))
+        sha.update(np.ascontiguousarray(model.physical_distances).tobytes())
+        return sha.hexdigest()
+
+    def _compile(self, model, name, expr, kernel_dir):
+        """Generate, compile, and store the native code for an expression."""
+        N = model.number_cities
+        args = [sym.MatrixSymbol(var, N, 1) for var in self._variables]
+        replacements = {}
+        for arg in args:
+            for i in range(N):
+                replacements[sym.Symbol('{}[{}]'.format(arg.name, i))] = arg[i, 0]
+        f, beta, phi, tau = sym.symbols('f, beta, phi, tau')
+        args = args[:5] + [f, beta, phi, tau] + args[5:]
+
+        out = sym.MatrixSymbol('out', expr.shape[0], expr.shape[1])
+        function = autowrap.autowrap(sym.Eq(out, expr.xreplace(replacements)),
+                                     language=None,
+                                     backend=self.backend,
+                                     tempdir=kernel_dir,
+                                     args=args)
+
+        # record information needed by other processes to load the kernel
+        # (written last, and atomically, once the extension module exists)
+        function_name, module_name = self._names(function, kernel_dir)
+        metadata = {'function': function_name,
+                    'module': module_name,
+                    'name': name,
+                    'number_cities': N,
+                    'model': model.__class__.__name__}
+        path = os.path.join(kernel_dir, 'kernel.json')
+        with open(path + '.tmp', 'w') as kernel_file:
+            json.dump(metadata, kernel_file)
+        os.rename(path + '.tmp', path)
+
+        return function
+
+    @staticmethod
+    def _load(kernel_dir):
+        """
+        Load a previously compiled kernel from disk (or return None if the
+        kernel has not been completely built, e.g. after an interrupted or
+        concurrent build).
+
+        """
+        path = os.path.join(kernel_dir, 'kernel.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as kernel_file:
+            metadata = json.load(kernel_file)
+        pattern = os.path.join(kernel_dir, metadata['module'] + '*')
+        extensions = [path for path in glob.glob(pattern)
+                      if path.endswith(('.so', '.pyd'))]
+        if not extensions:
+            return None
+        loader = importlib.machinery.ExtensionFileLoader(metadata['module'],
+                                                         extensions[0])
+        spec = importlib.util.spec_from_loader(metadata['module'], loader)
+        module = importlib.util.module_from_spec(spec)
+        loader.exec_module(module)
+        return getattr(module, metadata['function'])
+
+    def get(self, model, name, build):
+        """
+        Return the compiled kernel for a model, compiling it if necessary.
+
+        Parameters
+        ----------
+        model : models.Model
+            An instance of the models.Model class.
+        name : str
+            Name of the kernel (i.e., 'system' or 'jacobian').
+        build : function
+            Function of no arguments returning the symbolic expression (a
+            sympy.Matrix) to compile. Only called if the kernel is not
+            already on disk.
+
+        Returns
+        -------
+        kernel : function
+            Function with the same call signature as the function obtained by
+            lambdifying the symbolic expression.
+
+        """
+        kernel_dir = self._kernel_dir(model, name)
+        function = self._load(kernel_dir)
+        if function is None:
+            if not os.path.isdir(kernel_dir):
+                os.makedirs(kernel_dir)
+            function = self._compile(model, name, build(), kernel_dir)
+
+        N = model.number_cities
+
+        def kernel(P, Y, W, M, L, f, beta, phi, tau, theta):
+            """Evaluate the compiled kernel."""
+            P, Y, W, M, L, theta = (np.asarray(arg, dtype=float)[:N].reshape(N, 1)
+                                    for arg in (P, Y, W, M, L, theta))
+            return function(P, Y, W, M, L, f, beta, phi, tau, theta)
+
+        return kernel
+
+
+# kernels are shared by all models and solvers in a process
+registry = KernelRegistry()
+
+# compiled kernels are shared by all processes using the same cache directory
+compiled_kernels = CompiledKernelCache(os.path.join(os.path.expanduser('~'),
+                                                    '.wealth_of_cities',
+                                                    'kernels'))
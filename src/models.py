@@ -6,8 +6,11 @@ Main classes representing the model.
 
 """
 import numpy as np
+from scipy import sparse
 import sympy as sym
 
+import distance_store
+
 # define parameters
 f, beta, phi, tau = sym.var('f, beta, phi, tau')
 elasticity_substitution = sym.DeferredVector('theta')
@@ -23,10 +26,22 @@ num_firms = sym.DeferredVector('M')
 class Model(object):
 
     # initialize the cached values
+    __dense_distances = None
+    __economic_distances = None
+    __economic_distances_tau = None
+    __log_economic_distances = None
+    __pairwise_inputs = None
+    __pairwise_terms = None
+    __price_quantities = None
     __symbolic_equations = None
     __symbolic_jacobian = None
     __symbolic_system = None
     __symbolic_variables = None
+    __trade_pairs = None
+
+    _trade_network = None
+
+    _parameter_names = ['f', 'beta', 'phi', 'tau', 'L', 'theta']
 
     def __init__(self, params, physical_distances, population):
         """
@@ -36,12 +51,25 @@ class Model(object):
         ----------
         params : dict
             Dictionary of model parameters.
-        physical_distances : numpy.ndarray (shape=(N,N))
+        physical_distances : numpy.ndarray (shape=(N,N)), DistanceStore, or
+                             CondensedDistances
             Square array of pairwise measures pf physical distance between
-            cities.
+            cities. If the distances are kept in a memory-mapped
+            distance_store.DistanceStore or in a condensed
+            distance_store.CondensedDistances, then the model residual and
+            Jacobian are computed one block of rows at a time (looking up
+            condensed distances directly rather than expanding them into a
+            square array).
         population : numpy.ndarray (shape=(N,))
             Array of total population for each city.
 
+        Notes
+        -----
+        Instances are not thread-safe: economic distances and pairwise terms
+        for the most recent inputs are cached on the instance. Use a separate
+        instance in each thread (processes, as used by sweeps.sweep, each get
+        their own copy).
+
         """
         self.params = params
         self.physical_distances = physical_distances
@@ -123,6 +151,92 @@ class Model(object):
             self.__symbolic_variables = variables
         return self.__symbolic_variables
 
+    def _extend_cache(self, number_cities):
+        """
+        Extend the cached equations and Jacobian for some smaller number of
+        cities to the current number of cities.
+
+        Terms involving the new cities are appended to the existing equations
+        (and their derivatives are added to the existing Jacobian) so that the
+        symbolic work already done for the smaller system is not repeated.
+        Numeric kernels lambdified from the equations are not extended.
+
+        """
+        equations = self.__symbolic_equations
+        jacobian = self.__symbolic_jacobian
+        price_quantities = self.__price_quantities
+
+        # pairwise prices and quantities do not depend on number of cities
+        self._clear_cache()
+        self.__price_quantities = price_quantities
+
+        if equations is not None:
+            equations, increments = self._extend_equations(equations,
+                                                           number_cities)
+            self.__symbolic_equations = equations
+
+            if jacobian is not None:
+                jacobian = self._extend_jacobian(jacobian, increments,
+                                                 number_cities)
+                self.__symbolic_jacobian = jacobian
+
+    def _extend_equations(self, equations, number_cities):
+        """Extend list of equations for some smaller number of cities."""
+        N, n = self.number_cities, number_cities
+        old_cities, new_cities = range(n), range(n, N)
+
+        goods = [self.total_exports(h, new_cities) - self.total_imports(h, new_cities)
+                 for h in range(1, n)]
+        profits = [self.total_revenue(h, new_cities) - self.total_variable_cost(h, new_cities)
+                   for h in old_cities]
+        labor = [-self.total_variable_labor_demand(h, new_cities)
+                 for h in old_cities]
+        resource = [sym.S.Zero for h in old_cities]
+
+        # increments are ordered in the same way as the old equations
+        increments = goods + profits + labor + resource
+        old_equations = [eqn + increment for eqn, increment in
+                         zip(equations, increments)]
+
+        extended_equations = (old_equations[:n-1] +
+                              [self.goods_market_clearing(h) for h in new_cities] +
+                              old_equations[n-1:2*n-1] +
+                              [self.total_profits(h) for h in new_cities] +
+                              old_equations[2*n-1:3*n-1] +
+                              [self.labor_market_clearing(h) for h in new_cities] +
+                              old_equations[3*n-1:] +
+                              [self.resource_constraint(h) for h in new_cities])
+
+        return extended_equations, increments
+
+    def _extend_jacobian(self, jacobian, increments, number_cities):
+        """Extend Jacobian matrix for some smaller number of cities."""
+        N, n = self.number_cities, number_cities
+        equations = self._symbolic_equations
+        columns = {var: j for j, var in enumerate(self._symbolic_variables)}
+
+        # equations and variables for the smaller system keep their order
+        index = np.hstack((np.arange(n-1), np.arange(n) + N - 1,
+                           np.arange(n) + 2 * N - 1, np.arange(n) + 3 * N - 1))
+
+        extended_jacobian = sym.zeros(4 * N - 1, 4 * N - 1)
+        for i in range(jacobian.rows):
+            for j in range(jacobian.cols):
+                if jacobian[i, j] != 0:
+                    extended_jacobian[index[i], index[j]] = jacobian[i, j]
+
+            # add derivatives of the terms involving the new cities
+            for var in increments[i].free_symbols & set(columns):
+                extended_jacobian[index[i], columns[var]] += increments[i].diff(var)
+
+        # derivatives of equations for the new cities
+        new_rows = sorted(set(range(4 * N - 1)) - set(index))
+        for i in new_rows:
+            for var in equations[i].free_symbols & set(columns):
+                extended_jacobian[i, columns[var]] = equations[i].diff(var)
+
+        return extended_jacobian
+
     @property
     def economic_distances(self):
         """
@@ -132,7 +246,7 @@ class Model(object):
         :type: sympy.Basic
 
         """
-        return np.exp(self.physical_distances)**tau
+        return self.compute_economic_distances(tau)
 
     @property
     def number_cities(self):
@@ -149,21 +263,37 @@ class Model(object):
     @number_cities.setter
     def number_cities(self, value):
         """Set a new number of cities."""
+        previous_value = getattr(self, '_number_cities', None)
         self._number_cities = self._validate_number_cities(value)
 
-        # don't forget to clear cache!
-        self._clear_cache()
+        # extend cache when adding cities, otherwise don't forget to clear it!
+        if previous_value is not None and self._number_cities > previous_value:
+            self._extend_cache(previous_value)
+        else:
+            self._clear_cache()
 
     @property
     def physical_distances(self):
         """
         Square array of pairwise measures pf physical distance between cities.
 
+        If the distances are kept in a distance_store.CondensedDistances, then
+        the (read-only) square array is built once for the current number of
+        cities and cached. The residual and Jacobian never need it.
+
         :getter: Return the current array of physical distances.
         :setter: Set a new array of physical distances.
         :type: numpy.ndarray
 
         """
+        if isinstance(self._physical_distances,
+                      distance_store.CondensedDistances):
+            if self.__dense_distances is None:
+                condensed = self._physical_distances.condensed(self.number_cities)
+                squareform = distance_store.CondensedDistances.squareform
+                self.__dense_distances = squareform(condensed, 0.0)
+                self.__dense_distances.flags.writeable = False
+            return self.__dense_distances
         return self._physical_distances[:self.number_cities, :self.number_cities]
 
     @physical_distances.setter
@@ -171,6 +301,32 @@ class Model(object):
         """Set a new array of physical distances."""
         self._physical_distances = array
 
+        # don't forget to clear cache!
+        self._clear_cache()
+
+    @property
+    def trade_network(self):
+        """
+        Sparse matrix whose non-zero (h, j) entries are the pairs of cities
+        that trade with one another when computing the sparse residual and
+        Jacobian (see compute_trade_network).
+
+        :getter: Return the current trade network (None if all pairs of
+            cities trade).
+        :setter: Set a new trade network.
+        :type: scipy.sparse.csr_matrix
+
+        """
+        return self._trade_network
+
+    @trade_network.setter
+    def trade_network(self, value):
+        """Set a new trade network."""
+        self._trade_network = self._validate_trade_network(value)
+
+        # don't forget to clear cache!
+        self.__trade_pairs = None
+
     @property
     def params(self):
         """
@@ -188,12 +344,27 @@ class Model(object):
         """Set a new parameter dictionary."""
         self._params = self._validate_params(value)
 
+    def _partners(self, partners):
+        """Trading partners over which to sum (defaults to all cities)."""
+        if partners is None:
+            return range(self.number_cities)
+        else:
+            return partners
+
     def _clear_cache(self):
         """Clear all cached values."""
+        self.__dense_distances = None
+        self.__economic_distances = None
+        self.__economic_distances_tau = None
+        self.__log_economic_distances = None
+        self.__pairwise_inputs = None
+        self.__pairwise_terms = None
+        self.__price_quantities = None
         self.__symbolic_equations = None
         self.__symbolic_jacobian = None
         self.__symbolic_system = None
         self.__symbolic_variables = None
+        self.__trade_pairs = None
 
     @classmethod
     def _validate_number_cities(cls, value):
@@ -208,6 +379,21 @@ class Model(object):
         else:
             return value
 
+    @classmethod
+    def _validate_trade_network(cls, value):
+        """Validate the trade_network attribute."""
+        if value is None:
+            return value
+        elif not sparse.issparse(value):
+            mesg = ("Model.trade_network attribute must be a scipy.sparse " +
+                    "matrix, not {}")
+            raise AttributeError(mesg.format(value.__class__))
+        elif value.shape[0] != value.shape[1]:
+            mesg = "Model.trade_network attribute must be a square matrix."
+            raise AttributeError(mesg)
+        else:
+            return sparse.csr_matrix(value)
+
     @classmethod
     def _validate_params(cls, params):
         """Validate params attribute."""
@@ -221,6 +407,1122 @@ class Model(object):
         else:
             return params
 
+    def compute_economic_distances(self, tau):
+        """
+        Compute the square matrix of pairwise economic distances between
+        cities given a value for the iceberg trade cost parameter.
+
+        Parameters
+        ----------
+        tau : float, numpy.ndarray (shape=(K,)), or sympy.Symbol
+            Iceberg trade cost parameter. If tau is an array, then one matrix
+            of economic distances is computed for each value.
+
+        Returns
+        -------
+        economic_distances : numpy.ndarray (shape=(N,N) or (K,N,N))
+            Square array of pairwise economic distances.
+
+        Notes
+        -----
+        The matrix is cached (along with its logarithm) and is only
+        recomputed when the value of tau, the number of cities, or the
+        physical distances change.
+
+        """
+        self._update_economic_distances(tau)
+        return self.__economic_distances
+
+    def compute_log_economic_distances(self, tau):
+        """
+        Compute the square matrix of the logarithm of pairwise economic
+        distances between cities given a value for the iceberg trade cost
+        parameter.
+
+        Parameters
+        ----------
+        tau : float, numpy.ndarray (shape=(K,)), or sympy.Symbol
+            Iceberg trade cost parameter.
+
+        Returns
+        -------
+        log_economic_distances : numpy.ndarray (shape=(N,N) or (K,N,N))
+            Square array of log economic distances.
+
+        """
+        self._update_economic_distances(tau)
+        return self.__log_economic_distances
+
+    def _update_economic_distances(self, tau):
+        """Recompute the cached economic distances if tau has changed."""
+        if self.__economic_distances is None or not self._is_cached_tau(tau):
+            if isinstance(tau, sym.Basic):
+                log_distances = tau * self.physical_distances
+                economic_distances = np.exp(self.physical_distances)**tau
+            elif isinstance(self._physical_distances,
+                            distance_store.CondensedDistances):
+                tau = np.copy(tau)
+                condensed = self._physical_distances.condensed(self.number_cities)
+                log_condensed = self._batch(tau, 1) * condensed
+                squareform = distance_store.CondensedDistances.squareform
+                log_distances = squareform(log_condensed, 0.0)
+                economic_distances = squareform(np.exp(log_condensed), 1.0)
+            else:
+                tau = np.copy(tau)
+                log_distances = self._batch(tau, 2) * self.physical_distances
+                economic_distances = np.exp(log_distances)
+            self.__log_economic_distances = log_distances
+            self.__economic_distances = economic_distances
+            self.__economic_distances_tau = tau
+
+    def _is_cached_tau(self, tau):
+        """Check whether tau matches the value used for the cached distances."""
+        cached_tau = self.__economic_distances_tau
+        if isinstance(tau, sym.Basic) or isinstance(cached_tau, sym.Basic):
+            return (isinstance(tau, sym.Basic) and
+                    isinstance(cached_tau, sym.Basic) and tau == cached_tau)
+        else:
+            return np.array_equal(tau, cached_tau)
+
+    @staticmethod
+    def _batch(param, ndim):
+        """Append ndim axes to a (possibly stacked) parameter for broadcasting."""
+        return np.asarray(param)[(Ellipsis,) + ndim * (np.newaxis,)]
+
+    @staticmethod
+    def _add_to_diag(block, values):
+        """Add (stacked) values to the diagonal of a (stacked) square block."""
+        diagonal = np.arange(block.shape[-1])
+        block[..., diagonal, diagonal] += values
+
+    def compute_optimal_prices(self, nominal_wage, phi, tau, theta):
+        """
+        Compute the optimal price of each good j sold in each city h.
+
+        Parameters
+        ----------
+        nominal_wage : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal wage in each city.
+        phi : float or numpy.ndarray (shape=(K,))
+            Labor productivity parameter.
+        tau : float or numpy.ndarray (shape=(K,))
+            Iceberg trade cost parameter.
+        theta : numpy.ndarray (shape=(N,) or (K,N))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        optimal_prices : numpy.ndarray (shape=(N,N) or (K,N,N))
+            Square array whose (h, j) entry is the optimal price of the good
+            produced in city h and sold in city j.
+
+        """
+        economic_distances = self.compute_economic_distances(tau)
+        mark_ups = theta / (theta - 1)
+        marginal_costs = (nominal_wage[..., np.newaxis] * economic_distances /
+                          self._batch(phi, 2))
+        return mark_ups[..., np.newaxis, :] * marginal_costs
+
+    @staticmethod
+    def compute_quantity_demands(prices, price_level, nominal_gdp, theta):
+        """
+        Compute the quantity demanded in city j of the good produced in city h.
+
+        Parameters
+        ----------
+        prices : numpy.ndarray (shape=(N,N) or (K,N,N))
+            Square array of optimal prices.
+        price_level : numpy.ndarray (shape=(N,) or (K,N))
+            Price level in each city.
+        nominal_gdp : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal GDP in each city.
+        theta : numpy.ndarray (shape=(N,) or (K,N))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        quantity_demands : numpy.ndarray (shape=(N,N) or (K,N,N))
+            Square array of quantity demands.
+
+        """
+        price_level = price_level[..., np.newaxis, :]
+        relative_prices = prices / price_level
+        real_gdp = nominal_gdp[..., np.newaxis, :] / price_level
+        return relative_prices**(-theta[..., np.newaxis, :]) * real_gdp
+
+    def _compute_pairwise_terms(self, P, Y, W, phi, tau, theta):
+        """
+        Compute square arrays of revenues and variable labor demands.
+
+        The arrays for the most recent inputs are cached so that evaluating
+        the residual and the Jacobian at the same point computes each
+        pairwise term only once. The cache is shared mutable state, so a
+        Model instance must not be used by several threads at once.
+
+        """
+        inputs = (P, Y, W, phi, tau, theta)
+        if (self.__pairwise_inputs is None or
+                not all(np.array_equal(new, old) for new, old in
+                        zip(inputs, self.__pairwise_inputs))):
+            if self._streams_distances():
+                blocks = list(self._pairwise_blocks(P, Y, W, phi, tau, theta))
+                revenues = np.concatenate([block[2] for block in blocks],
+                                          axis=-2)
+                labor_demands = np.concatenate([block[3] for block in blocks],
+                                               axis=-2)
+            else:
+                prices = self.compute_optimal_prices(W, phi, tau, theta)
+                quantities = self.compute_quantity_demands(prices, P, Y, theta)
+                revenues = prices * quantities
+                labor_demands = (quantities *
+                                 self.compute_economic_distances(tau) /
+                                 self._batch(phi, 2))
+            self.__pairwise_inputs = tuple(np.copy(arg) for arg in inputs)
+            self.__pairwise_terms = (revenues, labor_demands)
+        return self.__pairwise_terms
+
+    def _pairwise_blocks(self, P, Y, W, phi, tau, theta):
+        """
+        Iterate over blocks of exporting cities, yielding a tuple (start,
+        stop, revenues, labor_demands) of the rows of the square arrays of
+        revenues and variable labor demands for cities start, ..., stop-1.
+
+        If the physical distances are kept in a DistanceStore or in condensed
+        form, then each block is computed from one block of rows of the
+        stored distances so that no (N,N) arrays are ever held in memory.
+        Otherwise there is a single block containing the (cached) square
+        arrays.
+
+        """
+        if self._streams_distances():
+            for start, stop, distances in self._distance_blocks():
+                revenues, labor_demands = self._compute_block_terms(
+                    distances, P, Y, W[..., start:stop], phi, tau, theta)
+                yield start, stop, revenues, labor_demands
+        else:
+            revenues, labor_demands = self._compute_pairwise_terms(P, Y, W, phi,
+                                                                   tau, theta)
+            yield 0, self.number_cities, revenues, labor_demands
+
+    def _streams_distances(self):
+        """Check whether pairwise terms are computed by blocks of rows."""
+        return isinstance(self._physical_distances,
+                          (distance_store.DistanceStore,
+                           distance_store.CondensedDistances))
+
+    def _compute_block_terms(self, distances, P, Y, W, phi, tau, theta):
+        """
+        Compute revenues and variable labor demands for a block of exporting
+        cities given the physical distances from those cities.
+
+        """
+        economic_distances = np.exp(self._batch(tau, 2) * distances)
+        mark_ups = theta / (theta - 1)
+        prices = (mark_ups[..., np.newaxis, :] * W[..., np.newaxis] *
+                  economic_distances / self._batch(phi, 2))
+        quantities = self.compute_quantity_demands(prices, P, Y, theta)
+        revenues = prices * quantities
+        labor_demands = quantities * economic_distances / self._batch(phi, 2)
+        return revenues, labor_demands
+
+    def _compute_totals(self, P, Y, W, M, phi, tau, theta):
+        """
+        Compute total revenues, variable labor demands, and imports for each
+        city.
+
+        The pairwise terms are summed one block of exporting cities at a time
+        (see _pairwise_blocks).
+
+        """
+        shape = np.broadcast(P, Y, W, M, theta, self._batch(phi, 1),
+                             self._batch(tau, 1)).shape
+        total_revenues = np.empty(shape)
+        total_variable_labor_demands = np.empty(shape)
+        total_imports = np.zeros(shape)
+
+        blocks = self._pairwise_blocks(P, Y, W, phi, tau, theta)
+        for start, stop, revenues, labor_demands in blocks:
+            exporters = slice(start, stop)
+            total_revenues[..., exporters] = revenues.sum(axis=-1)
+            total_variable_labor_demands[..., exporters] = (
+                labor_demands.sum(axis=-1))
+            total_imports += np.einsum('...h,...hj->...j',
+                                       M[..., exporters], revenues)
+
+        return total_revenues, total_variable_labor_demands, total_imports
+
+    def compute_jacobian(self, P, Y, W, M, L, f, beta, phi, tau, theta):
+        """
+        Compute the Jacobian of the model residual using vectorized NumPy
+        operations.
+
+        The Jacobian is assembled from closed-form expressions for each of the
+        P, Y, W, and M blocks of partial derivatives. The call signature
+        matches that of the function obtained by lambdifying the symbolic
+        Jacobian so that the two can be used interchangeably.
+
+        All arguments may also be stacked along a leading axis of length K
+        (i.e., arrays of shape (K,N) and parameters of shape (K,)) in which
+        case the Jacobians for all K points are computed in a single call.
+
+        If the physical distances are kept in a DistanceStore or in condensed
+        form, then the rows and columns of the Jacobian involving each block of exporting cities
+        are filled in from one block of rows of the stored distances at a
+        time, so that the only (N,N) arrays held in memory are the blocks of
+        the Jacobian itself.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,) or (K,N))
+            Price level in each city (including the normalized P[0]).
+        Y : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal GDP in each city.
+        W : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal wage in each city.
+        M : numpy.ndarray (shape=(N,) or (K,N))
+            Number of firms in each city.
+        L : numpy.ndarray (shape=(N,) or (K,N))
+            Total population of each city.
+        f, beta, phi, tau : float or numpy.ndarray (shape=(K,))
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,) or (K,N))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        jac : numpy.ndarray (shape=(4N-1, 4N-1) or (K,4N-1,4N-1))
+            Jacobian matrix of partial derivatives.
+
+        """
+        N = self.number_cities
+        L, theta = L[..., :N], theta[..., :N]
+        f, beta = self._batch(f, 1), self._batch(beta, 1)
+        shape = np.broadcast(P, Y, W, M, L, theta, f, beta, self._batch(phi, 1),
+                             self._batch(tau, 1)).shape
+
+        # sums over importing cities of pairwise terms and their derivatives
+        total_revenues = np.empty(shape)
+        total_variable_labor_demands = np.empty(shape)
+        total_revenues_W = np.empty(shape)
+        total_labor_demands_W = np.empty(shape)
+        total_imports = np.zeros(shape)
+
+        theta_j = theta[..., np.newaxis, :]
+        elasticities_P = (theta - 1) / P
+        elasticities_P_j = elasticities_P[..., np.newaxis, :]
+        Y_j = Y[..., np.newaxis, :]
+
+        # blocks are filled in place to avoid stacking (K,N,N) temporaries
+        jac = np.zeros(shape[:-1] + (4 * N, 4 * N))
+        blocks = [slice(i * N, (i + 1) * N) for i in range(4)]
+        goods, profit, labor, resource = blocks
+        P_, Y_, W_, M_ = blocks
+
+        pairwise_blocks = self._pairwise_blocks(P, Y, W, phi, tau, theta)
+        for start, stop, revenues, labor_demands in pairwise_blocks:
+            exporters = slice(start, stop)
+            W_h = W[..., exporters, np.newaxis]
+            M_h = M[..., exporters, np.newaxis]
+
+            # derivatives of pairwise terms wrt wages in the exporting city
+            revenues_W = (1 - theta_j) * revenues / W_h
+            labor_demands_W = -theta_j * labor_demands / W_h
+            profits = revenues - W_h * labor_demands
+
+            total_revenues[..., exporters] = revenues.sum(axis=-1)
+            total_variable_labor_demands[..., exporters] = (
+                labor_demands.sum(axis=-1))
+            total_revenues_W[..., exporters] = revenues_W.sum(axis=-1)
+            total_labor_demands_W[..., exporters] = labor_demands_W.sum(axis=-1)
+            total_imports += np.einsum('...h,...hj->...j',
+                                       M[..., exporters], revenues)
+
+            # rows of the exporting cities...
+            jac[..., goods, P_][..., exporters, :] = (M_h * revenues *
+                                                      elasticities_P_j)
+            jac[..., goods, Y_][..., exporters, :] = M_h * revenues / Y_j
+            jac[..., profit, P_][..., exporters, :] = profits * elasticities_P_j
+            jac[..., profit, Y_][..., exporters, :] = profits / Y_j
+            jac[..., labor, P_][..., exporters, :] = (-M_h * labor_demands *
+                                                      elasticities_P_j)
+            jac[..., labor, Y_][..., exporters, :] = -M_h * labor_demands / Y_j
+
+            # ...and columns of the exporting cities in the goods block
+            jac[..., goods, W_][..., exporters] = (
+                -(M_h * revenues_W).swapaxes(-1, -2))
+            jac[..., goods, M_][..., exporters] = -revenues.swapaxes(-1, -2)
+
+        # goods market clearing block
+        self._add_to_diag(jac[..., goods, P_], -elasticities_P * total_imports)
+        self._add_to_diag(jac[..., goods, Y_], -total_imports / Y)
+        self._add_to_diag(jac[..., goods, W_], M * total_revenues_W)
+        self._add_to_diag(jac[..., goods, M_], total_revenues)
+
+        # total profits block
+        self._add_to_diag(jac[..., profit, W_],
+                          total_revenues_W - W * total_labor_demands_W -
+                          total_variable_labor_demands - f)
+
+        # labor market clearing block
+        self._add_to_diag(jac[..., labor, W_], -M * total_labor_demands_W)
+        self._add_to_diag(jac[..., labor, M_], -(total_variable_labor_demands + f))
+
+        # resource constraint block
+        self._add_to_diag(jac[..., resource, Y_], 1.0)
+        self._add_to_diag(jac[..., resource, W_], -beta * L)
+
+        # drop goods market clearing for city 0 and derivatives wrt P[0]
+        return jac[..., 1:, 1:]
+
+    def compute_jacobian_blocks(self, P, Y, W, M, L, f, beta, phi, tau, theta):
+        """
+        Compute the diagonal blocks of the Jacobian of the model residual.
+
+        The block for city h contains the partial derivatives of the goods
+        market clearing, total profits, labor market clearing, and resource
+        constraint conditions for city h with respect to the price level,
+        nominal gdp, wage, and number of firms in city h. If there is no
+        trade between cities, then these blocks are the Jacobians of the
+        SingleCityModel for each city and the Jacobian of the model residual
+        is block diagonal.
+
+        The blocks only depend on sums of pairwise terms over importing
+        cities (and on the terms for trade of each city with itself), which
+        are accumulated one block of exporting cities at a time. No (N,N)
+        arrays are formed, so memory use beyond the physical distances is
+        proportional to the block size times N.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,))
+            Price level in each city (including the normalized P[0]).
+        Y : numpy.ndarray (shape=(N,))
+            Nominal GDP in each city.
+        W : numpy.ndarray (shape=(N,))
+            Nominal wage in each city.
+        M : numpy.ndarray (shape=(N,))
+            Number of firms in each city.
+        L : numpy.ndarray (shape=(N,))
+            Total population of each city.
+        f, beta, phi, tau : float
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        blocks : numpy.ndarray (shape=(N,4,4))
+            Diagonal blocks of the Jacobian. Since there is no goods market
+            clearing condition for city 0 and P[0] is normalized, the
+            corresponding row and column of the block for city 0 are those
+            of the identity matrix.
+
+        """
+        N = self.number_cities
+        L, theta = L[:N], theta[:N]
+
+        # sums over importing cities of pairwise terms and their derivatives
+        total_revenues = np.empty(N)
+        total_variable_labor_demands = np.empty(N)
+        total_revenues_W = np.empty(N)
+        total_labor_demands_W = np.empty(N)
+        total_imports = np.zeros(N)
+
+        # terms involving trade of each city with itself
+        own_revenues = np.empty(N)
+        own_labor_demands = np.empty(N)
+
+        for start, stop, distances in self._distance_blocks():
+            exporters = slice(start, stop)
+            revenues, labor_demands = self._compute_block_terms(
+                distances, P, Y, W[exporters], phi, tau, theta)
+            own = (np.arange(stop - start), np.arange(start, stop))
+
+            total_revenues[exporters] = revenues.sum(axis=-1)
+            total_variable_labor_demands[exporters] = labor_demands.sum(axis=-1)
+            total_revenues_W[exporters] = (((1 - theta) * revenues).sum(axis=-1) /
+                                           W[exporters])
+            total_labor_demands_W[exporters] = (-(theta * labor_demands).sum(axis=-1) /
+                                                W[exporters])
+            total_imports += M[exporters].dot(revenues)
+            own_revenues[exporters] = revenues[own]
+            own_labor_demands[exporters] = labor_demands[own]
+
+        own_revenues_W = (1 - theta) * own_revenues / W
+        own_profits = own_revenues - W * own_labor_demands
+        elasticities_P = (theta - 1) / P
+
+        blocks = np.zeros((N, 4, 4))
+
+        # goods market clearing row
+        blocks[:, 0, 0] = elasticities_P * (M * own_revenues - total_imports)
+        blocks[:, 0, 1] = (M * own_revenues - total_imports) / Y
+        blocks[:, 0, 2] = M * (total_revenues_W - own_revenues_W)
+        blocks[:, 0, 3] = total_revenues - own_revenues
+
+        # total profits row
+        blocks[:, 1, 0] = own_profits * elasticities_P
+        blocks[:, 1, 1] = own_profits / Y
+        blocks[:, 1, 2] = (total_revenues_W - W * total_labor_demands_W -
+                           total_variable_labor_demands - f)
+
+        # labor market clearing row
+        blocks[:, 2, 0] = -M * own_labor_demands * elasticities_P
+        blocks[:, 2, 1] = -M * own_labor_demands / Y
+        blocks[:, 2, 2] = -M * total_labor_demands_W
+        blocks[:, 2, 3] = -(total_variable_labor_demands + f)
+
+        # resource constraint row
+        blocks[:, 3, 1] = 1.0
+        blocks[:, 3, 2] = -beta * L
+
+        # no goods market clearing for city 0 and P[0] is normalized
+        blocks[0, 0, :], blocks[0, :, 0] = 0.0, 0.0
+        blocks[0, 0, 0] = 1.0
+
+        return blocks
+
+    def compute_parameter_jacobian(self, P, Y, W, M, L, f, beta, phi, tau,
+                                   theta, names):
+        """
+        Compute the partial derivatives of the model residual with respect to
+        some of the model parameters using vectorized NumPy operations.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,))
+            Price level in each city (including the normalized P[0]).
+        Y : numpy.ndarray (shape=(N,))
+            Nominal GDP in each city.
+        W : numpy.ndarray (shape=(N,))
+            Nominal wage in each city.
+        M : numpy.ndarray (shape=(N,))
+            Number of firms in each city.
+        L : numpy.ndarray (shape=(N,))
+            Total population of each city.
+        f, beta, phi, tau : float
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,))
+            Elasticity of substitution for goods sold in each city.
+        names : list
+            Names of the parameters. Valid names are 'f', 'beta', 'phi',
+            'tau', 'L' (the population of each city), and 'theta' (the
+            elasticity of substitution for goods sold in each city).
+
+        Returns
+        -------
+        jacs : list
+            List of numpy.ndarrays containing the partial derivatives of the
+            model residual with respect to each parameter. Arrays have shape
+            (4N-1,) for the scalar parameters and shape (4N-1,N) for L and
+            theta (with one column for each city).
+
+        """
+        N = self.number_cities
+        L, theta = L[:N], theta[:N]
+        revenues, labor_demands = self._compute_pairwise_terms(P, Y, W, phi,
+                                                               tau, theta)
+
+        def derivatives(revenues_, labor_demands_, per_city=False):
+            """Derivatives of the residual given those of pairwise terms."""
+            if not per_city:
+                # parameter affects every pair of cities...
+                total_revenues_ = revenues_.sum(axis=-1)
+                total_labor_demands_ = labor_demands_.sum(axis=-1)
+                jac = np.concatenate((M * total_revenues_ - M.dot(revenues_),
+                                      total_revenues_ - W * total_labor_demands_,
+                                      -M * total_labor_demands_,
+                                      np.zeros(N)))
+            else:
+                # ...or only goods sold in importing city j (column j)
+                jac = np.zeros((4 * N, N))
+                jac[:N] = M[:, np.newaxis] * revenues_
+                self._add_to_diag(jac[:N], -M.dot(revenues_))
+                jac[N:2 * N] = revenues_ - W[:, np.newaxis] * labor_demands_
+                jac[2 * N:3 * N] = -M[:, np.newaxis] * labor_demands_
+            return jac[1:]
+
+        jacs = []
+        for name in names:
+            if name == 'f':
+                jac = np.concatenate((np.zeros(N), -W, -M, np.zeros(N)))[1:]
+            elif name == 'beta':
+                jac = np.concatenate((np.zeros(2 * N), L, -L * W))[1:]
+            elif name == 'L':
+                jac = np.zeros((4 * N, N))
+                self._add_to_diag(jac[2 * N:3 * N], beta)
+                self._add_to_diag(jac[3 * N:], -beta * W)
+                jac = jac[1:]
+            elif name == 'phi':
+                jac = derivatives((theta - 1) * revenues / phi,
+                                  (theta - 1) * labor_demands / phi)
+            elif name == 'tau':
+                distances = self.physical_distances
+                jac = derivatives((1 - theta) * distances * revenues,
+                                  (1 - theta) * distances * labor_demands)
+            elif name == 'theta':
+                prices = self.compute_optimal_prices(W, phi, tau, theta)
+                log_relative_prices = np.log(prices / P)
+                jac = derivatives(revenues * (1 / theta - log_relative_prices),
+                                  labor_demands * (1 / (theta - 1) -
+                                                   log_relative_prices),
+                                  per_city=True)
+            else:
+                mesg = "Parameter names must be among {}, not {}"
+                raise ValueError(mesg.format(self._parameter_names, name))
+            jacs.append(jac)
+
+        return jacs
+
+    def compute_residual(self, P, Y, W, M, L, f, beta, phi, tau, theta):
+        """
+        Compute the model residual using vectorized NumPy operations.
+
+        The call signature matches that of the function obtained by
+        lambdifying the symbolic system so that the two can be used
+        interchangeably for numeric evaluation of the model.
+
+        All arguments may also be stacked along a leading axis of length K
+        (i.e., arrays of shape (K,N) and parameters of shape (K,)) in which
+        case the residuals for all K points are computed in a single call.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,) or (K,N))
+            Price level in each city (including the normalized P[0]).
+        Y : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal GDP in each city.
+        W : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal wage in each city.
+        M : numpy.ndarray (shape=(N,) or (K,N))
+            Number of firms in each city.
+        L : numpy.ndarray (shape=(N,) or (K,N))
+            Total population of each city.
+        f, beta, phi, tau : float or numpy.ndarray (shape=(K,))
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,) or (K,N))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        residual : numpy.ndarray (shape=(4N-1,) or (K,4N-1))
+            Value of the model residual.
+
+        """
+        N = self.number_cities
+        L, theta = L[..., :N], theta[..., :N]
+        totals = self._compute_totals(P, Y, W, M, phi, tau, theta)
+        total_revenues, total_variable_labor_demands, total_imports = totals
+        f, beta = self._batch(f, 1), self._batch(beta, 1)
+
+        total_exports = M * total_revenues
+        total_costs = (total_variable_labor_demands + f) * W
+        total_labor_demands = M * (total_variable_labor_demands + f)
+
+        resource_constraint = np.broadcast_to(Y - beta * L * W,
+                                              total_revenues.shape)
+        residual = np.concatenate(((total_exports - total_imports)[..., 1:],
+                                   total_revenues - total_costs,
+                                   beta * L - total_labor_demands,
+                                   resource_constraint), axis=-1)
+        return residual
+
+    def _compute_reduced_totals(self, P, W, L, f, beta, phi, tau, theta):
+        """
+        Compute nominal gdp, number of firms, total revenues, variable labor
+        demands, and imports for each city given price levels and wages.
+
+        """
+        Y = beta * L * W
+        totals = self._compute_totals(P, Y, W, np.zeros_like(Y), phi, tau, theta)
+        total_revenues, total_variable_labor_demands, _ = totals
+        M = beta * L / (total_variable_labor_demands + f)
+        total_imports = self._compute_totals(P, Y, W, M, phi, tau, theta)[2]
+        return (Y, M, total_revenues, total_variable_labor_demands,
+                total_imports)
+
+    def _distance_blocks(self, block_size=256):
+        """Iterate over blocks of rows of physical distances between cities."""
+        N = self.number_cities
+        if isinstance(self._physical_distances, distance_store.DistanceStore):
+            return self._physical_distances.row_blocks(N)
+        elif isinstance(self._physical_distances,
+                        distance_store.CondensedDistances):
+            return self._physical_distances.row_blocks(N, block_size)
+        else:
+            bounds = [(start, min(start + block_size, N))
+                      for start in range(0, N, block_size)]
+            return ((start, stop, self._physical_distances[start:stop, :N])
+                    for start, stop in bounds)
+
+    def compute_fixed_point_update(self, P, W, L, f, beta, phi, tau, theta):
+        """
+        Compute updated price levels and wages given current values.
+
+        Nominal gdp and the number of firms are pinned down by the resource
+        constraints and labor market clearing conditions. Given these, the
+        updated price levels are the CES price indices of the goods sold in
+        each city and the updated wages are those that would eliminate the
+        profits (holding nominal gdp in each city fixed). Equilibrium price
+        levels and wages are a fixed point of this map (up to the
+        normalization P[0] = 1).
+
+        Pairwise terms are computed one block of exporting cities at a time,
+        so memory use beyond the physical distances is proportional to the
+        block size times N.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,))
+            Price level in each city.
+        W : numpy.ndarray (shape=(N,))
+            Nominal wage in each city.
+        L : numpy.ndarray (shape=(N,))
+            Total population of each city.
+        f, beta, phi, tau : float
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        P, W : tuple
+            Two numpy.ndarrays (shape=(N,)) containing the updated price
+            levels and wages.
+
+        """
+        N = self.number_cities
+        L, theta = L[:N], theta[:N]
+        Y = beta * L * W
+        mark_ups = theta / (theta - 1)
+
+        price_indices = np.zeros(N)
+        profit_terms = np.empty(N)
+        elasticity_terms = np.empty(N)
+        for start, stop, distances in self._distance_blocks():
+            economic_distances = np.exp(tau * distances)
+            prices = (mark_ups * W[start:stop, np.newaxis] *
+                      economic_distances / phi)
+            quantities = self.compute_quantity_demands(prices, P, Y, theta)
+            labor_demands = quantities * economic_distances / phi
+
+            # variable profits per unit wage, and their elasticities wrt wage
+            profits = labor_demands / (theta - 1)
+            profit_terms[start:stop] = profits.sum(axis=-1)
+            elasticity_terms[start:stop] = (theta * profits).sum(axis=-1)
+
+            M = (beta * L[start:stop] /
+                 (labor_demands.sum(axis=-1) + f))
+            price_indices += M.dot(prices**(1 - theta))
+
+        updated_P = price_indices**(1 / (1 - theta))
+        updated_W = W * (profit_terms / f)**(profit_terms / elasticity_terms)
+        return updated_P, updated_W
+
+    def compute_eliminated_variables(self, P, W, L, f, beta, phi, tau, theta):
+        """
+        Compute the nominal gdp and number of firms in each city implied by
+        the resource constraints and labor market clearing conditions given
+        price levels and wages.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,) or (K,N))
+            Price level in each city (including the normalized P[0]).
+        W : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal wage in each city.
+        L : numpy.ndarray (shape=(N,) or (K,N))
+            Total population of each city.
+        f, beta, phi, tau : float or numpy.ndarray (shape=(K,))
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,) or (K,N))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        Y, M : tuple
+            Two numpy.ndarrays (shape=(N,) or (K,N)) containing nominal gdp
+            and number of firms in each city.
+
+        """
+        N = self.number_cities
+        L, theta = L[..., :N], theta[..., :N]
+        f, beta = self._batch(f, 1), self._batch(beta, 1)
+        totals = self._compute_reduced_totals(P, W, L, f, beta, phi, tau, theta)
+        return totals[0], totals[1]
+
+    def compute_reduced_jacobian(self, P, W, L, f, beta, phi, tau, theta):
+        """
+        Compute the Jacobian of the reduced model residual using vectorized
+        NumPy operations.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,) or (K,N))
+            Price level in each city (including the normalized P[0]).
+        W : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal wage in each city.
+        L : numpy.ndarray (shape=(N,) or (K,N))
+            Total population of each city.
+        f, beta, phi, tau : float or numpy.ndarray (shape=(K,))
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,) or (K,N))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        jac : numpy.ndarray (shape=(2N-1, 2N-1) or (K,2N-1,2N-1))
+            Jacobian matrix of partial derivatives.
+
+        """
+        N = self.number_cities
+        L, theta = L[..., :N], theta[..., :N]
+        f, beta = self._batch(f, 1), self._batch(beta, 1)
+        totals = self._compute_reduced_totals(P, W, L, f, beta, phi, tau, theta)
+        Y, M, total_revenues, total_variable_labor_demands, total_imports = totals
+        revenues, labor_demands = self._compute_pairwise_terms(P, Y, W, phi,
+                                                               tau, theta)
+
+        # derivatives of pairwise terms wrt wages in the exporting city...
+        theta_j = theta[..., np.newaxis, :]
+        revenues_W = (1 - theta_j) * revenues / W[..., np.newaxis]
+        labor_demands_W = -theta_j * labor_demands / W[..., np.newaxis]
+
+        # ...and wrt price levels and wages (via gdp) in the importing city
+        elasticities_P = (theta - 1) / P
+        elasticities_P_j = elasticities_P[..., np.newaxis, :]
+        W_j = W[..., np.newaxis, :]
+
+        jac = np.zeros(revenues.shape[:-2] + (2 * N, 2 * N))
+        goods, profit = slice(0, N), slice(N, 2 * N)
+        P_, W_ = slice(0, N), slice(N, 2 * N)
+
+        # derivatives of total revenues and variable labor demands
+        revenues_jac = np.concatenate((revenues * elasticities_P_j,
+                                       revenues / W_j), axis=-1)
+        self._add_to_diag(revenues_jac[..., W_], revenues_W.sum(axis=-1))
+        labor_demands_jac = np.concatenate((labor_demands * elasticities_P_j,
+                                            labor_demands / W_j), axis=-1)
+        self._add_to_diag(labor_demands_jac[..., W_],
+                          labor_demands_W.sum(axis=-1))
+
+        # derivatives of number of firms implied by labor market clearing
+        firms_jac = (-(M / (total_variable_labor_demands + f))[..., np.newaxis] *
+                     labor_demands_jac)
+
+        # goods market clearing block
+        jac[..., goods, :] = (total_revenues[..., np.newaxis] * firms_jac +
+                              M[..., np.newaxis] * revenues_jac -
+                              np.matmul(revenues.swapaxes(-1, -2), firms_jac))
+        jac[..., goods, W_] -= (M[..., np.newaxis] * revenues_W).swapaxes(-1, -2)
+        self._add_to_diag(jac[..., goods, P_],
+                          -total_imports * elasticities_P)
+        self._add_to_diag(jac[..., goods, W_], -total_imports / W)
+
+        # total profits block
+        jac[..., profit, :] = (revenues_jac -
+                               W[..., np.newaxis] * labor_demands_jac)
+        self._add_to_diag(jac[..., profit, W_],
+                          -(total_variable_labor_demands + f))
+
+        # drop goods market clearing for city 0 and derivatives wrt P[0]
+        return jac[..., 1:, 1:]
+
+    def compute_reduced_residual(self, P, W, L, f, beta, phi, tau, theta):
+        """
+        Compute the residual of the reduced model using vectorized NumPy
+        operations.
+
+        The reduced model substitutes the resource constraints (which pin
+        down nominal gdp) and the labor market clearing conditions (which
+        pin down the number of firms) into the goods market clearing and
+        total profits conditions, leaving a system of 2N-1 equations in the
+        2N-1 unknown price levels and wages.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,) or (K,N))
+            Price level in each city (including the normalized P[0]).
+        W : numpy.ndarray (shape=(N,) or (K,N))
+            Nominal wage in each city.
+        L : numpy.ndarray (shape=(N,) or (K,N))
+            Total population of each city.
+        f, beta, phi, tau : float or numpy.ndarray (shape=(K,))
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,) or (K,N))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        residual : numpy.ndarray (shape=(2N-1,) or (K,2N-1))
+            Value of the reduced model residual.
+
+        """
+        N = self.number_cities
+        L, theta = L[..., :N], theta[..., :N]
+        f, beta = self._batch(f, 1), self._batch(beta, 1)
+        totals = self._compute_reduced_totals(P, W, L, f, beta, phi, tau, theta)
+        Y, M, total_revenues, total_variable_labor_demands, total_imports = totals
+
+        total_exports = M * total_revenues
+        total_costs = (total_variable_labor_demands + f) * W
+        residual = np.concatenate(((total_exports - total_imports)[..., 1:],
+                                   total_revenues - total_costs), axis=-1)
+        return residual
+
+    def _lookup_distances(self, rows, cols):
+        """Look up the physical distances between pairs of cities."""
+        if isinstance(self._physical_distances,
+                      distance_store.CondensedDistances):
+            return self._physical_distances.lookup(rows, cols)
+        else:
+            return np.asarray(self._physical_distances[rows, cols],
+                              dtype=np.float64)
+
+    def _compute_trade_pairs(self):
+        """
+        Compute the exporting city, importing city, and physical distance for
+        each pair of cities in the trade network.
+
+        """
+        if self.__trade_pairs is None:
+            N = self.number_cities
+            if self.trade_network is None or self.trade_network.shape != (N, N):
+                mesg = ("Model.trade_network attribute must be a sparse " +
+                        "matrix with shape ({0}, {0}).")
+                raise AttributeError(mesg.format(N))
+            network = self.trade_network.copy()
+            network.sum_duplicates()
+            rows = np.repeat(np.arange(N), np.diff(network.indptr))
+            cols = network.indices
+            distances = self._lookup_distances(rows, cols)
+            self.__trade_pairs = (rows, cols, distances)
+        return self.__trade_pairs
+
+    def _compute_sparse_terms(self, P, Y, W, phi, tau, theta):
+        """
+        Compute revenues and variable labor demands for each pair of cities
+        in the trade network.
+
+        """
+        rows, cols, distances = self._compute_trade_pairs()
+        economic_distances = np.exp(tau * distances)
+        mark_ups = theta / (theta - 1)
+        prices = mark_ups[cols] * W[rows] * economic_distances / phi
+        quantities = (prices / P[cols])**(-theta[cols]) * Y[cols] / P[cols]
+        revenues = prices * quantities
+        labor_demands = quantities * economic_distances / phi
+        return rows, cols, revenues, labor_demands
+
+    def compute_trade_network(self, tau, theta, max_distance=None,
+                              min_trade_share=None, number_neighbors=5):
+        """
+        Compute a sparse trade network that drops pairs of cities that are
+        far apart or trade little with one another.
+
+        Parameters
+        ----------
+        tau : float
+            Iceberg trade cost parameter.
+        theta : numpy.ndarray (shape=(N,))
+            Elasticity of substitution for goods sold in each city.
+        max_distance : float (default=None)
+            Pairs of cities whose physical distance exceeds max_distance are
+            dropped.
+        min_trade_share : float (default=None)
+            Pairs of cities are dropped if the share of the exporting city in
+            the imports of the importing city would be less than
+            min_trade_share were wages equal and the number of firms
+            proportional to population in every city (i.e., if the gravity
+            weight L[h] * exp((1 - theta[j]) * tau * d[h, j]) is less than
+            min_trade_share times its sum over all exporting cities h).
+        number_neighbors : int (default=5)
+            Each city always trades with (at least) its number_neighbors
+            nearest neighbors and with itself.
+
+        Returns
+        -------
+        trade_network : scipy.sparse.csr_matrix (shape=(N,N))
+            Symmetric boolean matrix whose non-zero entries are the pairs of
+            cities that trade with one another. Pass this matrix to the
+            trade_network attribute to use it when computing the sparse
+            residual and Jacobian.
+
+        Notes
+        -----
+        Distances are processed one block of rows at a time, so that memory
+        use is proportional to the block size times N plus the number of
+        pairs in the trade network.
+
+        """
+        N = self.number_cities
+        L, theta = self.population[:N], theta[:N]
+        k = min(number_neighbors + 1, N)
+
+        if min_trade_share is not None:
+            total_weights = np.zeros(N)
+            for start, stop, distances in self._distance_blocks():
+                weights = (L[start:stop, np.newaxis] *
+                           np.exp((1 - theta) * tau * distances))
+                total_weights += weights.sum(axis=0)
+
+        exporters, importers = [], []
+        for start, stop, distances in self._distance_blocks():
+            keep = np.ones(distances.shape, dtype=bool)
+            if max_distance is not None:
+                keep &= distances <= max_distance
+            if min_trade_share is not None:
+                weights = (L[start:stop, np.newaxis] *
+                           np.exp((1 - theta) * tau * distances))
+                keep &= weights >= min_trade_share * total_weights
+
+            # always keep nearest neighbors (including the city itself)
+            block = np.arange(stop - start)
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            keep[block[:, np.newaxis], nearest] = True
+            keep[block, block + start] = True
+
+            rows, cols = np.nonzero(keep)
+            exporters.append(rows + start)
+            importers.append(cols)
+
+        rows, cols = np.concatenate(exporters), np.concatenate(importers)
+        network = sparse.csr_matrix((np.ones(rows.size, dtype=bool),
+                                     (rows, cols)), shape=(N, N))
+        return network + network.T
+
+    def compute_sparse_jacobian(self, P, Y, W, M, L, f, beta, phi, tau, theta):
+        """
+        Compute the sparse Jacobian of the model residual when trade is
+        restricted to the pairs of cities in the trade network.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,))
+            Price level in each city (including the normalized P[0]).
+        Y : numpy.ndarray (shape=(N,))
+            Nominal GDP in each city.
+        W : numpy.ndarray (shape=(N,))
+            Nominal wage in each city.
+        M : numpy.ndarray (shape=(N,))
+            Number of firms in each city.
+        L : numpy.ndarray (shape=(N,))
+            Total population of each city.
+        f, beta, phi, tau : float
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        jac : scipy.sparse.csc_matrix (shape=(4N-1, 4N-1))
+            Jacobian matrix of partial derivatives.
+
+        """
+        N = self.number_cities
+        L, theta = L[:N], theta[:N]
+        terms = self._compute_sparse_terms(P, Y, W, phi, tau, theta)
+        rows, cols, revenues, labor_demands = terms
+
+        total_revenues = np.bincount(rows, revenues, N)
+        total_variable_labor_demands = np.bincount(rows, labor_demands, N)
+        total_imports = np.bincount(cols, M[rows] * revenues, N)
+
+        # derivatives of pairwise terms wrt wages in the exporting city...
+        revenues_W = (1 - theta[cols]) * revenues / W[rows]
+        labor_demands_W = -theta[cols] * labor_demands / W[rows]
+        total_revenues_W = np.bincount(rows, revenues_W, N)
+        total_labor_demands_W = np.bincount(rows, labor_demands_W, N)
+
+        # ...and wrt price levels and nominal gdp in the importing city
+        elasticities_P = (theta - 1) / P
+        profits = revenues - W[rows] * labor_demands
+        cities = np.arange(N)
+
+        # (row, column, value) triplets for each block (duplicates are summed)
+        goods, profit, labor, resource = (i * N for i in range(4))
+        P_, Y_, W_, M_ = (i * N for i in range(4))
+        entries = [
+            # goods market clearing block
+            (goods + rows, P_ + cols, M[rows] * revenues * elasticities_P[cols]),
+            (goods + cities, P_ + cities, -elasticities_P * total_imports),
+            (goods + rows, Y_ + cols, M[rows] * revenues / Y[cols]),
+            (goods + cities, Y_ + cities, -total_imports / Y),
+            (goods + cols, W_ + rows, -M[rows] * revenues_W),
+            (goods + cities, W_ + cities, M * total_revenues_W),
+            (goods + cols, M_ + rows, -revenues),
+            (goods + cities, M_ + cities, total_revenues),
+            # total profits block
+            (profit + rows, P_ + cols, profits * elasticities_P[cols]),
+            (profit + rows, Y_ + cols, profits / Y[cols]),
+            (profit + cities, W_ + cities,
+             total_revenues_W - W * total_labor_demands_W -
+             total_variable_labor_demands - f),
+            # labor market clearing block
+            (labor + rows, P_ + cols,
+             -M[rows] * labor_demands * elasticities_P[cols]),
+            (labor + rows, Y_ + cols, -M[rows] * labor_demands / Y[cols]),
+            (labor + cities, W_ + cities, -M * total_labor_demands_W),
+            (labor + cities, M_ + cities, -(total_variable_labor_demands + f)),
+            # resource constraint block
+            (resource + cities, Y_ + cities, np.ones(N)),
+            (resource + cities, W_ + cities, -beta * L),
+        ]
+        jac_rows, jac_cols, values = (np.concatenate(arrays)
+                                      for arrays in zip(*entries))
+        jac = sparse.csc_matrix((values, (jac_rows, jac_cols)),
+                                shape=(4 * N, 4 * N))
+
+        # drop goods market clearing for city 0 and derivatives wrt P[0]
+        return jac[1:, 1:]
+
+    def compute_sparse_residual(self, P, Y, W, M, L, f, beta, phi, tau, theta):
+        """
+        Compute the model residual when trade is restricted to the pairs of
+        cities in the trade network.
+
+        Parameters
+        ----------
+        P : numpy.ndarray (shape=(N,))
+            Price level in each city (including the normalized P[0]).
+        Y : numpy.ndarray (shape=(N,))
+            Nominal GDP in each city.
+        W : numpy.ndarray (shape=(N,))
+            Nominal wage in each city.
+        M : numpy.ndarray (shape=(N,))
+            Number of firms in each city.
+        L : numpy.ndarray (shape=(N,))
+            Total population of each city.
+        f, beta, phi, tau : float
+            Model parameters.
+        theta : numpy.ndarray (shape=(N,))
+            Elasticity of substitution for goods sold in each city.
+
+        Returns
+        -------
+        residual : numpy.ndarray (shape=(4N-1,))
+            Value of the model residual.
+
+        """
+        N = self.number_cities
+        L, theta = L[:N], theta[:N]
+        terms = self._compute_sparse_terms(P, Y, W, phi, tau, theta)
+        rows, cols, revenues, labor_demands = terms
+
+        total_revenues = np.bincount(rows, revenues, N)
+        total_variable_labor_demands = np.bincount(rows, labor_demands, N)
+        total_imports = np.bincount(cols, M[rows] * revenues, N)
+
+        total_exports = M * total_revenues
+        total_costs = (total_variable_labor_demands + f) * W
+        total_labor_demands = M * (total_variable_labor_demands + f)
+
+        residual = np.concatenate(((total_exports - total_imports)[1:],
+                                   total_revenues - total_costs,
+                                   beta * L - total_labor_demands,
+                                   Y - beta * L * W))
+        return residual
+
     def effective_labor_supply(self, h):
         """Effective labor supply is a constant multple of total population."""
         return beta * population[h]
@@ -265,6 +1567,23 @@ class Model(object):
         """Relative price of a good in city j."""
         return price / nominal_price_level[j]
 
+    def price_quantity(self, h, j):
+        """
+        Optimal price and quantity demand of good produced in city h and sold
+        in city j.
+
+        Each (h, j) pair is computed once and then shared by all of the
+        total_* methods.
+
+        """
+        if self.__price_quantities is None:
+            self.__price_quantities = {}
+        if (h, j) not in self.__price_quantities:
+            p_star = self.optimal_price(h, j)
+            q_star = self.quantity_demand(p_star, j)
+            self.__price_quantities[(h, j)] = (p_star, q_star)
+        return self.__price_quantities[(h, j)]
+
     def resource_constraint(self, h):
         """Nominal GDP in city h must equal nominal income in city h."""
         constraint = (nominal_gdp[h] -
@@ -280,12 +1599,11 @@ class Model(object):
         """Total cost of production for a firm in city h."""
         return self.total_variable_cost(h) + self.total_fixed_cost(h)
 
-    def total_exports(self, h):
-        """Total exports of various goods from city h."""
+    def total_exports(self, h, partners=None):
+        """Total exports of various goods from city h (to some partners)."""
         individual_exports = []
-        for j in range(self.number_cities):
-            p_star = self.optimal_price(h, j)
-            q_star = self.quantity_demand(p_star, j)
+        for j in self._partners(partners):
+            p_star, q_star = self.price_quantity(h, j)
             total_revenue_h = num_firms[h] * self.revenue(p_star, q_star)
             individual_exports.append(total_revenue_h)
 
@@ -301,12 +1619,11 @@ class Model(object):
         """Total fixed labor demand for firms in city h."""
         return num_firms[h] * f
 
-    def total_imports(self, h):
-        """Total imports of various goods into city h."""
+    def total_imports(self, h, partners=None):
+        """Total imports of various goods into city h (from some partners)."""
         individual_imports = []
-        for j in range(self.number_cities):
-            p_star = self.optimal_price(j, h)
-            q_star = self.quantity_demand(p_star, h)
+        for j in self._partners(partners):
+            p_star, q_star = self.price_quantity(j, h)
             total_revenue_j = num_firms[j] * self.revenue(p_star, q_star)
             individual_imports.append(total_revenue_j)
 
@@ -322,32 +1639,29 @@ class Model(object):
         """Total profits for a firm in city h."""
         return self.total_revenue(h) - self.total_cost(h)
 
-    def total_revenue(self, h):
-        """Total revenue for a firm producing in city h."""
+    def total_revenue(self, h, partners=None):
+        """Total revenue for a firm producing in city h (from some partners)."""
         individual_revenues = []
-        for j in range(self.number_cities):
-            p_star = self.optimal_price(h, j)
-            q_star = self.quantity_demand(p_star, j)
+        for j in self._partners(partners):
+            p_star, q_star = self.price_quantity(h, j)
             individual_revenues.append(self.revenue(p_star, q_star))
 
         return sum(individual_revenues)
 
-    def total_variable_cost(self, h):
+    def total_variable_cost(self, h, partners=None):
         """Total variable costs of production for a firm in city h."""
         individual_variable_costs = []
-        for j in range(self.number_cities):
-            p_star = self.optimal_price(h, j)
-            q_star = self.quantity_demand(p_star, j)
+        for j in self._partners(partners):
+            p_star, q_star = self.price_quantity(h, j)
             individual_variable_costs.append(self.variable_cost(q_star, h, j))
 
         return sum(individual_variable_costs)
 
-    def total_variable_labor_demand(self, h):
+    def total_variable_labor_demand(self, h, partners=None):
         """Total variable labor demand for firms in city h."""
         individual_labor_demands = []
-        for j in range(self.number_cities):
-            p_star = self.optimal_price(h, j)
-            q_star = self.quantity_demand(p_star, j)
+        for j in self._partners(partners):
+            p_star, q_star = self.price_quantity(h, j)
             variable_demand_h = self.variable_labor_demand(q_star, h, j)
             individual_labor_demands.append(variable_demand_h)
 
@@ -373,13 +1687,8 @@ class Model(object):
 class SingleCityModel(Model):
 
     # initialize cached values
-    __numeric_gdp = None
-    __numeric_num_firms = None
-    __numeric_wage = None
     __symbolic_solution = None
 
-    _modules = [{'ImmutableMatrix': np.array}, "numpy"]
-
     def __init__(self, params, physical_distances, population):
         """
         Create an instance of the SingleCityModel class.
@@ -407,60 +1716,8 @@ class SingleCityModel(Model):
         :type: numpy.ndarray
 
         """
-        P0 = np.ones(1.0)
-        Y0 = self.compute_nominal_gdp(P0, self.population, self.params)
-        W0 = self.compute_nominal_wage(P0, self.population, self.params)
-        M0 = self.compute_number_firms(P0, self.population, self.params)
-
-        return np.hstack((Y0, W0, M0))
-
-    @property
-    def _numeric_gdp(self):
-        """
-        Vectorized function for evaluating solution for nominal GDP.
-
-        :getter: Return the current function.
-        :type: function
-
-        """
-        if self.__numeric_gdp is None:
-            Y = nominal_gdp[0]
-            self.__numeric_gdp = sym.lambdify(self._symbolic_args,
-                                              self._symbolic_solution[Y],
-                                              self._modules)
-        return self.__numeric_gdp
-
-    @property
-    def _numeric_wage(self):
-        """
-        Vectorized function for evaluating solution for nominal wage.
-
-        :getter: Return the current function.
-        :type: function
-
-        """
-        if self.__numeric_wage is None:
-            W = nominal_wage[0]
-            self.__numeric_wage = sym.lambdify(self._symbolic_args,
-                                               self._symbolic_solution[W],
-                                               self._modules)
-        return self.__numeric_wage
-
-    @property
-    def _numeric_num_firms(self):
-        """
-        Vectorized function for evaluating solution for number of firms.
-
-        :getter: Return the current function.
-        :type: function
-
-        """
-        if self.__numeric_num_firms is None:
-            M = num_firms[0]
-            self.__numeric_num_firms = sym.lambdify(self._symbolic_args,
-                                                    self._symbolic_solution[M],
-                                                    self._modules)
-        return self.__numeric_num_firms
+        return np.hstack(self.compute_solution(np.ones(1), self.population[:1],
+                                               self.params))
 
     @property
     def _symbolic_args(self):
@@ -480,6 +1737,9 @@ class SingleCityModel(Model):
         """
         Dictionary of symbolic expressions for analytic solution to the model.
 
+        Only used to check the closed form expressions used by the compute_*
+        methods (solving for the symbolic solution is slow).
+
         :getter: Return the analytic solution to the model as a dictionary.
         :type: dict
 
@@ -490,71 +1750,115 @@ class SingleCityModel(Model):
                                                   dict=True)
         return self.__symbolic_solution
 
+    @staticmethod
+    def _elasticities(population, params):
+        """Elasticity of substitution for each of some isolated cities."""
+        theta = np.asarray(params['theta'], dtype=float)
+        if theta.ndim > 0:
+            theta = theta[:np.size(population)]
+        return theta
+
     def compute_nominal_gdp(self, price_level, population, params):
         """
-        Compute equilibrium nominal GDP for the city given a price level and
-        some parameters.
+        Compute equilibrium nominal GDP for some isolated cities given their
+        price levels and some parameters.
 
         Parameters
         ----------
-        price_level : numpy.ndarray (shape=(1,))
-            Price level index for the city.
-        population : numpy.ndarray (shape=(1,))
-            Total population for the city.
+        price_level : numpy.ndarray (shape=(N,))
+            Price level index for each city.
+        population : numpy.ndarray (shape=(N,))
+            Total population for each city.
         params : dict
-            Dictionary of model parameters.
+            Dictionary of model parameters. The first N values of theta are
+            used as the elasticities of substitution for the N cities.
 
         Returns
         -------
-        nominal_gdp : float
-            Equilibrium nominal GDP for the city.
+        nominal_gdp : numpy.ndarray (shape=(N,))
+            Equilibrium nominal GDP for each city.
 
         """
-        nominal_gdp = self._numeric_gdp(price_level, population, **params)
-        return nominal_gdp
+        nominal_wage = self.compute_nominal_wage(price_level, population, params)
+        return params['beta'] * population * nominal_wage
 
     def compute_nominal_wage(self, price_level, population, params):
         """
-        Compute equilibrium nominal wage for the city given a price level and
-        some parameters.
+        Compute equilibrium nominal wage for some isolated cities given their
+        price levels and some parameters.
 
         Parameters
         ----------
-        price_level : numpy.ndarray (shape=(1,))
-            Price level index for the city.
-        population : numpy.ndarray (shape=(1,))
-            Total population for the city.
+        price_level : numpy.ndarray (shape=(N,))
+            Price level index for each city.
+        population : numpy.ndarray (shape=(N,))
+            Total population for each city.
         params : dict
             Dictionary of model parameters.
 
         Returns
         -------
-        nominal_wage : float
-            Equilibrium nominal wages for the city.
+        nominal_wage : numpy.ndarray (shape=(N,))
+            Equilibrium nominal wages for each city.
+
+        Notes
+        -----
+        Closed form of the symbolic solution to the single city model (with
+        no trade costs within a city).
 
         """
-        nominal_wage = self._numeric_wage(price_level, population, **params)
-        return nominal_wage
+        theta = self._elasticities(population, params)
+        f, beta, phi = params['f'], params['beta'], params['phi']
+        mark_up = theta / (theta - 1)
+        unit_costs = (price_level * f * phi * (theta - 1) *
+                      (mark_up / (price_level * phi))**theta)
+        return (beta * population / unit_costs)**(1 / (theta - 1))
 
     def compute_number_firms(self, price_level, population, params):
         """
-        Compute equilibrium nominal number of firms for the city given a price
-        level and some parameters.
+        Compute equilibrium nominal number of firms for some isolated cities
+        given their price levels and some parameters.
+
+        Parameters
+        ----------
+        price_level : numpy.ndarray (shape=(N,))
+            Price level index for each city.
+        population : numpy.ndarray (shape=(N,))
+            Total population for each city.
+        params : dict
+            Dictionary of model parameters.
+
+        Returns
+        -------
+        number_firms: numpy.ndarray (shape=(N,))
+            Equilibrium number of firms in each city.
+
+        """
+        theta = self._elasticities(population, params)
+        number_firms = params['beta'] * population / (theta * params['f'])
+        return number_firms * np.ones_like(price_level)
+
+    def compute_solution(self, price_level, population, params):
+        """
+        Compute equilibrium nominal GDP, nominal wage, and number of firms for
+        some isolated cities given their price levels and some parameters.
 
         Parameters
         ----------
-        price_level : numpy.ndarray (shape=(1,))
-            Price level index for the city.
-        population : numpy.ndarray (shape=(1,))
-            Total population for the city.
+        price_level : numpy.ndarray (shape=(N,))
+            Price level index for each city.
+        population : numpy.ndarray (shape=(N,))
+            Total population for each city.
         params : dict
             Dictionary of model parameters.
 
         Returns
         -------
-        number_firms: float
-            Equilibrium number of firms.
+        nominal_gdp, nominal_wage, number_firms : tuple
+            Arrays (shape=(N,)) of equilibrium values for each city.
 
         """
-        number_firms = self._numeric_num_firms(price_level, population, **params)
-        return number_firms
+        nominal_wage = self.compute_nominal_wage(price_level, population, params)
+        nominal_gdp = params['beta'] * population * nominal_wage
+        number_firms = self.compute_number_firms(price_level, population, params)
+        return nominal_gdp, nominal_wage, number_firms
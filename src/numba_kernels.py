@@ -0,0 +1,209 @@
+"""
+Numba-compiled kernels for evaluating the model residual and Jacobian.
+
+The kernels fuse the pairwise computations of prices, quantities, revenues
+and variable labor demands into loops over pairs of cities, so no square
+arrays of intermediate values are ever allocated. Using the optimal pricing
+rule the revenue of firms in city h selling in city j simplifies to
+
+    r[h,j] = c[j] * exp((1 - theta[j]) * (log W[h] + tau * d[h,j]))
+
+with c[j] = (mu[j] / phi)**(1 - theta[j]) * P[j]**(theta[j] - 1) * Y[j] and
+mu[j] the mark-up, and the variable labor demand simplifies to
+r[h,j] / (mu[j] * W[h]). Each pair of cities therefore costs a single
+exponential.
+
+Numba is an optional dependency. If it is not installed, then available is
+False and the functions in this module are plain (and very slow) Python.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    available = True
+    prange = numba.prange
+    jit = numba.njit(parallel=True, cache=True)
+else:
+    available = False
+    prange = range
+
+    def jit(function):
+        """Return function unchanged when Numba is not installed."""
+        return function
+
+
+# rows of the pairwise terms processed together by a single thread
+_block_size = 32
+
+
+@jit
+def _city_terms(P, Y, W, phi, theta):
+    """Terms of the pairwise revenues depending on a single city."""
+    N = P.shape[0]
+    mark_ups = np.empty(N)
+    demand_shifters = np.empty(N)
+    log_wages = np.empty(N)
+    for j in prange(N):
+        mark_ups[j] = theta[j] / (theta[j] - 1)
+        demand_shifters[j] = ((mark_ups[j] / phi)**(1 - theta[j]) *
+                              P[j]**(theta[j] - 1) * Y[j])
+        log_wages[j] = np.log(W[j])
+    return mark_ups, demand_shifters, log_wages
+
+
+@jit
+def compute_residual(P, Y, W, M, L, f, beta, phi, tau, theta, d):
+    """
+    Compute the model residual.
+
+    Parameters
+    ----------
+    P : numpy.ndarray (shape=(N,))
+        Price level in each city (including the normalized P[0]).
+    Y : numpy.ndarray (shape=(N,))
+        Nominal GDP in each city.
+    W : numpy.ndarray (shape=(N,))
+        Nominal wage in each city.
+    M : numpy.ndarray (shape=(N,))
+        Number of firms in each city.
+    L : numpy.ndarray (shape=(N,))
+        Total population of each city.
+    f, beta, phi, tau : float
+        Model parameters.
+    theta : numpy.ndarray (shape=(N,))
+        Elasticity of substitution for goods sold in each city.
+    d : numpy.ndarray (shape=(N,N))
+        Square array of physical distances between cities.
+
+    Returns
+    -------
+    residual : numpy.ndarray (shape=(4N-1,))
+        Value of the model residual.
+
+    """
+    N = P.shape[0]
+    mark_ups, demand_shifters, log_wages = _city_terms(P, Y, W, phi, theta)
+
+    # each block of exporting cities accumulates its own share of imports
+    number_blocks = (N + _block_size - 1) // _block_size
+    partial_imports = np.zeros((number_blocks, N))
+    total_revenues = np.empty(N)
+    total_variable_labor_demands = np.empty(N)
+
+    for b in prange(number_blocks):
+        for h in range(b * _block_size, min((b + 1) * _block_size, N)):
+            total_revenue = 0.0
+            total_variable_labor_demand = 0.0
+            for j in range(N):
+                revenue = demand_shifters[j] * np.exp((1 - theta[j]) *
+                                                      (log_wages[h] + tau * d[h, j]))
+                total_revenue += revenue
+                total_variable_labor_demand += revenue / (mark_ups[j] * W[h])
+                partial_imports[b, j] += M[h] * revenue
+            total_revenues[h] = total_revenue
+            total_variable_labor_demands[h] = total_variable_labor_demand
+
+    total_imports = partial_imports.sum(axis=0)
+
+    residual = np.empty(4 * N - 1)
+    for h in range(N):
+        if h > 0:
+            residual[h - 1] = M[h] * total_revenues[h] - total_imports[h]
+        residual[N - 1 + h] = (total_revenues[h] -
+                               (total_variable_labor_demands[h] + f) * W[h])
+        residual[2 * N - 1 + h] = (beta * L[h] -
+                                   M[h] * (total_variable_labor_demands[h] + f))
+        residual[3 * N - 1 + h] = Y[h] - beta * L[h] * W[h]
+
+    return residual
+
+
+@jit
+def compute_jacobian(P, Y, W, M, L, f, beta, phi, tau, theta, d):
+    """
+    Compute the Jacobian of the model residual.
+
+    Parameters
+    ----------
+    P, Y, W, M, L, f, beta, phi, tau, theta, d
+        See compute_residual.
+
+    Returns
+    -------
+    jac : numpy.ndarray (shape=(4N-1,4N-1))
+        Jacobian matrix of partial derivatives.
+
+    """
+    N = P.shape[0]
+    mark_ups, demand_shifters, log_wages = _city_terms(P, Y, W, phi, theta)
+
+    # rows and columns are offset by one to drop goods market clearing for
+    # city 0 and derivatives wrt P[0]
+    jac = np.zeros((4 * N, 4 * N))
+    goods, profit, labor, resource = 0, N, 2 * N, 3 * N
+    P_, Y_, W_, M_ = 0, N, 2 * N, 3 * N
+
+    # each city h fills its own rows (and its own columns of the goods
+    # market clearing block) so blocks of cities can be processed in parallel
+    number_blocks = (N + _block_size - 1) // _block_size
+    partial_imports = np.zeros((number_blocks, N))
+
+    for b in prange(number_blocks):
+        for h in range(b * _block_size, min((b + 1) * _block_size, N)):
+            total_revenue = 0.0
+            total_variable_labor_demand = 0.0
+            total_revenue_W = 0.0
+            total_variable_labor_demand_W = 0.0
+            for j in range(N):
+                revenue = demand_shifters[j] * np.exp((1 - theta[j]) *
+                                                      (log_wages[h] + tau * d[h, j]))
+                labor_demand = revenue / (mark_ups[j] * W[h])
+                revenue_W = (1 - theta[j]) * revenue / W[h]
+                labor_demand_W = -theta[j] * labor_demand / W[h]
+                elasticity_P = (theta[j] - 1) / P[j]
+                profits = revenue - W[h] * labor_demand
+
+                total_revenue += revenue
+                total_variable_labor_demand += labor_demand
+                total_revenue_W += revenue_W
+                total_variable_labor_demand_W += labor_demand_W
+                partial_imports[b, j] += M[h] * revenue
+
+                jac[goods + h, P_ + j] = M[h] * revenue * elasticity_P
+                jac[goods + h, Y_ + j] = M[h] * revenue / Y[j]
+                jac[goods + j, W_ + h] = -M[h] * revenue_W
+                jac[goods + j, M_ + h] = -revenue
+
+                jac[profit + h, P_ + j] = profits * elasticity_P
+                jac[profit + h, Y_ + j] = profits / Y[j]
+
+                jac[labor + h, P_ + j] = -M[h] * labor_demand * elasticity_P
+                jac[labor + h, Y_ + j] = -M[h] * labor_demand / Y[j]
+
+            jac[goods + h, W_ + h] += M[h] * total_revenue_W
+            jac[goods + h, M_ + h] += total_revenue
+
+            jac[profit + h, W_ + h] = (total_revenue_W -
+                                       W[h] * total_variable_labor_demand_W -
+                                       total_variable_labor_demand - f)
+
+            jac[labor + h, W_ + h] = -M[h] * total_variable_labor_demand_W
+            jac[labor + h, M_ + h] = -(total_variable_labor_demand + f)
+
+            jac[resource + h, Y_ + h] = 1.0
+            jac[resource + h, W_ + h] = -beta * L[h]
+
+    total_imports = partial_imports.sum(axis=0)
+    for h in range(N):
+        jac[goods + h, P_ + h] -= (theta[h] - 1) / P[h] * total_imports[h]
+        jac[goods + h, Y_ + h] -= total_imports[h] / Y[h]
+
+    return jac[1:, 1:]
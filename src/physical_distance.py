@@ -1,9 +1,177 @@
-from geopy.distance import great_circle, vincenty
 import pandas as pd
 import numpy as np
 
+from distance_store import CondensedDistances
+
+# mean radius of the earth (km) used by geopy.distance.great_circle
+EARTH_RADIUS = 6371.009
+
+# major (km) and minor (km) axes and flattening of the WGS-84 ellipsoid
+WGS84 = (6378.137, 6356.7523142, 1 / 298.257223563)
+
+
+def great_circle_distance(lat1, lng1, lat2, lng2, radius=EARTH_RADIUS):
+    """
+    Compute great circle distances between pairs of points on a sphere.
+
+    Parameters
+    ----------
+    lat1, lng1, lat2, lng2 : numpy.ndarray
+        Arrays (with broadcastable shapes) of latitude and longitude (in
+        degrees) for the first and second point of each pair.
+    radius : float (default=EARTH_RADIUS)
+        Radius of the sphere (in km).
+
+    Returns
+    -------
+    distance : numpy.ndarray
+        Great circle distance (in km) between each pair of points.
+
+    Notes
+    -----
+    Uses the same (numerically stable) formula as geopy.distance.great_circle.
 
-def compute_physical_distance(data):
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(x) for x in (lat1, lng1, lat2, lng2))
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    sin_lat2, cos_lat2 = np.sin(lat2), np.cos(lat2)
+    delta_lng = lng2 - lng1
+    cos_delta_lng, sin_delta_lng = np.cos(delta_lng), np.sin(delta_lng)
+
+    d = np.arctan2(np.sqrt((cos_lat2 * sin_delta_lng)**2 +
+                           (cos_lat1 * sin_lat2 -
+                            sin_lat1 * cos_lat2 * cos_delta_lng)**2),
+                   sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lng)
+
+    return radius * d
+
+
+def vincenty_distance(lat1, lng1, lat2, lng2, ellipsoid=WGS84, tol=1e-12,
+                      max_iterations=200):
+    """
+    Compute geodesic distances between pairs of points on an ellipsoid.
+
+    Parameters
+    ----------
+    lat1, lng1, lat2, lng2 : numpy.ndarray
+        Arrays (with broadcastable shapes) of latitude and longitude (in
+        degrees) for the first and second point of each pair.
+    ellipsoid : tuple (default=WGS84)
+        Major axis (in km), minor axis (in km), and flattening of the
+        ellipsoid.
+    tol : float (default=1e-12)
+        Convergence tolerance for the difference in longitude on the
+        auxiliary sphere.
+    max_iterations : int (default=200)
+        Maximum number of iterations.
+
+    Returns
+    -------
+    distance : numpy.ndarray
+        Geodesic distance (in km) between each pair of points.
+
+    Notes
+    -----
+    Vectorized version of Vincenty's inverse formula as implemented by
+    geopy.distance.vincenty. All pairs are iterated together until every
+    pair has converged. Like geopy, raises a ValueError if the formula fails
+    to converge (which can happen for nearly antipodal points).
+
+    """
+    major, minor, f = ellipsoid
+    lat1, lng1, lat2, lng2 = np.broadcast_arrays(*(np.radians(x) for x in
+                                                   (lat1, lng1, lat2, lng2)))
+    delta_lng = lng2 - lng1
+
+    reduced_lat1 = np.arctan((1 - f) * np.tan(lat1))
+    reduced_lat2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_reduced1, cos_reduced1 = np.sin(reduced_lat1), np.cos(reduced_lat1)
+    sin_reduced2, cos_reduced2 = np.sin(reduced_lat2), np.cos(reduced_lat2)
+
+    lambda_lng = delta_lng
+    for i in range(max_iterations):
+        sin_lambda_lng, cos_lambda_lng = np.sin(lambda_lng), np.cos(lambda_lng)
+        sin_sigma = np.sqrt((cos_reduced2 * sin_lambda_lng)**2 +
+                            (cos_reduced1 * sin_reduced2 -
+                             sin_reduced1 * cos_reduced2 * cos_lambda_lng)**2)
+        cos_sigma = (sin_reduced1 * sin_reduced2 +
+                     cos_reduced1 * cos_reduced2 * cos_lambda_lng)
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+
+        # coincident points have sin_sigma equal to zero
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sin_alpha = np.where(sin_sigma == 0, 0.0,
+                                 cos_reduced1 * cos_reduced2 * sin_lambda_lng /
+                                 sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha**2
+            cos2_sigma_m = np.where(cos_sq_alpha == 0, 0.0,
+                                    cos_sigma - 2 * sin_reduced1 * sin_reduced2 /
+                                    cos_sq_alpha)
+
+        C = f / 16. * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+        lambda_prev = lambda_lng
+        lambda_lng = (delta_lng + (1 - C) * f * sin_alpha *
+                      (sigma + C * sin_sigma *
+                       (cos2_sigma_m + C * cos_sigma *
+                        (-1 + 2 * cos2_sigma_m**2))))
+
+        if np.all(np.abs(lambda_lng - lambda_prev) <= tol):
+            break
+    else:
+        raise ValueError("Vincenty formula failed to converge!")
+
+    u_sq = cos_sq_alpha * (major**2 - minor**2) / minor**2
+    A = 1 + u_sq / 16384. * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = (B * sin_sigma *
+                   (cos2_sigma_m + B / 4. *
+                    (cos_sigma * (-1 + 2 * cos2_sigma_m**2) -
+                     B / 6. * cos2_sigma_m * (-3 + 4 * sin_sigma**2) *
+                     (-3 + 4 * cos2_sigma_m**2))))
+
+    return minor * A * (sigma - delta_sigma)
+
+
+def pairwise_distances(coords, metric, block_size=256):
+    """
+    Compute the symmetric matrix of distances between pairs of points.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray (shape = (N, 2))
+        Array of latitude and longitude (in degrees) for each point.
+    metric : function
+        Vectorized distance function (i.e., great_circle_distance or
+        vincenty_distance).
+    block_size : int (default=256)
+        Number of rows of the distance matrix computed at a time. Memory use
+        for temporary arrays is proportional to block_size * N.
+
+    Returns
+    -------
+    distances : numpy.ndarray (shape = (N, N))
+        Square array of pairwise distances.
+
+    """
+    coords = np.asarray(coords, dtype=float)
+    lat, lng = coords[:, 0], coords[:, 1]
+    N = coords.shape[0]
+    distances = np.zeros((N, N))
+
+    # distance is symmetric so only compute the upper triangle...
+    for start in range(0, N, block_size):
+        stop = min(start + block_size, N)
+        block = metric(lat[start:stop, np.newaxis], lng[start:stop, np.newaxis],
+                       lat[np.newaxis, start:], lng[np.newaxis, start:])
+
+        # ...and then reflect it
+        distances[start:stop, start:] = block
+        distances[start:, start:stop] = block.T
+
+    return distances
+
+
+def compute_physical_distance(data, block_size=256):
     """
     Compute measures of physical distance given geographical coordinates for
     U.S. metropolitan statistical areas (MSAs).
@@ -12,31 +180,20 @@ def compute_physical_distance(data):
     ----------
     data : DataFrame (shape = (N, 2))
         Pandas DataFrame containing geographical coordinate data for MSAs.
+    block_size : int (default=256)
+        Number of rows of each distance matrix computed at a time.
 
     Returns
     -------
-    great_circle_distance, vincenty_distance : tuple
+    great_circle_matrix, vincenty_matrix : tuple
         Two numpy.ndarrays with shape (N, N) containing different measurements
         of physical distance between MSAs.
 
     """
-    N = data.shape[0]
-    great_circle_distance = np.array(np.zeros((N, N)))
-    vincenty_distance = np.array(np.zeros((N, N)))
-
-    # inefficient given that distance is symmetric!
-    for i, geo_fips_1 in enumerate(data.index):
-        for j, geo_fips_2 in enumerate(data.index):
-            tmp_coords_1 = tuple(data.ix[geo_fips_1])
-            tmp_coords_2 = tuple(data.ix[geo_fips_2])
-
-            tmp_metric = great_circle(tmp_coords_1, tmp_coords_2)
-            great_circle_distance[i, j] = tmp_metric.kilometers
-
-            tmp_metric = vincenty(tmp_coords_1, tmp_coords_2)
-            vincenty_distance[i, j] = tmp_metric.kilometers
-
-    return great_circle_distance, vincenty_distance
+    coords = data.values
+    great_circle = pairwise_distances(coords, great_circle_distance, block_size)
+    vincenty = pairwise_distances(coords, vincenty_distance, block_size)
+    return great_circle, vincenty
 
 
 # load the csv file containing the geocoordinates
@@ -49,11 +206,11 @@ geo_coords = sorted_subset[['lat', 'lng']].drop([998, 48260])
 
 # compute the physical distance matrices
 physical_distance_matrices = compute_physical_distance(geo_coords)
-great_circle_distance, vincenty_distance = physical_distance_matrices
+great_circle_matrix, vincenty_matrix = physical_distance_matrices
 
 # normalize the distance measures (for numeric purposes)
-normed_vincenty_distance = vincenty_distance / vincenty_distance.max()
-normed_great_circle_distance = great_circle_distance / great_circle_distance.max()
+normed_vincenty_distance = vincenty_matrix / vincenty_matrix.max()
+normed_great_circle_distance = great_circle_matrix / great_circle_matrix.max()
 
 # save the resulting arrays to disk
 with open('../data/google/normed_vincenty_distance.npy', 'w') as results:
@@ -61,3 +218,10 @@ with open('../data/google/normed_vincenty_distance.npy', 'w') as results:
 
 with open('../data/google/normed_great_circle_distance.npy', 'w') as results:
     np.save(results, normed_great_circle_distance)
+
+# ...and in condensed form (which uses half the disk space)
+condensed_vincenty_distance = CondensedDistances.from_array(normed_vincenty_distance)
+condensed_vincenty_distance.save('../data/google/condensed_vincenty_distance.npy')
+
+condensed_great_circle_distance = CondensedDistances.from_array(normed_great_circle_distance)
+condensed_great_circle_distance.save('../data/google/condensed_great_circle_distance.npy')
@@ -0,0 +1,226 @@
+"""
+Functions for racing several (initial guess, method) strategies for solving
+the model against one another in parallel.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import multiprocessing
+import time
+import warnings
+
+import numpy as np
+from scipy import optimize
+
+import models
+import solvers
+
+# solver is created once per worker process and then reused
+_worker_solver = None
+
+
+def default_strategies():
+    """
+    Default strategies for racing solves.
+
+    Returns
+    -------
+    strategies : list
+        List of strategy dictionaries that combine the islands guess and a
+        randomly perturbed islands guess with the hybr, lm, and krylov
+        methods of scipy.optimize.root.
+
+    """
+    return [{'guess': 'islands', 'method': 'hybr'},
+            {'guess': 'islands', 'method': 'lm'},
+            {'guess': 'islands', 'method': 'krylov', 'with_jacobian': False},
+            {'guess': 'perturbed', 'method': 'hybr'},
+            {'guess': 'perturbed', 'method': 'lm'}]
+
+
+def perturbed_guess(model, scale=0.1, seed=None):
+    """
+    Islands guess with each variable multiplied by a log-normal shock.
+
+    Parameters
+    ----------
+    model : models.Model
+        An instance of the models.Model class.
+    scale : float (default=0.1)
+        Standard deviation of the log shocks.
+    seed : int (default=None)
+        Seed for the random number generator.
+
+    Returns
+    -------
+    guess : numpy.ndarray (shape=(4N-1,))
+        Perturbed initial guess for the model equilibrium.
+
+    """
+    guess = solvers.IslandsGuess(model).guess
+    prng = np.random.RandomState(seed)
+    return guess * np.exp(prng.normal(0.0, scale, guess.size))
+
+
+def _converged(result):
+    """Check that a result is a converged (and positive) equilibrium."""
+    return bool(result.success and (result.x > 0).all())
+
+
+def _initialize_worker(params, physical_distances, population, number_cities,
+                       backend):
+    """Create the solver used by a worker process."""
+    global _worker_solver
+    model = models.Model(params=params,
+                         physical_distances=physical_distances,
+                         population=population)
+    model.number_cities = number_cities
+    _worker_solver = solvers.Solver(model, backend=backend)
+
+
+def _initial_guess(model, strategy, seed):
+    """Initial guess for a strategy."""
+    guess = strategy.get('guess', 'islands')
+    if isinstance(guess, str) and guess == 'islands':
+        return solvers.IslandsGuess(model).guess
+    elif isinstance(guess, str) and guess == 'perturbed':
+        return perturbed_guess(model, strategy.get('scale', 0.1), seed)
+    elif isinstance(guess, str):
+        mesg = ("Strategy guess must be 'islands', 'perturbed', or an " +
+                "array, not {}")
+        raise ValueError(mesg.format(guess))
+    else:
+        return np.asarray(guess, dtype=np.float64)
+
+
+def _run_strategy(task):
+    """Solve the model using one strategy."""
+    index, initial_guess, method, solver_kwargs = task
+    start = time.time()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            result = _worker_solver.solve(initial_guess, method=method,
+                                          **solver_kwargs)
+        except (ArithmeticError, ValueError, np.linalg.LinAlgError) as error:
+            result = optimize.OptimizeResult(x=initial_guess, success=False,
+                                             message=str(error), nfev=0)
+    return index, result, time.time() - start
+
+
+def race(model, strategies=None, backend='numpy', processes=None,
+         timeout=None, seed=None, **solver_kwargs):
+    """
+    Solve the model using several strategies in parallel and return the
+    first converged result.
+
+    Each strategy is run in its own worker process. As soon as one of them
+    finds an equilibrium (i.e., the solver reports success and all variables
+    are positive), the remaining workers are terminated.
+
+    Parameters
+    ----------
+    model : models.Model
+        An instance of the models.Model class.
+    strategies : list (default=None)
+        List of strategy dictionaries. Each dictionary must specify a method
+        (passed to Solver.solve) and may specify a guess (either 'islands',
+        'perturbed', or an array), the scale of the log shocks used for a
+        perturbed guess (default 0.1), and additional keyword arguments for
+        Solver.solve (which override solver_kwargs). Defaults to
+        default_strategies().
+    backend : str (default='numpy')
+        Backend used for numeric evaluation of the model.
+    processes : int (default=None)
+        Number of worker processes. Defaults to the number of strategies. If
+        1, then strategies are tried one at a time in the current process.
+    timeout : float (default=None)
+        Maximum wall clock time (in seconds) to wait for a converged result.
+        Defaults to no maximum.
+    seed : int (default=None)
+        Seed for the random number generator used for perturbed guesses.
+    solver_kwargs : dict
+        Additional keyword arguments passed to Solver.solve.
+
+    Returns
+    -------
+    result : scipy.optimize.OptimizeResult
+        Result of the winning strategy (or, if no strategy converged, of the
+        finished strategy with the smallest residual). The result has extra
+        attributes strategy (index of the winning strategy), race (list of
+        dictionaries with the index, method, success flag, number of
+        function evaluations, and wall clock time for each finished
+        strategy, in order of finishing), and time (wall clock time of the
+        whole race).
+
+    """
+    start = time.time()
+    if strategies is None:
+        strategies = default_strategies()
+    if processes is None:
+        processes = len(strategies)
+
+    tasks = []
+    for index, strategy in enumerate(strategies):
+        kwargs = dict(solver_kwargs)
+        kwargs.update((key, value) for key, value in strategy.items()
+                      if key not in ['guess', 'method', 'scale'])
+        initial_guess = _initial_guess(model, strategy,
+                                       None if seed is None else seed + index)
+        tasks.append((index, initial_guess, strategy['method'], kwargs))
+
+    finished = []
+    initargs = (model.params, model.physical_distances,
+                model.population[:model.number_cities], model.number_cities,
+                backend)
+
+    if processes == 1:
+        _initialize_worker(*initargs)
+        for task in tasks:
+            finished.append(_run_strategy(task))
+            if _converged(finished[-1][1]):
+                break
+            elif timeout is not None and time.time() - start > timeout:
+                break
+    else:
+        pool = multiprocessing.Pool(processes, _initialize_worker, initargs)
+        try:
+            results = pool.imap_unordered(_run_strategy, tasks)
+            for _ in tasks:
+                if timeout is None:
+                    finished.append(results.next())
+                else:
+                    remaining = max(timeout - (time.time() - start), 0)
+                    finished.append(results.next(remaining))
+                if _converged(finished[-1][1]):
+                    break
+        except multiprocessing.TimeoutError:
+            pass
+        finally:
+            # cancel any strategies that are still running
+            pool.terminate()
+            pool.join()
+
+    winners = [(index, result) for index, result, _ in finished
+               if _converged(result)]
+    candidates = [(index, result) for index, result, _ in finished]
+    if winners:
+        index, result = winners[0]
+    elif candidates:
+        index, result = min(candidates, key=lambda candidate:
+                            np.linalg.norm(candidate[1].get('fun', np.inf)))
+    else:
+        index = None
+        mesg = "No strategy finished before the timeout."
+        result = optimize.OptimizeResult(x=None, success=False, nfev=0,
+                                         message=mesg)
+
+    result.strategy = index
+    result.race = [{'strategy': i,
+                    'method': strategies[i]['method'],
+                    'success': _converged(r),
+                    'nfev': r.get('nfev', 0),
+                    'time': elapsed} for i, r, elapsed in finished]
+    result.time = time.time() - start
+    return result
@@ -1,8 +1,15 @@
+import time
+import warnings
+
 import numpy as np
+from scipy import linalg as dense_linalg
 from scipy import optimize
+from scipy.sparse import linalg
 import sympy as sym
 
+import kernels
 import models
+import numba_kernels
 
 
 class InitialGuess(object):
@@ -78,6 +85,11 @@ class IslandsGuess(InitialGuess):
         """
         The initial guess for the model equilibrium.
 
+        Each city is given the solution of the model for an economy
+        consisting of that city alone, using its own elasticity of
+        substitution params['theta'][h] (earlier versions used
+        params['theta'][0] for every city).
+
         :getter: Return current initial guess.
         :type: numpy.ndarray
 
@@ -86,29 +98,24 @@ class IslandsGuess(InitialGuess):
         P0 = np.repeat(1.0, self.number_cities-1)
 
         # initial guess for nominal gdp, wages, and number of firms
-        Y0 = np.empty(self.number_cities)
-        W0 = np.empty(self.number_cities)
-        M0 = np.empty(self.number_cities)
-
-        for h, population in enumerate(self.city.population[:self.number_cities]):
-            Y0[h] = self.city.compute_nominal_gdp(np.ones(1.0),
-                                                  np.array([population]),
-                                                  self.city.params)
-            W0[h] = self.city.compute_nominal_wage(np.ones(1.0),
-                                                   np.array([population]),
-                                                   self.city.params)
-            M0[h] = self.city.compute_number_firms(np.ones(1.0),
-                                                   np.array([population]),
-                                                   self.city.params)
+        population = self.city.population[:self.number_cities]
+        Y0, W0, M0 = self.city.compute_solution(np.ones(self.number_cities),
+                                                population, self.city.params)
 
         return np.hstack((P0, Y0, W0, M0))
 
 
 class HotStartGuess(InitialGuess):
 
+    __report = None
     __result = None
     __solution = None
     __solver = None
+    __timings = None
+
+    _growth_nfev = 20
+    _max_stride = 1
+    _solver_backend = 'sympy'
 
     @property
     def guess(self):
@@ -121,31 +128,126 @@ class HotStartGuess(InitialGuess):
         """
         self.__model = self.model
         self.__solution = self.city.solution
+        self.__report = []
+        self.__timings = []
+
+        target_number_cities = self.number_cities
+        number_cities, stride = 1, 1
+
+        while number_cities < target_number_cities:
+            start = time.time()
+            solves, nfev, njev = 0, 0, 0
+
+            while True:
+                next_number_cities = min(number_cities + stride,
+                                         target_number_cities)
+
+                # combine current solution with guesses for the new cities
+                self.__initial_guess = self._extend_solution(number_cities,
+                                                             next_number_cities)
+
+                self.__model.number_cities = next_number_cities
+                self.__solver = Solver(self.__model, backend=self.solver_backend)
+                self.__result = self.__solver.solve(self.__initial_guess,
+                                                    **self.solver_kwargs)
+                solves += 1
+                nfev += self.__result.get('nfev', 0)
+                njev += self.__result.get('njev', 0)
+
+                # if step fails, bisect the stride and try again
+                if self.__result.success or stride == 1:
+                    break
+                else:
+                    stride = stride // 2
 
-        for number_cities in range(1, self.number_cities):
+            self.__solution = self.__result.x
+            self.__report.append({'number_cities': next_number_cities,
+                                  'stride': next_number_cities - number_cities,
+                                  'success': self.__result.success,
+                                  'solves': solves,
+                                  'nfev': nfev,
+                                  'njev': njev})
+            self.__timings.append((next_number_cities, time.time() - start))
 
-            # split the current solution
-            P = self.__solution[:number_cities-1]
-            Y = self.__solution[number_cities-1:2 * number_cities-1]
-            W = self.__solution[2 * number_cities-1:3 * number_cities-1]
-            M = self.__solution[3 * number_cities-1:]
+            # if step was easy, grow the stride
+            if (self.__result.success and
+                    self.__result.get('nfev', 0) <= self.growth_nfev):
+                stride = min(2 * stride, self.max_stride)
 
-            # get the guess for the next city
-            P0, Y0, W0, M0 = self._guess_next_city(number_cities)
+            number_cities = next_number_cities
 
-            # then combine
-            self.__initial_guess = np.hstack((np.append(P, P0),
-                                              np.append(Y, Y0),
-                                              np.append(W, W0),
-                                              np.append(M, M0)))
+        return self.__solution
 
-            self.__model.number_cities = number_cities + 1
-            self.__solver = Solver(self.__model)
-            self.__result = self.__solver.solve(self.__initial_guess,
-                                                **self.solver_kwargs)
-            self.__solution = self.__result.x
+    @property
+    def growth_nfev(self):
+        """
+        Maximum number of function evaluations for a step that causes the
+        stride to grow.
 
-        return self.__solution
+        :getter: Return the current number of function evaluations.
+        :setter: Set a new number of function evaluations.
+        :type: int
+
+        """
+        return self._growth_nfev
+
+    @growth_nfev.setter
+    def growth_nfev(self, value):
+        """Set a new number of function evaluations."""
+        self._growth_nfev = value
+
+    @property
+    def max_stride(self):
+        """
+        Maximum number of cities to add to the model at each step.
+
+        With the default value of 1, cities are added one at a time. With
+        larger values the stride is doubled after each step that converges
+        using at most growth_nfev function evaluations (up to max_stride) and
+        is halved whenever a step fails to converge.
+
+        :getter: Return the current maximum stride.
+        :setter: Set a new maximum stride.
+        :type: int
+
+        """
+        return self._max_stride
+
+    @max_stride.setter
+    def max_stride(self, value):
+        """Set a new maximum stride."""
+        self._max_stride = self._validate_max_stride(value)
+
+    @property
+    def report(self):
+        """
+        Diagnostics for each step of the hot start.
+
+        :getter: Return a list of dictionaries with the number of cities, the
+            stride, a success flag, the number of solves (including any
+            failed attempts with larger strides), and the total number of
+            function and Jacobian evaluations used by each step.
+        :type: list
+
+        """
+        return self.__report
+
+    @property
+    def solver_backend(self):
+        """
+        Backend used by the solver at each step of the hot start.
+
+        :getter: Return the current backend.
+        :setter: Set a new backend.
+        :type: str
+
+        """
+        return self._solver_backend
+
+    @solver_backend.setter
+    def solver_backend(self, value):
+        """Set a new backend."""
+        self._solver_backend = Solver._validate_backend(value)
 
     @property
     def solver_kwargs(self):
@@ -163,28 +265,130 @@ class HotStartGuess(InitialGuess):
         """Set a new dictionary of solver keyword arugments."""
         self._solver_kwargs = value
 
-    def _guess_next_city(self, h):
-        """Initial guess for next city is the analytic "island" solution."""
-        tmp_params = self.city.params
-        tmp_population = np.array([self.city.population[h]])
+    @property
+    def timings(self):
+        """
+        Wall clock time (in seconds) taken by each step of the hot start.
+
+        Adding a city to the model extends (rather than rebuilds) the cached
+        symbolic equations and Jacobian. The numeric kernels still depend on
+        the number of cities and are lambdified again at every step, so with
+        the 'sympy' backend each step costs more than the last and hot
+        starting to N cities takes longer than building the model for N
+        cities once. The 'numpy' backend involves no symbolic work at all.
+
+        :getter: Return a list of (number_cities, seconds) tuples.
+        :type: list
+
+        """
+        return self.__timings
+
+    @classmethod
+    def _validate_max_stride(cls, value):
+        """Validate the max_stride attribute."""
+        if not isinstance(value, int):
+            mesg = "HotStartGuess.max_stride attribute must have type int, not {}"
+            raise AttributeError(mesg.format(value.__class__))
+        elif value < 1:
+            mesg = ("HotStartGuess.max_stride attribute must be greater " +
+                    "than or equal to 1.")
+            raise AttributeError(mesg)
+        else:
+            return value
+
+    def _extend_solution(self, number_cities, new_number_cities):
+        """Extend the current solution with guesses for some new cities."""
+        n = number_cities
 
-        # initial guess for a particular city h
-        P0 = np.ones(1.0)
-        Y0 = self.city.compute_nominal_gdp(P0, tmp_population, tmp_params)
-        W0 = self.city.compute_nominal_wage(P0, tmp_population, tmp_params)
-        M0 = self.city.compute_number_firms(P0, tmp_population, tmp_params)
+        # split the current solution
+        P = self.__solution[:n-1]
+        Y = self.__solution[n-1:2 * n-1]
+        W = self.__solution[2 * n-1:3 * n-1]
+        M = self.__solution[3 * n-1:]
+
+        # get the guesses for the new cities
+        P0, Y0, W0, M0 = self._guess_new_cities(number_cities, new_number_cities)
+
+        # then combine
+        return np.hstack((P, P0, Y, Y0, W, W0, M, M0))
+
+    def _guess_new_cities(self, number_cities, new_number_cities):
+        """Initial guess for new cities is the analytic "island" solution."""
+        tmp_population = self.city.population[number_cities:new_number_cities]
+        tmp_params = dict(self.city.params)
+        if np.ndim(tmp_params['theta']) > 0:
+            tmp_params['theta'] = tmp_params['theta'][number_cities:new_number_cities]
+
+        # initial guess for the new cities
+        P0 = np.ones(new_number_cities - number_cities)
+        Y0, W0, M0 = self.city.compute_solution(P0, tmp_population, tmp_params)
 
         return (P0, Y0, W0, M0)
 
 
+class IslandsPreconditioner(linalg.LinearOperator):
+
+    def __init__(self, solver, X):
+        """
+        Create an instance of the IslandsPreconditioner class.
+
+        The preconditioner approximates the inverse of the model Jacobian by
+        the inverse of its 4x4 diagonal blocks (i.e., the Jacobian of the
+        equations for each city treated as an island). The inverse blocks
+        take O(N) memory and are computed without forming any (N,N) arrays
+        (see Model.compute_jacobian_blocks).
+
+        Parameters
+        ----------
+        solver : solvers.Solver
+            An instance of the solvers.Solver class.
+        X : numpy.ndarray (shape=(4N-1,))
+            Values of the endogenous variables at which to evaluate the
+            diagonal blocks of the Jacobian.
+
+        """
+        N = solver.model.number_cities
+        super(IslandsPreconditioner, self).__init__(dtype=np.float64,
+                                                    shape=(4 * N - 1, 4 * N - 1))
+        self.solver = solver
+        self.update(X)
+
+    def _matvec(self, v):
+        """Apply the inverse of the diagonal blocks to some vector."""
+        N = self.solver.model.number_cities
+        v = np.concatenate(([0.0], np.ravel(v))).reshape(4, N).T
+        u = np.einsum('hij,hj->ih', self._inverse_blocks, v)
+        return u.ravel()[1:]
+
+    def update(self, X, F=None):
+        """Re-evaluate the diagonal blocks of the Jacobian at some new X."""
+        P, Y, W, M = self.solver._split(np.asarray(X))
+        model = self.solver.model
+        blocks = model.compute_jacobian_blocks(P, Y, W, M, model.population,
+                                               **model.params)
+        self._inverse_blocks = np.linalg.inv(blocks)
+
+
 class Solver(object):
 
     __numeric_jacobian = None
     __numeric_system = None
 
+    _fixed_point_options = {'maxiter': 1000, 'damping': 0.5, 'memory': 5}
+
+    _chord_options = {'maxiter': 100, 'max_backtracks': 10, 'contraction': 0.5}
+
+    _sparse_newton_options = {'maxiter': 50, 'max_backtracks': 10}
+
+    _newton_krylov_options = {'maxiter': 100, 'krylov_method': 'lgmres',
+                              'inner_maxiter': 20, 'line_search': 'armijo',
+                              'preconditioner': True}
+
     _modules = [{'ImmutableMatrix': np.array}, "numpy"]
 
-    def __init__(self, model):
+    _valid_backends = ['sympy', 'numpy', 'autowrap', 'numba']
+
+    def __init__(self, model, backend='sympy', reduced=False):
         """
         Create and instance of the Solver class.
 
@@ -192,9 +396,26 @@ class Solver(object):
         ----------
         model : model.model
             Instance of the model.Model class that you wish to solve.
+        backend : str (default='sympy')
+            Backend used for numeric evaluation of the model. Must be one of
+            'sympy' (lambdified symbolic equations and Jacobian), 'numpy'
+            (vectorized NumPy equations and closed-form Jacobian with no
+            symbolic step), 'autowrap' (symbolic equations and Jacobian
+            compiled to native code and cached on disk), or 'numba' (fused
+            loops compiled with Numba, falling back to 'numpy' if Numba is
+            not installed).
+        reduced : boolean (default=False)
+            Flag indicating whether to solve the reduced model in which
+            nominal gdp and the number of firms have been eliminated
+            analytically, leaving 2N-1 unknown price levels and wages. The
+            reduced model is always evaluated using vectorized NumPy
+            operations and solutions are returned using the same layout as
+            for the full model.
 
         """
         self.model = model
+        self.backend = backend
+        self.reduced = reduced
 
     @property
     def _numeric_jacobian(self):
@@ -206,9 +427,19 @@ class Solver(object):
 
         """
         if self.__numeric_jacobian is None:
-            self.__numeric_jacobian = sym.lambdify(self.model._symbolic_args,
-                                                   self.model._symbolic_jacobian,
-                                                   self._modules)
+            if self.backend == 'numpy':
+                self.__numeric_jacobian = self.model.compute_jacobian
+            elif self.backend == 'numba':
+                self.__numeric_jacobian = self._jit(numba_kernels.compute_jacobian,
+                                                    self.model.compute_jacobian)
+            elif self.backend == 'autowrap':
+                key = kernels.model_key(self.model, 'compiled_jacobian')
+                self.__numeric_jacobian = kernels.registry.get(key,
+                                                               self._compile_jacobian)
+            else:
+                key = kernels.model_key(self.model, 'jacobian')
+                self.__numeric_jacobian = kernels.registry.get(key,
+                                                               self._lambdify_jacobian)
         return self.__numeric_jacobian
 
     @property
@@ -221,35 +452,443 @@ class Solver(object):
 
         """
         if self.__numeric_system is None:
-            self.__numeric_system = sym.lambdify(self.model._symbolic_args,
-                                                 self.model._symbolic_system,
-                                                 self._modules)
+            if self.backend == 'numpy':
+                self.__numeric_system = self.model.compute_residual
+            elif self.backend == 'numba':
+                self.__numeric_system = self._jit(numba_kernels.compute_residual,
+                                                  self.model.compute_residual)
+            elif self.backend == 'autowrap':
+                key = kernels.model_key(self.model, 'compiled_system')
+                self.__numeric_system = kernels.registry.get(key,
+                                                             self._compile_system)
+            else:
+                key = kernels.model_key(self.model, 'system')
+                self.__numeric_system = kernels.registry.get(key,
+                                                             self._lambdify_system)
         return self.__numeric_system
 
+    @property
+    def backend(self):
+        """
+        Backend used for numeric evaluation of the model.
+
+        :getter: Return the current backend.
+        :setter: Set a new backend.
+        :type: str
+
+        """
+        return self._backend
+
+    @backend.setter
+    def backend(self, value):
+        """Set a new backend."""
+        self._backend = self._validate_backend(value)
+
+        # don't forget to clear cache!
+        self._clear_cache()
+
+    @property
+    def reduced(self):
+        """
+        Flag indicating whether to solve the reduced model.
+
+        :getter: Return the current flag.
+        :setter: Set a new flag.
+        :type: boolean
+
+        """
+        return self._reduced
+
+    @reduced.setter
+    def reduced(self, value):
+        """Set a new flag."""
+        self._reduced = value
+
+    def _clear_cache(self):
+        """Clear all cached values."""
+        self.__numeric_jacobian = None
+        self.__numeric_system = None
+
+    def _compile_jacobian(self):
+        """Compile (or load) native code for the symbolic Jacobian."""
+        build = lambda: self.model._symbolic_jacobian
+        return kernels.compiled_kernels.get(self.model, 'jacobian', build)
+
+    def _compile_system(self):
+        """Compile (or load) native code for the symbolic system."""
+        build = lambda: self.model._symbolic_system
+        return kernels.compiled_kernels.get(self.model, 'system', build)
+
+    def _jit(self, kernel, fallback):
+        """Wrap a Numba kernel, falling back to NumPy if Numba is missing."""
+        if not numba_kernels.available:
+            mesg = "Numba is not installed; using the 'numpy' backend instead."
+            warnings.warn(mesg)
+            return fallback
+
+        model = self.model
+
+        def function(P, Y, W, M, L, f, beta, phi, tau, theta):
+            """Evaluate the Numba kernel."""
+            N = model.number_cities
+            return kernel(P, Y, W, M, L[:N], float(f), float(beta),
+                          float(phi), float(tau), theta[:N],
+                          model.physical_distances)
+
+        return function
+
+    def _lambdify_jacobian(self):
+        """Lambdify the symbolic Jacobian for the current model."""
+        return sym.lambdify(self.model._symbolic_args,
+                            self.model._symbolic_jacobian,
+                            self._modules,
+                            cse=True)
+
+    def _lambdify_system(self):
+        """Lambdify the symbolic system for the current model."""
+        return sym.lambdify(self.model._symbolic_args,
+                            self.model._symbolic_system,
+                            self._modules,
+                            cse=True)
+
+    @classmethod
+    def _validate_backend(cls, value):
+        """Validate the backend attribute."""
+        if value not in cls._valid_backends:
+            mesg = "Solver.backend attribute must be one of {}, not {}"
+            raise AttributeError(mesg.format(cls._valid_backends, value))
+        else:
+            return value
+
+    def _split(self, X):
+        """Split (possibly stacked) X into arrays of P, Y, W, and M."""
+        N = self.model.number_cities
+        P = np.concatenate((np.ones(X.shape[:-1] + (1,)), X[..., :N-1]), axis=-1)
+        Y = X[..., N-1:2 * N-1]
+        W = X[..., 2 * N-1:3 * N-1]
+        M = X[..., 3 * N-1:]
+        return P, Y, W, M
+
+    def _fixed_point_update(self, x):
+        """Apply the fixed point map to log price levels and wages."""
+        N = self.model.number_cities
+        P, W = self.model.compute_fixed_point_update(np.exp(x[:N]),
+                                                     np.exp(x[N:]),
+                                                     self.model.population,
+                                                     **self.model.params)
+        updated_x = np.log(np.concatenate((P, W)))
+        return updated_x - updated_x[0]  # normalize P[0] = 1
+
+    def _solve_chord(self, system, jacobian, initial_guess, tol=1e-10,
+                     options=None):
+        """
+        Solve a system of non-linear equations using a chord (Shamanskii)
+        variant of Newton's method that reuses an LU factorization of the
+        Jacobian for as long as the residual contracts quickly enough.
+
+        The factorization is refreshed once the norm of the residual falls by
+        less than a factor of contraction in some iteration (or when the
+        backtracking line search fails with a stale Jacobian). Iteration
+        stops once the largest residual is less than tol. The options
+        dictionary may specify maxiter (default 100), max_backtracks (default
+        10), and contraction (default 0.5). The result reports the number of
+        residual evaluations (nfev), Jacobian evaluations (njev), and LU
+        factorizations (nlu).
+
+        """
+        options = dict(self._chord_options, **(options or {}))
+        X = np.asarray(initial_guess, dtype=np.float64)
+        residual = system(X)
+        norm = np.linalg.norm(residual)
+        nfev, njev, nlu = 1, 0, 0
+        factorization, fresh = None, False
+
+        for nit in range(options['maxiter'] + 1):
+            if np.max(np.abs(residual)) < tol:
+                success, status = True, 1
+                message = "The residual is less than tol."
+                break
+            elif nit == options['maxiter']:
+                success, status = False, 2
+                message = "The maximum number of iterations was reached."
+                break
+
+            if factorization is None:
+                factorization = dense_linalg.lu_factor(jacobian(X))
+                njev += 1
+                nlu += 1
+                fresh = True
+            step = dense_linalg.lu_solve(factorization, -residual)
+
+            # backtrack until variables are positive and the residual decreases
+            for backtrack in range(options['max_backtracks'] + 1):
+                new_X = X + step
+                if (new_X > 0).all():
+                    new_residual = system(new_X)
+                    new_norm = np.linalg.norm(new_residual)
+                    nfev += 1
+                    if new_norm < norm:
+                        break
+                step = step / 2
+            else:
+                if fresh:
+                    success, status = False, 3
+                    message = "The line search failed to reduce the residual."
+                    break
+                else:
+                    # stale Jacobian is no longer a descent direction
+                    factorization = None
+                    continue
+
+            # refresh the Jacobian if the residual has stopped contracting
+            if new_norm > options['contraction'] * norm:
+                factorization = None
+            fresh = False
+            X, residual, norm = new_X, new_residual, new_norm
+
+        return optimize.OptimizeResult(x=X, fun=residual, success=success,
+                                       status=status, message=message,
+                                       nit=nit, nfev=nfev, njev=njev, nlu=nlu)
+
+    def _solve_fixed_point(self, initial_guess, tol=1e-10, options=None):
+        """
+        Solve for the model equilibrium by Anderson accelerated, damped
+        fixed point iteration on log price levels and wages.
+
+        The map is Model.compute_fixed_point_update, so no Jacobian is
+        required. Iteration stops once the largest change in log price levels
+        and wages implied by the map is less than tol. The options dictionary
+        may specify maxiter (default 1000), damping (default 0.5), and memory
+        (the number of previous steps used for acceleration, default 5).
+
+        """
+        options = dict(self._fixed_point_options, **(options or {}))
+        damping, memory = options['damping'], options['memory']
+
+        P, _, W, _ = self._split(np.asarray(initial_guess))
+        x = np.log(np.concatenate((P, W)))
+        residual = self._fixed_point_update(x) - x
+        nfev, delta_x, delta_residual = 1, [], []
+
+        for nit in range(options['maxiter'] + 1):
+            if np.max(np.abs(residual)) < tol:
+                success, status = True, 1
+                message = "The fixed point residual is less than tol."
+                break
+            elif nit == options['maxiter']:
+                success, status = False, 2
+                message = "The maximum number of iterations was reached."
+                break
+
+            # damped step, corrected using the history of previous steps
+            step = damping * residual
+            if delta_x:
+                dX, dF = np.column_stack(delta_x), np.column_stack(delta_residual)
+                gamma = np.linalg.lstsq(dF, residual, rcond=None)[0]
+                step -= (dX + damping * dF).dot(gamma)
+
+            new_x = x + step
+            new_residual = self._fixed_point_update(new_x) - new_x
+            nfev += 1
+
+            # if the accelerated step fails, restart from a damped step
+            if delta_x and not np.isfinite(new_residual).all():
+                delta_x, delta_residual = [], []
+                new_x = x + damping * residual
+                new_residual = self._fixed_point_update(new_x) - new_x
+                nfev += 1
+
+            delta_x = (delta_x + [new_x - x])[-memory:]
+            delta_residual = (delta_residual + [new_residual - residual])[-memory:]
+            x, residual = new_x, new_residual
+
+        # recover nominal gdp and number of firms
+        X = self.expand(np.exp(x[1:]))
+        P, Y, W, M = self._split(X)
+        fun = self.model.compute_residual(P, Y, W, M, self.model.population,
+                                          **self.model.params)
+
+        return optimize.OptimizeResult(x=X, fun=fun, success=success,
+                                       status=status, message=message,
+                                       nit=nit, nfev=nfev)
+
+    def _solve_newton_krylov(self, initial_guess, tol=1e-10, options=None):
+        """
+        Solve for the model equilibrium using a Jacobian-free Newton-Krylov
+        method preconditioned by the Jacobians of the isolated cities.
+
+        The residual is always evaluated using vectorized NumPy operations
+        (whatever the backend) so that the symbolic equations are never built.
+        Iteration stops once the largest residual is less than tol. The
+        options dictionary may specify maxiter (default 100), krylov_method
+        (default 'lgmres'), inner_maxiter (default 20), line_search (default
+        'armijo'), and preconditioner (default True, see
+        IslandsPreconditioner).
+
+        """
+        options = dict(self._newton_krylov_options, **(options or {}))
+        initial_guess = np.asarray(initial_guess, dtype=np.float64)
+        if options['preconditioner']:
+            preconditioner = IslandsPreconditioner(self, initial_guess)
+        else:
+            preconditioner = None
+
+        evaluations = {'nfev': 0, 'nit': 0}
+
+        def system(X):
+            evaluations['nfev'] += 1
+            return self._evaluate(self.model.compute_residual, X)
+
+        def callback(X, F):
+            evaluations['nit'] += 1
+
+        try:
+            x = optimize.newton_krylov(system, initial_guess,
+                                       method=options['krylov_method'],
+                                       inner_maxiter=options['inner_maxiter'],
+                                       inner_M=preconditioner,
+                                       maxiter=options['maxiter'],
+                                       f_tol=tol,
+                                       line_search=options['line_search'],
+                                       callback=callback)
+            success, status = True, 1
+            message = "The residual is less than tol."
+        except optimize.NoConvergence as error:
+            x = error.args[0]
+            success, status = False, 2
+            message = "The solver failed to converge."
+
+        fun = self._evaluate(self.model.compute_residual, x)
+        return optimize.OptimizeResult(x=x, fun=fun, success=success,
+                                       status=status, message=message,
+                                       nit=evaluations['nit'],
+                                       nfev=evaluations['nfev'])
+
+    def _solve_sparse_newton(self, initial_guess, tol=1e-10, options=None):
+        """
+        Solve for the model equilibrium with trade restricted to the trade
+        network using Newton's method with sparse LU factorizations of the
+        Jacobian.
+
+        A backtracking line search keeps all variables positive. Iteration
+        stops once the largest residual is less than tol. The options
+        dictionary may specify maxiter (default 50) and max_backtracks
+        (default 10).
+
+        """
+        options = dict(self._sparse_newton_options, **(options or {}))
+        X = np.asarray(initial_guess, dtype=np.float64)
+        residual = self.sparse_system(X)
+        nfev, njev = 1, 0
+
+        for nit in range(options['maxiter'] + 1):
+            if np.max(np.abs(residual)) < tol:
+                success, status = True, 1
+                message = "The residual is less than tol."
+                break
+            elif nit == options['maxiter']:
+                success, status = False, 2
+                message = "The maximum number of iterations was reached."
+                break
+
+            step = linalg.splu(self.sparse_jacobian(X)).solve(-residual)
+            njev += 1
+
+            # backtrack until variables are positive and the residual decreases
+            norm = np.linalg.norm(residual)
+            for backtrack in range(options['max_backtracks'] + 1):
+                new_X = X + step
+                if (new_X > 0).all():
+                    new_residual = self.sparse_system(new_X)
+                    nfev += 1
+                    if np.linalg.norm(new_residual) < norm:
+                        break
+                step = step / 2
+            else:
+                success, status = False, 3
+                message = "The line search failed to reduce the residual."
+                break
+            X, residual = new_X, new_residual
+
+        return optimize.OptimizeResult(x=X, fun=residual, success=success,
+                                       status=status, message=message,
+                                       nit=nit, nfev=nfev, njev=njev)
+
+    def _split_reduced(self, X):
+        """Split (possibly stacked) reduced X into arrays of P and W."""
+        N = self.model.number_cities
+        P = np.concatenate((np.ones(X.shape[:-1] + (1,)), X[..., :N-1]), axis=-1)
+        W = X[..., N-1:]
+        return P, W
+
+    def _stacked_params(self, k):
+        """Parameter dictionary for the k-th of some stacked parameters."""
+        params = {}
+        for name, value in self.model.params.items():
+            if np.ndim(value) > (1 if name == 'theta' else 0):
+                value = value[k]
+            params[name] = value
+        return params
+
+    def _evaluate(self, function, X):
+        """Evaluate a numeric function at (possibly stacked) X."""
+        P, Y, W, M = self._split(X)
+        if X.ndim == 1 or self.backend == 'numpy':
+            return function(P, Y, W, M, self.model.population,
+                            **self.model.params)
+        else:
+            # lambdified and compiled kernels only handle one point at a time
+            return np.array([function(P[k], Y[k], W[k], M[k],
+                                      self.model.population,
+                                      **self._stacked_params(k))
+                             for k in range(X.shape[0])])
+
     def system(self, X):
         """
         System of non-linear equations defining the model equilibrium.
 
         Parameters
         ----------
-        X : numpy.ndarray
-            Array containing values of the endogenous variables.
+        X : numpy.ndarray (shape=(4N-1,) or (K,4N-1))
+            Array containing values of the endogenous variables. If X is a
+            two-dimensional array, then each row is a separate point and
+            the model parameters may be stacked along a leading axis of
+            length K (i.e., f, beta, phi, and tau with shape (K,) and theta
+            with shape (K,N)).
 
         Returns
         -------
-        residual : numpy.ndarray
+        residual : numpy.ndarray (shape=(4N-1,) or (K,4N-1))
             Value of the model residual given current values of endogenous
             variables and parameters.
 
         """
-        P = np.append(np.ones(1.0), X[:self.model.number_cities-1])
-        Y = X[self.model.number_cities-1:2 * self.model.number_cities-1]
-        W = X[2 * self.model.number_cities-1:3 * self.model.number_cities-1]
-        M = X[3 * self.model.number_cities-1:]
-        residual = self._numeric_system(P, Y, W, M,
-                                        self.model.population,
-                                        **self.model.params)
-        return residual.ravel()
+        X = np.asarray(X)
+        residual = self._evaluate(self._numeric_system, X)
+        return residual.reshape(X.shape)
+
+    def expand(self, X):
+        """
+        Expand a solution of the reduced model into a solution of the full
+        model.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (shape=(2N-1,) or (K,2N-1))
+            Array containing values of price levels (excluding P[0]) and
+            nominal wages.
+
+        Returns
+        -------
+        X : numpy.ndarray (shape=(4N-1,) or (K,4N-1))
+            Array containing values of all endogenous variables.
+
+        """
+        P, W = self._split_reduced(np.asarray(X))
+        Y, M = self.model.compute_eliminated_variables(P, W,
+                                                       self.model.population,
+                                                       **self.model.params)
+        return np.concatenate((P[..., 1:], Y, W, M), axis=-1)
 
     def jacobian(self, X):
         """
@@ -258,25 +897,185 @@ class Solver(object):
 
         Parameters
         ----------
-        X : numpy.ndarray
+        X : numpy.ndarray (shape=(4N-1,) or (K,4N-1))
+            Array containing values of the endogenous variables. See system
+            for details on stacked inputs.
+
+        Returns
+        -------
+        jac : numpy.ndarray (shape=(4N-1,4N-1) or (K,4N-1,4N-1))
+            Jacobian matrix of partial derivatives.
+
+        """
+        X = np.asarray(X)
+        jac = self._evaluate(self._numeric_jacobian, X)
+        return jac.reshape(X.shape + X.shape[-1:])
+
+    def reduce(self, X):
+        """
+        Extract the price levels and nominal wages from (possibly stacked)
+        values of the endogenous variables of the full model.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (shape=(4N-1,) or (K,4N-1))
+            Array containing values of all endogenous variables.
+
+        Returns
+        -------
+        X : numpy.ndarray (shape=(2N-1,) or (K,2N-1))
+            Array containing values of price levels (excluding P[0]) and
+            nominal wages.
+
+        """
+        P, _, W, _ = self._split(np.asarray(X))
+        return np.concatenate((P[..., 1:], W), axis=-1)
+
+    def reduced_jacobian(self, X):
+        """
+        Jacobian matrix of partial derivatives for the reduced system of
+        non-linear equations.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (shape=(2N-1,) or (K,2N-1))
+            Array containing values of price levels (excluding P[0]) and
+            nominal wages.
+
+        Returns
+        -------
+        jac : numpy.ndarray (shape=(2N-1,2N-1) or (K,2N-1,2N-1))
+            Jacobian matrix of partial derivatives.
+
+        """
+        P, W = self._split_reduced(np.asarray(X))
+        return self.model.compute_reduced_jacobian(P, W, self.model.population,
+                                                   **self.model.params)
+
+    def reduced_system(self, X):
+        """
+        Reduced system of non-linear equations defining the model
+        equilibrium in terms of price levels and nominal wages only.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (shape=(2N-1,) or (K,2N-1))
+            Array containing values of price levels (excluding P[0]) and
+            nominal wages.
+
+        Returns
+        -------
+        residual : numpy.ndarray (shape=(2N-1,) or (K,2N-1))
+            Value of the reduced model residual.
+
+        """
+        P, W = self._split_reduced(np.asarray(X))
+        return self.model.compute_reduced_residual(P, W, self.model.population,
+                                                   **self.model.params)
+
+    def sensitivities(self, X, names, elasticities=False):
+        """
+        Sensitivities of an equilibrium to the model parameters computed
+        using the implicit function theorem.
+
+        Differentiating F(X, params) = 0 implies that dX/dparam solves the
+        linear system J dX/dparam = -dF/dparam where J is the Jacobian of
+        the model residual. The Jacobian is factored once and the
+        derivatives with respect to all parameters (including one column
+        for each city for L and theta) are obtained from that single
+        factorization by solving with multiple right-hand sides.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (shape=(4N-1,))
+            Array containing equilibrium values of the endogenous variables.
+        names : list
+            Names of the parameters. Valid names are 'f', 'beta', 'phi',
+            'tau', 'L' (the population of each city), and 'theta' (the
+            elasticity of substitution for goods sold in each city).
+        elasticities : boolean (default=False)
+            If True, return the elasticities d log(X) / d log(param) rather
+            than the derivatives dX/dparam.
+
+        Returns
+        -------
+        sensitivities : dict
+            Dictionary mapping each parameter name to an array of shape
+            (4N-1,) for the scalar parameters or (4N-1,N) for L and theta
+            (with column k giving the response to the parameter for city k).
+
+        """
+        X = np.asarray(X)
+        P, Y, W, M = self._split(X)
+        params = self.model.params
+        jacs = self.model.compute_parameter_jacobian(P, Y, W, M,
+                                                     self.model.population,
+                                                     names=names, **params)
+
+        # stack derivatives to solve all right-hand sides at once
+        columns = [jac.reshape(X.size, -1) for jac in jacs]
+        lu_and_piv = dense_linalg.lu_factor(self.jacobian(X))
+        dX = dense_linalg.lu_solve(lu_and_piv, -np.hstack(columns))
+
+        N = self.model.number_cities
+        sensitivities = {}
+        start = 0
+        for name, jac, column in zip(names, jacs, columns):
+            stop = start + column.shape[1]
+            derivative = dX[:, start:stop].reshape(jac.shape)
+            if elasticities and name in ['L', 'theta']:
+                value = self.model.population if name == 'L' else params[name]
+                derivative = derivative * value[:N] / X[:, np.newaxis]
+            elif elasticities:
+                derivative = derivative * params[name] / X
+            sensitivities[name] = derivative
+            start = stop
+
+        return sensitivities
+
+    def sparse_jacobian(self, X):
+        """
+        Sparse Jacobian matrix of partial derivatives for the system of
+        non-linear equations defining the model equilibrium when trade is
+        restricted to the pairs of cities in the model's trade network.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (shape=(4N-1,))
             Array containing values of the endogenous variables.
 
         Returns
         -------
-        jac : numpy.ndarray
+        jac : scipy.sparse.csc_matrix (shape=(4N-1,4N-1))
             Jacobian matrix of partial derivatives.
 
         """
-        P = np.append(np.ones(1.0), X[:self.model.number_cities-1])
-        Y = X[self.model.number_cities-1:2 * self.model.number_cities-1]
-        W = X[2 * self.model.number_cities-1:3 * self.model.number_cities-1]
-        M = X[3 * self.model.number_cities-1:]
+        P, Y, W, M = self._split(np.asarray(X))
+        return self.model.compute_sparse_jacobian(P, Y, W, M,
+                                                  self.model.population,
+                                                  **self.model.params)
 
-        jac = self._numeric_jacobian(P, Y, W, M,
-                                     self.model.population,
-                                     **self.model.params)
+    def sparse_system(self, X):
+        """
+        System of non-linear equations defining the model equilibrium when
+        trade is restricted to the pairs of cities in the model's trade
+        network.
 
-        return jac
+        Parameters
+        ----------
+        X : numpy.ndarray (shape=(4N-1,))
+            Array containing values of the endogenous variables.
+
+        Returns
+        -------
+        residual : numpy.ndarray (shape=(4N-1,))
+            Value of the model residual.
+
+        """
+        P, Y, W, M = self._split(np.asarray(X))
+        return self.model.compute_sparse_residual(P, Y, W, M,
+                                                  self.model.population,
+                                                  **self.model.params)
 
     def solve(self, initial_guess, method='hybr', with_jacobian=True, **kwargs):
         """
@@ -287,7 +1086,23 @@ class Solver(object):
         guess : numpy.ndarray
         method : str (default='hybr')
             Valid method used to find the root of the non-linear system. See
-            scipy.optimize.root for a complete list of valid methods.
+            scipy.optimize.root for a complete list of valid methods. The
+            following additional methods are also supported:
+
+            * 'fixed_point': damped fixed point iteration on price levels
+              and wages with Anderson acceleration (no Jacobian required).
+            * 'newton_krylov': Jacobian-free Newton-Krylov method
+              preconditioned by the Jacobians of the isolated cities.
+            * 'sparse_newton': Newton's method with sparse LU factorizations,
+              with trade restricted to the pairs of cities in
+              model.trade_network.
+            * 'chord': Newton's method reusing the LU factorization of the
+              Jacobian for several iterations.
+
+            Each additional method accepts tol (default 1e-10) and an options
+            dictionary, described in the corresponding _solve_* method. The
+            reduced flag is ignored by 'fixed_point', 'newton_krylov', and
+            'sparse_newton'.
         with_jacobian : boolean (default=True)
             Flag indicating whether to used the exact jacobian or a finite
             difference approximation of the exact jacobian.
@@ -298,19 +1113,44 @@ class Solver(object):
             The solution represented as a OptimizeResult object. Important
             attributes are: x the solution array, success a Boolean flag
             indicating if the algorithm exited successfully and message which
-            describes the cause of the termination.
+            describes the cause of the termination. If the solver is using
+            the reduced model, then x and fun are expanded to the full set
+            of endogenous variables and equations.
 
         """
-        if with_jacobian:
-            jacobian = self.jacobian
+        if method == 'fixed_point':
+            return self._solve_fixed_point(initial_guess, **kwargs)
+        elif method == 'newton_krylov':
+            return self._solve_newton_krylov(initial_guess, **kwargs)
+        elif method == 'sparse_newton':
+            return self._solve_sparse_newton(initial_guess, **kwargs)
+
+        if self.reduced:
+            system, jacobian = self.reduced_system, self.reduced_jacobian
+            initial_guess = self.reduce(initial_guess)
         else:
-            jacobian = False
+            system, jacobian = self.system, self.jacobian
 
         # solve for the model equilibrium
-        result = optimize.root(self.system,
-                               x0=initial_guess,
-                               jac=jacobian,
-                               method=method,
-                               **kwargs
-                               )
+        if method == 'chord':
+            result = self._solve_chord(system, jacobian, initial_guess,
+                                       **kwargs)
+        else:
+            if not with_jacobian:
+                jacobian = False
+            result = optimize.root(system,
+                                   x0=initial_guess,
+                                   jac=jacobian,
+                                   method=method,
+                                   **kwargs
+                                   )
+
+        # recover nominal gdp and number of firms
+        if self.reduced:
+            result.x = self.expand(result.x)
+            P, Y, W, M = self._split(result.x)
+            result.fun = self.model.compute_residual(P, Y, W, M,
+                                                     self.model.population,
+                                                     **self.model.params)
+
         return result
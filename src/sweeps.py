@@ -0,0 +1,175 @@
+"""
+Functions for solving the model over grids of parameter values in parallel.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import itertools
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+
+import models
+import solvers
+
+# model and solver are created once per worker process and then reused
+_worker_model = None
+_worker_solver = None
+_worker_solver_kwargs = None
+
+
+def parameter_grid(**grids):
+    """
+    Cartesian product of some grids of parameter values.
+
+    Parameters
+    ----------
+    grids : dict
+        Dictionary mapping parameter names to iterables of values.
+
+    Returns
+    -------
+    params : list
+        List of parameter dictionaries, one for each point in the grid.
+
+    """
+    names = sorted(grids.keys())
+    values = [grids[name] for name in names]
+    return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+
+def variable_names(number_cities):
+    """
+    Names of the endogenous variables in the solution vector.
+
+    Parameters
+    ----------
+    number_cities : int
+        Number of cities in the economy.
+
+    Returns
+    -------
+    names : list
+        List of variable names (i.e., 'P[1]', ..., 'M[N-1]').
+
+    """
+    N = number_cities
+    names = (['P[{}]'.format(h) for h in range(1, N)] +
+             ['Y[{}]'.format(h) for h in range(N)] +
+             ['W[{}]'.format(h) for h in range(N)] +
+             ['M[{}]'.format(h) for h in range(N)])
+    return names
+
+
+def _initialize_worker(physical_distances, population, number_cities,
+                       backend, solver_kwargs):
+    """Create the model and solver used by a worker process."""
+    global _worker_model, _worker_solver, _worker_solver_kwargs
+    params = {'f': 1.0, 'beta': 1.0, 'phi': 1.0, 'tau': 1.0,
+              'theta': np.ones(number_cities)}
+    _worker_model = models.Model(params=params,
+                                 physical_distances=physical_distances,
+                                 population=population)
+    _worker_model.number_cities = number_cities
+    _worker_solver = solvers.Solver(_worker_model, backend=backend)
+    _worker_solver_kwargs = solver_kwargs
+
+
+def _solve_chunk(chunk):
+    """Solve the model for each (index, params) pair in a chunk."""
+    results = []
+    for index, params in chunk:
+        start = time.time()
+        params = dict(params)
+        if np.ndim(params['theta']) == 0:
+            params['theta'] = np.repeat(params['theta'],
+                                        _worker_model.number_cities)
+        _worker_model.params = params
+
+        initial_guess = solvers.IslandsGuess(_worker_model).guess
+        result = _worker_solver.solve(initial_guess, **_worker_solver_kwargs)
+        results.append((index, result.x, result.success,
+                        result.get('nfev', 0), time.time() - start))
+
+    return results
+
+
+def sweep(params, physical_distances, population, number_cities,
+          backend='numpy', processes=None, chunksize=None, **solver_kwargs):
+    """
+    Solve the model for each of a list of parameter dictionaries.
+
+    Parameters
+    ----------
+    params : list
+        List of parameter dictionaries (see parameter_grid). If a dictionary
+        specifies a single value for theta, then that value is used for every
+        city.
+    physical_distances : numpy.ndarray (shape=(N,N))
+        Square array of pairwise measures of physical distance between cities.
+    population : numpy.ndarray (shape=(N,))
+        Array of total population for each city.
+    number_cities : int
+        Number of cities in the economy.
+    backend : str (default='numpy')
+        Backend used for numeric evaluation of the model.
+    processes : int (default=None)
+        Number of worker processes. Defaults to the number of CPUs. If 1,
+        then the model is solved in the current process.
+    chunksize : int (default=None)
+        Number of parameter dictionaries sent to a worker at a time. Defaults
+        to splitting the work into roughly four chunks per worker.
+    solver_kwargs : dict
+        Additional keyword arguments passed to Solver.solve.
+
+    Returns
+    -------
+    results : pandas.DataFrame
+        Table with one row per parameter dictionary (in the same order as
+        params) containing the parameter values, the solution vector (one
+        column per endogenous variable), a convergence flag, the number of
+        function evaluations, and the wall clock time taken by the solve.
+        If params is empty, then the table has no rows.
+
+    """
+    if len(params) == 0:
+        columns = variable_names(number_cities) + ['success', 'nfev', 'time']
+        return pd.DataFrame(columns=columns)
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, len(params) // (4 * processes))
+
+    tasks = list(enumerate(params))
+    chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+    initargs = (physical_distances, population, number_cities, backend,
+                solver_kwargs)
+
+    if processes == 1:
+        _initialize_worker(*initargs)
+        results = [_solve_chunk(chunk) for chunk in chunks]
+    else:
+        pool = multiprocessing.Pool(processes, _initialize_worker, initargs)
+        try:
+            results = list(pool.imap_unordered(_solve_chunk, chunks))
+        finally:
+            pool.close()
+            pool.join()
+
+    # results arrive in whatever order the workers finish
+    rows = sorted(itertools.chain.from_iterable(results), key=lambda row: row[0])
+    index, solutions, success, nfev, timings = zip(*rows)
+
+    table = pd.DataFrame(list(params))
+    solutions = pd.DataFrame(np.vstack(solutions),
+                             columns=variable_names(number_cities))
+    table = pd.concat([table, solutions], axis=1)
+    table['success'] = success
+    table['nfev'] = nfev
+    table['time'] = timings
+
+    return table
@@ -0,0 +1,122 @@
+"""
+Test suite for the continuation.py module.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import nose
+
+import numpy as np
+
+import continuation
+import master_data
+import models
+import solvers
+
+# grab data on physical distances
+physical_distances = np.load('../data/google/normed_vincenty_distance.npy')
+
+# compute the effective labor supply
+raw_data = master_data.panel.minor_xs(2010)
+clean_data = raw_data.sort('GDP_MP', ascending=False).drop([998, 48260])
+population = clean_data['POP_MI'].values
+
+# define some parameters
+N = 380
+params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+          'theta': np.repeat(10.0, N)}
+
+
+def test_trace():
+    """Compare results of parameter continuation with independent solves."""
+    model = models.Model(params=dict(params),
+                         physical_distances=physical_distances,
+                         population=population)
+    model.number_cities = np.random.randint(2, 25)
+    solver = solvers.Solver(model, backend='numpy')
+    initial_guess = solvers.IslandsGuess(model).guess
+
+    path = continuation.ParameterContinuation(solver, 'tau')
+    for value, solution, diagnostics in path.trace(np.linspace(0.05, 1.0, 5),
+                                                   initial_guess, tol=1e-12):
+        nose.tools.assert_true(diagnostics['success'])
+
+        # solve independently starting from the islands guess
+        result = solver.solve(solvers.IslandsGuess(model).guess, tol=1e-12)
+        np.testing.assert_almost_equal(solution, result.x,
+                                       err_msg="tau: {}".format(value))
+
+
+def test_duplicate_values():
+    """Testing continuation along a path starting with duplicate values."""
+    model = models.Model(params=dict(params),
+                         physical_distances=physical_distances,
+                         population=population)
+    model.number_cities = 5
+    solver = solvers.Solver(model, backend='numpy')
+    initial_guess = solvers.IslandsGuess(model).guess
+
+    path = continuation.ParameterContinuation(solver, 'tau')
+    values = [0.05, 0.05, 0.1]
+    trace = list(path.trace(values, initial_guess, tol=1e-12))
+    nose.tools.assert_equal([value for value, _, _ in trace], values)
+    nose.tools.assert_true(all(diagnostics['success']
+                               for _, _, diagnostics in trace))
+
+    # non-positive steps would never reach the next value
+    with nose.tools.assert_raises(ValueError):
+        path.trace(values, initial_guess, initial_step=0.0)
+    with nose.tools.assert_raises(ValueError):
+        path.trace(values, initial_guess, max_step=-1.0)
+
+
+class BoundedSolver(solvers.Solver):
+    """Solver that fails for values of tau above some bound."""
+
+    bound = 0.1
+
+    def solve(self, initial_guess, **kwargs):
+        result = super(BoundedSolver, self).solve(initial_guess, **kwargs)
+        if self.model.params['tau'] > self.bound:
+            result.success = False
+        return result
+
+
+def test_failed_corrections():
+    """Testing continuation stops at the last value reached."""
+    model = models.Model(params=dict(params),
+                         physical_distances=physical_distances,
+                         population=population)
+    model.number_cities = 5
+    solver = BoundedSolver(model, backend='numpy')
+    initial_guess = solvers.IslandsGuess(model).guess
+
+    # the path gets as close to the bound as the minimum step allows...
+    path = continuation.ParameterContinuation(solver, 'tau')
+    trace = list(path.trace([0.05, 0.2, 0.3], initial_guess,
+                            min_step=1e-3, tol=1e-12))
+    nose.tools.assert_equal(len(trace), 2)
+    value, solution, diagnostics = trace[-1]
+    nose.tools.assert_false(diagnostics['success'])
+    nose.tools.assert_true(0.1 - 2e-3 <= value <= 0.1)
+
+    # ...and the solution yielded belongs to the value yielded
+    model.params = dict(params, tau=value)
+    result = solvers.Solver(model, backend='numpy').solve(solution, tol=1e-12)
+    np.testing.assert_almost_equal(solution, result.x)
+
+    # nothing is traced from a failed initial solve
+    solver.bound = 0.0
+    trace = list(path.trace([0.05, 0.1], initial_guess, tol=1e-12))
+    nose.tools.assert_equal(len(trace), 1)
+    nose.tools.assert_false(trace[0][2]['success'])
+
+
+def test_validate_param():
+    """Testing validation method for param attribute."""
+    model = models.Model(params=dict(params),
+                         physical_distances=physical_distances,
+                         population=population)
+    with nose.tools.assert_raises(AttributeError):
+        continuation.ParameterContinuation(solvers.Solver(model), 'L')
@@ -0,0 +1,109 @@
+"""
+Test suite for the counterfactuals.py module.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import nose
+
+import numpy as np
+
+import counterfactuals
+import master_data
+import models
+import solvers
+
+# grab data on physical distances
+physical_distances = np.load('../data/google/normed_vincenty_distance.npy')
+
+# compute the effective labor supply
+raw_data = master_data.panel.minor_xs(2010)
+clean_data = raw_data.sort('GDP_MP', ascending=False).drop([998, 48260])
+population = clean_data['POP_MI'].values
+
+# define some parameters
+N = 380
+params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+          'theta': np.repeat(10.0, N)}
+
+
+def _solve_baseline(number_cities):
+    """Solve the model for the baseline equilibrium."""
+    model = models.Model(params=dict(params),
+                         physical_distances=physical_distances,
+                         population=population)
+    model.number_cities = number_cities
+    solver = solvers.Solver(model, backend='numpy')
+    result = solver.solve(solvers.IslandsGuess(model).guess, tol=1e-12)
+    return solver, result.x
+
+
+def _solve_directly(number_cities, distances, labor_supply, initial_guess):
+    """Solve a counterfactual model from scratch."""
+    model = models.Model(params=dict(params),
+                         physical_distances=distances,
+                         population=labor_supply)
+    model.number_cities = number_cities
+    solver = solvers.Solver(model, backend='numpy')
+    return solver.solve(initial_guess, tol=1e-12).x
+
+
+def test_solve_population():
+    """Compare population counterfactuals with independent solves."""
+    number_cities = np.random.randint(2, 25)
+    solver, baseline = _solve_baseline(number_cities)
+    counterfactual = counterfactuals.Counterfactual(solver, baseline)
+
+    for city in np.random.randint(number_cities, size=3):
+        value = np.random.uniform(0.5, 1.5) * population[city]
+        result = counterfactual.solve_population(city, value, tol=1e-12)
+        nose.tools.assert_true(result.success)
+
+        labor_supply = population.copy()
+        labor_supply[city] = value
+        expected = _solve_directly(number_cities, physical_distances,
+                                   labor_supply, baseline)
+        np.testing.assert_almost_equal(result.x, expected,
+                                       err_msg="City: {}".format(city))
+
+    # baseline model is left unchanged
+    nose.tools.assert_true((solver.model.population == population).all())
+
+
+def test_solve_distances():
+    """Compare distance counterfactuals with independent solves."""
+    number_cities = np.random.randint(2, 25)
+    solver, baseline = _solve_baseline(number_cities)
+    counterfactual = counterfactuals.Counterfactual(solver, baseline)
+
+    for city in np.random.randint(number_cities, size=3):
+        distances = (np.random.uniform(0.5, 1.5) *
+                     physical_distances[city, :number_cities])
+        result = counterfactual.solve_distances(city, distances, tol=1e-12)
+        nose.tools.assert_true(result.success)
+
+        shocked_distances = physical_distances[:number_cities, :number_cities].copy()
+        shocked_distances[city, :] = distances
+        shocked_distances[:, city] = distances
+        expected = _solve_directly(number_cities, shocked_distances,
+                                   population, baseline)
+        np.testing.assert_almost_equal(result.x, expected,
+                                       err_msg="City: {}".format(city))
+
+    # population counterfactuals use the baseline distances again
+    result = counterfactual.solve_population(0, population[0], tol=1e-12)
+    np.testing.assert_almost_equal(result.x, baseline)
+
+
+def test_validation():
+    """Testing validation of baselines and shocks."""
+    solver, baseline = _solve_baseline(5)
+    with nose.tools.assert_raises(AttributeError):
+        counterfactuals.Counterfactual(solver, baseline[:-1])
+
+    counterfactual = counterfactuals.Counterfactual(solver, baseline)
+    with nose.tools.assert_raises(ValueError):
+        counterfactual.solve_population(5, 1.0)
+    with nose.tools.assert_raises(ValueError):
+        counterfactual.solve_distances(0, np.zeros(4))
@@ -0,0 +1,218 @@
+"""
+Test suite for the distance_store.py module.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import os
+import shutil
+import tempfile
+
+import nose
+import numpy as np
+
+from distance_store import CondensedDistances, DistanceStore
+from models import Model
+
+# grab data on physical distances
+physical_distances = np.load('../data/google/normed_vincenty_distance.npy')
+condensed_distances = CondensedDistances.load('../data/google/condensed_vincenty_distance.npy')
+
+
+def test_row_blocks():
+    """Testing that row blocks of a store match the stored array."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for dtype in ['float32', 'float64']:
+            path = os.path.join(tmp_dir, 'distances_{}.npy'.format(dtype))
+            store = DistanceStore.from_array(path, physical_distances, dtype)
+            store.block_size = 7
+            nose.tools.assert_equals(store.dtype, np.dtype(dtype))
+
+            expected = physical_distances[:20, :20].astype(dtype)
+            actual = np.vstack([distances for _, _, distances in
+                                store.row_blocks(20)])
+            np.testing.assert_almost_equal(expected, actual)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_residual():
+    """Testing that the residual is the same for in-memory and stored distances."""
+    N = 20
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, N)}
+    population = np.random.uniform(0.5, 1.5, N)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'distances.npy')
+        store = DistanceStore.from_array(path, physical_distances)
+        store.block_size = 7
+
+        expected_model = Model(params, physical_distances, population)
+        actual_model = Model(params, store, population)
+        expected_model.number_cities = N
+        actual_model.number_cities = N
+
+        P = np.append(1.0, np.random.uniform(0.5, 1.5, N - 1))
+        Y, W, M = np.random.uniform(0.5, 1.5, (3, N))
+        args = (P, Y, W, M, population, 1.0, 1.31, 1.0 / 1.31, 0.05,
+                params['theta'])
+        np.testing.assert_almost_equal(expected_model.compute_residual(*args),
+                                       actual_model.compute_residual(*args))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+class RowBlockStore(DistanceStore):
+    """DistanceStore that may only be read one block of rows at a time."""
+
+    def __getitem__(self, key):
+        raise AssertionError("Distances must be read using row_blocks.")
+
+
+def test_jacobian():
+    """Testing that the Jacobian streams stored distances by row blocks."""
+    N = 20
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, N)}
+    population = np.random.uniform(0.5, 1.5, N)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'distances.npy')
+        DistanceStore.from_array(path, physical_distances).flush()
+        store = RowBlockStore(path)
+        store.block_size = 7
+
+        expected_model = Model(params, physical_distances, population)
+        actual_model = Model(params, store, population)
+        expected_model.number_cities = N
+        actual_model.number_cities = N
+
+        # single and stacked points
+        P = np.append(1.0, np.random.uniform(0.5, 1.5, N - 1))
+        Y, W, M = np.random.uniform(0.5, 1.5, (3, N))
+        args = (P, Y, W, M, population, 1.0, 1.31, 1.0 / 1.31, 0.05,
+                params['theta'])
+        stacked_args = (np.array([P, P]), np.array([Y, 2 * Y]),
+                        np.array([W, W]), np.array([M, M]), population,
+                        np.array([1.0, 1.5]), 1.31, 1.0 / 1.31,
+                        np.array([0.05, 0.1]), params['theta'])
+
+        for point in [args, stacked_args]:
+            np.testing.assert_almost_equal(expected_model.compute_residual(*point),
+                                           actual_model.compute_residual(*point))
+            np.testing.assert_almost_equal(expected_model.compute_jacobian(*point),
+                                           actual_model.compute_jacobian(*point))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_validate_block_size():
+    """Testing validation of block_size attribute."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        store = DistanceStore.create(os.path.join(tmp_dir, 'distances.npy'), 4)
+        with nose.tools.assert_raises(AttributeError):
+            store.block_size = 0
+        with nose.tools.assert_raises(AttributeError):
+            store.block_size = 1.5
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_condensed_indexing():
+    """Testing indexing of condensed distances."""
+    N = condensed_distances.number_cities
+    nose.tools.assert_equals(N, physical_distances.shape[0])
+
+    i, j = np.random.randint(0, N, 2)
+    np.testing.assert_almost_equal(condensed_distances[i, j],
+                                   physical_distances[i, j])
+    np.testing.assert_almost_equal(condensed_distances[i],
+                                   physical_distances[i])
+    np.testing.assert_almost_equal(condensed_distances[:, j],
+                                   physical_distances[:, j])
+    np.testing.assert_almost_equal(condensed_distances[:50, 10:30],
+                                   physical_distances[:50, 10:30])
+
+    blocks = condensed_distances.row_blocks(20, 7)
+    np.testing.assert_almost_equal(np.vstack([b for _, _, b in blocks]),
+                                   physical_distances[:20, :20])
+
+
+def test_condensed_economic_distances():
+    """Testing economic distances computed in condensed form."""
+    N = 20
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, N)}
+    population = np.random.uniform(0.5, 1.5, N)
+
+    expected_model = Model(params, physical_distances, population)
+    actual_model = Model(params, condensed_distances, population)
+    expected_model.number_cities = N
+    actual_model.number_cities = N
+
+    for tau in [0.05, np.array([0.05, 0.1])]:
+        np.testing.assert_almost_equal(
+            expected_model.compute_economic_distances(tau),
+            actual_model.compute_economic_distances(tau))
+
+    P = np.append(1.0, np.random.uniform(0.5, 1.5, N - 1))
+    Y, W, M = np.random.uniform(0.5, 1.5, (3, N))
+    args = (P, Y, W, M, population, 1.0, 1.31, 1.0 / 1.31, 0.05,
+            params['theta'])
+    np.testing.assert_almost_equal(expected_model.compute_residual(*args),
+                                   actual_model.compute_residual(*args))
+    np.testing.assert_almost_equal(expected_model.compute_jacobian(*args),
+                                   actual_model.compute_jacobian(*args))
+
+
+class RowBlockCondensedDistances(CondensedDistances):
+    """CondensedDistances that may only be read by looking up distances."""
+
+    def condensed(self, number_cities):
+        raise AssertionError("Distances must not be expanded.")
+
+
+def test_condensed_jacobian():
+    """Testing that the Jacobian looks up condensed distances directly."""
+    N = 20
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, N)}
+    population = np.random.uniform(0.5, 1.5, N)
+
+    expected_model = Model(params, physical_distances, population)
+    actual_model = Model(params,
+                         RowBlockCondensedDistances(condensed_distances.distances),
+                         population)
+    expected_model.number_cities = N
+    actual_model.number_cities = N
+
+    P = np.append(1.0, np.random.uniform(0.5, 1.5, N - 1))
+    Y, W, M = np.random.uniform(0.5, 1.5, (3, N))
+    args = (P, Y, W, M, population, 1.0, 1.31, 1.0 / 1.31, 0.05,
+            params['theta'])
+    np.testing.assert_almost_equal(expected_model.compute_residual(*args),
+                                   actual_model.compute_residual(*args))
+    np.testing.assert_almost_equal(expected_model.compute_jacobian(*args),
+                                   actual_model.compute_jacobian(*args))
+
+
+def test_condensed_physical_distances():
+    """Testing dense physical distances are cached per number of cities."""
+    N = 380
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, N)}
+    model = Model(params, condensed_distances, np.ones(N))
+
+    for number_cities in [10, 20, 5]:
+        model.number_cities = number_cities
+        distances = model.physical_distances
+        nose.tools.assert_true(model.physical_distances is distances)
+        np.testing.assert_almost_equal(
+            distances,
+            physical_distances[:number_cities, :number_cities])
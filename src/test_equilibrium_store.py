@@ -0,0 +1,172 @@
+"""
+Test suite for the equilibrium_store.py module.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import os
+import shutil
+import tempfile
+
+import nose
+
+import numpy as np
+
+import equilibrium_store
+import master_data
+import models
+import solvers
+
+# grab data on physical distances
+physical_distances = np.load('../data/google/normed_vincenty_distance.npy')
+
+# compute the effective labor supply
+raw_data = master_data.panel.minor_xs(2010)
+clean_data = raw_data.sort('GDP_MP', ascending=False).drop([998, 48260])
+population = clean_data['POP_MI'].values
+
+# define some parameters
+N = 380
+params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+          'theta': np.repeat(10.0, N)}
+
+
+def test_warm_starts():
+    """Compare solutions using the store with independent solves."""
+    path = tempfile.mkdtemp()
+    try:
+        model = models.Model(params=dict(params),
+                             physical_distances=physical_distances,
+                             population=population)
+        model.number_cities = np.random.randint(2, 25)
+        solver = solvers.Solver(model, backend='numpy')
+        store = equilibrium_store.EquilibriumStore(path)
+
+        for tau in [0.05, 0.1, 0.15]:
+            model.params = dict(params, tau=tau)
+            result = store.solve(solver, tol=1e-12)
+            nose.tools.assert_true(result.success)
+
+            expected = solver.solve(solvers.IslandsGuess(model).guess, tol=1e-12)
+            np.testing.assert_almost_equal(result.x, expected.x,
+                                           err_msg="tau: {}".format(tau))
+
+        # first solve misses, later solves start from stored equilibria
+        report = store.report
+        nose.tools.assert_equal(report['entries'], 3)
+        nose.tools.assert_equal(report['hits'], 2)
+        nose.tools.assert_equal(report['misses'], 1)
+
+        # nearest equilibrium is found by a new store using the same directory
+        model.params = dict(params, tau=0.09)
+        solution, distance = equilibrium_store.EquilibriumStore(path).nearest(model)
+        model.params = dict(params, tau=0.1)
+        np.testing.assert_almost_equal(solution, store.solve(solver).x)
+        np.testing.assert_almost_equal(distance, np.log(1.1 / 1.09))
+
+        # equilibria are not shared between different data
+        model.number_cities += 1
+        nose.tools.assert_equal(store.nearest(model), (None, np.inf))
+    finally:
+        shutil.rmtree(path)
+
+
+def test_eviction():
+    """Testing eviction of least recently used equilibria."""
+    path = tempfile.mkdtemp()
+    try:
+        model = models.Model(params=dict(params),
+                             physical_distances=physical_distances,
+                             population=population)
+        model.number_cities = 5
+        store = equilibrium_store.EquilibriumStore(path, max_entries=2)
+
+        for tau in [1.0, 2.0, 3.0]:
+            model.params = dict(params, tau=tau)
+            store.add(model, np.repeat(tau, 19))
+
+        # equilibrium with tau=1.0 was least recently used
+        nose.tools.assert_equal(store.report['entries'], 2)
+        nose.tools.assert_equal(store.report['evictions'], 1)
+        nose.tools.assert_equal(len(os.listdir(path)), 3)
+        model.params = dict(params, tau=1.0)
+        solution, _ = store.nearest(model)
+        np.testing.assert_almost_equal(solution, np.repeat(2.0, 19))
+
+        # ...now tau=3.0 is least recently used
+        store.max_entries = 1
+        solution, _ = store.nearest(model)
+        np.testing.assert_almost_equal(solution, np.repeat(2.0, 19))
+
+        store.clear()
+        nose.tools.assert_equal(os.listdir(path), [])
+    finally:
+        shutil.rmtree(path)
+
+
+def test_eviction_after_lookup():
+    """Testing that lookups are remembered by new stores."""
+    path = tempfile.mkdtemp()
+    try:
+        model = models.Model(params=dict(params),
+                             physical_distances=physical_distances,
+                             population=population)
+        model.number_cities = 5
+        store = equilibrium_store.EquilibriumStore(path, max_entries=2)
+        for tau in [1.0, 2.0]:
+            model.params = dict(params, tau=tau)
+            store.add(model, np.repeat(tau, 19))
+
+        # looking up tau=1.0 makes tau=2.0 the least recently used...
+        model.params = dict(params, tau=1.0)
+        equilibrium_store.EquilibriumStore(path).nearest(model)
+
+        # ...so a new store evicts tau=2.0 when adding tau=3.0
+        store = equilibrium_store.EquilibriumStore(path, max_entries=2)
+        model.params = dict(params, tau=3.0)
+        store.add(model, np.repeat(3.0, 19))
+
+        model.params = dict(params, tau=1.0)
+        solution, distance = store.nearest(model)
+        np.testing.assert_almost_equal(solution, np.repeat(1.0, 19))
+        np.testing.assert_almost_equal(distance, 0.0)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_free_trade():
+    """Testing equilibria with tau=0 and invalid parameters."""
+    path = tempfile.mkdtemp()
+    try:
+        model = models.Model(params=dict(params, tau=0.0),
+                             physical_distances=physical_distances,
+                             population=population)
+        model.number_cities = 5
+        store = equilibrium_store.EquilibriumStore(path)
+        store.add(model, np.repeat(1.0, 19))
+
+        model.params = dict(params, tau=0.05)
+        solution, distance = store.nearest(model)
+        np.testing.assert_almost_equal(solution, np.repeat(1.0, 19))
+        np.testing.assert_almost_equal(distance, np.log1p(0.05))
+
+        # invalid parameters are never stored
+        model.params = dict(params, tau=-1.0)
+        with nose.tools.assert_raises(ValueError):
+            store.add(model, np.repeat(1.0, 19))
+        nose.tools.assert_equal(store.report['entries'], 1)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_validate_max_entries():
+    """Testing validation method for max_entries attribute."""
+    path = tempfile.mkdtemp()
+    try:
+        with nose.tools.assert_raises(AttributeError):
+            equilibrium_store.EquilibriumStore(path, max_entries=0)
+        with nose.tools.assert_raises(AttributeError):
+            equilibrium_store.EquilibriumStore(path, max_entries=1.5)
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,86 @@
+"""
+Test suite for the kernels.py module.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import nose
+
+import numpy as np
+
+import kernels
+import models
+import solvers
+
+# grab data on physical distances
+physical_distances = np.load('../data/google/normed_vincenty_distance.npy')
+population = np.ones(physical_distances.shape[0])
+
+# define some parameters
+params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+          'theta': np.repeat(10.0, physical_distances.shape[0])}
+
+
+def test_registry_hits():
+    """Testing that kernels are shared across solver instances."""
+    registry = kernels.registry
+    registry.clear()
+
+    for i in range(3):
+        model = models.Model(params=params,
+                             physical_distances=physical_distances,
+                             population=population)
+        model.number_cities = 2
+        solvers.Solver(model)._numeric_system
+
+    info = registry.info()
+    nose.tools.assert_equals(info.misses, 1)
+    nose.tools.assert_equals(info.hits, 2)
+
+
+def test_registry_eviction():
+    """Testing that least recently used kernels are evicted."""
+    registry = kernels.KernelRegistry(maxsize=2)
+    registry.get('a', lambda: 1)
+    registry.get('b', lambda: 2)
+    registry.get('a', lambda: 1)
+    registry.get('c', lambda: 3)
+
+    # 'b' was least recently used and should have been evicted
+    nose.tools.assert_equals(registry.info().currsize, 2)
+    nose.tools.assert_equals(registry.get('b', lambda: 4), 4)
+    nose.tools.assert_equals(registry.info().misses, 4)
+
+
+def test_incomplete_compiled_kernels():
+    """Testing that incomplete compiled kernels are treated as cache misses."""
+    kernel_dir = tempfile.mkdtemp()
+    try:
+        # build interrupted before metadata was written...
+        nose.tools.assert_is_none(kernels.CompiledKernelCache._load(kernel_dir))
+
+        # ...or metadata written but extension module missing
+        metadata = {'function': 'autofunc_c', 'module': 'wrapper_module_0'}
+        with open(os.path.join(kernel_dir, 'kernel.json'), 'w') as kernel_file:
+            json.dump(metadata, kernel_file)
+        nose.tools.assert_is_none(kernels.CompiledKernelCache._load(kernel_dir))
+    finally:
+        shutil.rmtree(kernel_dir)
+
+
+def test_validate_backend():
+    """Testing validation method for backend attribute."""
+    with nose.tools.assert_raises(AttributeError):
+        kernels.CompiledKernelCache(tempfile.gettempdir(), backend='numba')
+
+
+def test_validate_maxsize():
+    """Testing validation method for maxsize attribute."""
+    with nose.tools.assert_raises(AttributeError):
+        kernels.KernelRegistry(maxsize=0)
@@ -7,8 +7,9 @@ Test suite for the models.py module.
 """
 import nose
 import numpy as np
+import sympy as sym
 
-from models import Model
+from models import Model, SingleCityModel
 import master_data
 import solvers
 
@@ -120,3 +121,162 @@ def test_validate_params():
         Model(params=invalid_params,
               physical_distances=physical_distances,
               population=population)
+
+
+def test_economic_distances_cache():
+    """Testing that cached economic distances are updated when required."""
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, 1)}
+    model = Model(params=params,
+                  physical_distances=physical_distances,
+                  population=population)
+    model.number_cities = 5
+
+    # changing tau should update the economic distances...
+    for iceberg_cost in iceberg_costs:
+        expected_distances = np.exp(iceberg_cost * physical_distances[:5, :5])
+        actual_distances = model.compute_economic_distances(iceberg_cost)
+        np.testing.assert_almost_equal(expected_distances, actual_distances)
+
+    # ...as should changing the number of cities...
+    model.number_cities = 10
+    expected_distances = np.exp(0.05 * physical_distances[:10, :10])
+    actual_distances = model.compute_economic_distances(0.05)
+    np.testing.assert_almost_equal(expected_distances, actual_distances)
+
+    # ...or the physical distances
+    model.physical_distances = 2 * physical_distances
+    expected_distances = np.exp(0.1 * physical_distances[:10, :10])
+    actual_distances = model.compute_economic_distances(0.05)
+    np.testing.assert_almost_equal(expected_distances, actual_distances)
+
+
+def test_pairwise_terms_cache():
+    """Testing that cached pairwise terms are updated when required."""
+    N = 10
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, N)}
+    model = Model(params=params,
+                  physical_distances=physical_distances,
+                  population=population)
+    model.number_cities = N
+
+    P = np.append(1.0, np.random.uniform(0.5, 1.5, N - 1))
+    Y, W, M = np.random.uniform(0.5, 1.5, (3, N))
+    args = {'P': P, 'Y': Y, 'W': W, 'M': M, 'L': population[:N], 'f': 1.0,
+            'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+            'theta': params['theta']}
+
+    def expected_residual(args):
+        """Residual computed by a model with an empty cache."""
+        fresh_model = Model(params=params,
+                            physical_distances=physical_distances,
+                            population=population)
+        fresh_model.number_cities = N
+        return fresh_model.compute_residual(**args)
+
+    # same inputs reuse the cached pairwise terms...
+    residual = model.compute_residual(**args)
+    terms = model._compute_pairwise_terms(P, Y, W, args['phi'], args['tau'],
+                                          args['theta'])
+    np.testing.assert_almost_equal(model.compute_residual(**args), residual)
+    nose.tools.assert_true(
+        model._compute_pairwise_terms(P, Y, W, args['phi'], args['tau'],
+                                      args['theta']) is terms)
+
+    # ...but changing any of them gives fresh results
+    changes = {'P': np.append(1.0, 1.1 * P[1:]), 'W': 1.1 * W, 'tau': 0.1,
+               'theta': np.repeat(5.0, N)}
+    for name, value in changes.items():
+        new_args = dict(args, **{name: value})
+        np.testing.assert_almost_equal(model.compute_residual(**new_args),
+                                       expected_residual(new_args),
+                                       err_msg="Changed input: {}".format(name))
+
+    # ...including modifying an input array in place
+    model.compute_residual(**args)
+    W *= 1.1
+    np.testing.assert_almost_equal(model.compute_residual(**args),
+                                   expected_residual(args))
+
+
+def test_extend_equations():
+    """Testing that extended equations match equations built from scratch."""
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.repeat(10.0, 4)}
+    grown_model = Model(params=params,
+                        physical_distances=physical_distances,
+                        population=population)
+    grown_model.number_cities = 2
+    grown_model._symbolic_jacobian
+    grown_model.number_cities = 4
+
+    model = Model(params=params,
+                  physical_distances=physical_distances,
+                  population=population)
+    model.number_cities = 4
+
+    # compare numeric values of the two systems at some random point
+    P = np.append(1.0, np.random.uniform(0.5, 1.5, 3))
+    Y, W, M = np.random.uniform(0.5, 1.5, (3, 4))
+    args = (P, Y, W, M, population, 1.0, 1.31, 1.0 / 1.31, 0.05, params['theta'])
+    modules = [{'ImmutableMatrix': np.array}, "numpy"]
+
+    for grown_expr, expr in [(grown_model._symbolic_system, model._symbolic_system),
+                             (grown_model._symbolic_jacobian, model._symbolic_jacobian)]:
+        grown_function = sym.lambdify(model._symbolic_args, grown_expr, modules)
+        function = sym.lambdify(model._symbolic_args, expr, modules)
+        np.testing.assert_almost_equal(grown_function(*args), function(*args))
+
+
+def test_single_city_solution():
+    """Testing closed form solution against the symbolic solution."""
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.random.uniform(2.0, 20.0, 10)}
+    city = SingleCityModel(params=params,
+                           physical_distances=physical_distances,
+                           population=population)
+    modules = [{'ImmutableMatrix': np.array}, "numpy"]
+
+    # evaluate the closed form for ten cities in one call...
+    P = np.random.uniform(0.5, 1.5, 10)
+    actual_solution = city.compute_solution(P, population[:10], params)
+
+    # ...and the symbolic solution one city at a time
+    variables = [sym.DeferredVector(name)[0] for name in ['Y', 'W', 'M']]
+    for variable, actual in zip(variables, actual_solution):
+        function = sym.lambdify(city._symbolic_args,
+                                city._symbolic_solution[variable], modules)
+        expected = [function(P[h:h+1], population[h:h+1], params['f'],
+                             params['beta'], params['phi'], params['tau'],
+                             params['theta'][h:h+1]) for h in range(10)]
+        np.testing.assert_almost_equal(expected, actual)
+
+
+def test_sparse_residual():
+    """Testing sparse residual and Jacobian against the dense versions."""
+    N = 10
+    params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+              'theta': np.random.uniform(2.0, 20.0, N)}
+    model = Model(params=params,
+                  physical_distances=physical_distances,
+                  population=population)
+    model.number_cities = N
+
+    P = np.append(1.0, np.random.uniform(0.5, 1.5, N - 1))
+    Y, W, M = np.random.uniform(0.5, 1.5, (3, N))
+    args = (P, Y, W, M, population, 1.0, 1.31, 1.0 / 1.31, 0.05, params['theta'])
+
+    # when all pairs of cities trade the results should be identical...
+    model.trade_network = model.compute_trade_network(0.05, params['theta'])
+    nose.tools.assert_equals(model.trade_network.nnz, N**2)
+    np.testing.assert_almost_equal(model.compute_residual(*args),
+                                   model.compute_sparse_residual(*args))
+    np.testing.assert_almost_equal(model.compute_jacobian(*args),
+                                   model.compute_sparse_jacobian(*args).toarray())
+
+    # ...and truncated networks should be symmetric and keep nearest neighbors
+    network = model.compute_trade_network(0.05, params['theta'],
+                                          max_distance=0.0, number_neighbors=2)
+    nose.tools.assert_equals((network != network.T).nnz, 0)
+    nose.tools.assert_true((network.sum(axis=1) >= 3).all())
@@ -1,5 +1,8 @@
 import nose
 
+from geopy.distance import great_circle, vincenty
+import numpy as np
+
 import master_data
 import physical_distance
 
@@ -13,3 +16,17 @@ def test_data_alignment():
     """Testing alignment of population and physical distance data."""
     condition = clean_data.index == physical_distance.geo_coords.index
     nose.tools.assert_true(condition.all())
+
+
+def test_pairwise_distances():
+    """Testing vectorized distances against geopy."""
+    coords = physical_distance.geo_coords.values[:50]
+    metrics = [(physical_distance.great_circle_distance, great_circle),
+               (physical_distance.vincenty_distance, vincenty)]
+
+    for metric, geopy_metric in metrics:
+        # use a small block size so that several blocks are needed
+        actual = physical_distance.pairwise_distances(coords, metric, 16)
+        expected = [[geopy_metric(tuple(coords_1), tuple(coords_2)).kilometers
+                     for coords_2 in coords] for coords_1 in coords]
+        np.testing.assert_almost_equal(actual, expected, decimal=6)
@@ -0,0 +1,64 @@
+"""
+Test suite for the racing.py module.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import nose
+
+import numpy as np
+
+import master_data
+import models
+import racing
+import solvers
+
+# grab data on physical distances
+physical_distances = np.load('../data/google/normed_vincenty_distance.npy')
+
+# compute the effective labor supply
+raw_data = master_data.panel.minor_xs(2010)
+clean_data = raw_data.sort('GDP_MP', ascending=False).drop([998, 48260])
+population = clean_data['POP_MI'].values
+
+# define some parameters
+N = 380
+params = {'f': 1.0, 'beta': 1.31, 'phi': 1.0 / 1.31, 'tau': 0.05,
+          'theta': np.repeat(10.0, N)}
+
+model = models.Model(params=params,
+                     physical_distances=physical_distances,
+                     population=population)
+
+
+def test_race():
+    """Compare results of racing solves with hybr."""
+    model.number_cities = np.random.randint(2, 25)
+    solver = solvers.Solver(model, backend='numpy')
+    expected = solver.solve(solvers.IslandsGuess(model).guess, tol=1e-12)
+
+    # first strategy can not converge using a single function evaluation
+    strategies = [{'guess': 'islands', 'method': 'hybr',
+                   'options': {'maxfev': 1}},
+                  {'guess': 'perturbed', 'method': 'hybr', 'scale': 0.01}]
+
+    for processes in [1, 2]:
+        result = racing.race(model, strategies, processes=processes, seed=42,
+                             tol=1e-12)
+        nose.tools.assert_true(result.success)
+        nose.tools.assert_equal(result.strategy, 1)
+        nose.tools.assert_equal(result.race[-1]['strategy'], 1)
+        np.testing.assert_almost_equal(result.x, expected.x,
+                                       err_msg="Processes: {}".format(processes))
+
+    # if no strategy converges, return the one with the smallest residual
+    result = racing.race(model, strategies[:1], processes=1)
+    nose.tools.assert_false(result.success)
+    nose.tools.assert_equal(result.strategy, 0)
+
+
+def test_invalid_guess():
+    """Testing validation of strategy guesses."""
+    with nose.tools.assert_raises(ValueError):
+        racing.race(model, [{'guess': 'invalid', 'method': 'hybr'}])
@@ -1,9 +1,14 @@
+import shutil
+import tempfile
+
 import nose
 
 import numpy as np
 
+import kernels
 import master_data
 import models
+import numba_kernels
 import solvers
 
 # grab data on physical distances
@@ -48,6 +53,58 @@ def test_initial_guesses():
                                    err_msg="Number of cities: {}".format(N))
 
 
+def test_islands_guess():
+    """Testing the islands guess with a different elasticity for each city."""
+    N = np.random.randint(1, 25)
+    tmp_params = dict(params, theta=np.random.uniform(5.0, 15.0, 380))
+    tmp_model = models.Model(params=tmp_params,
+                             physical_distances=physical_distances,
+                             population=population)
+
+    islands = solvers.IslandsGuess(tmp_model)
+    islands.number_cities = N
+    Y0, W0, M0 = islands.guess[N-1:].reshape(3, N)
+
+    # each city should solve the model for an economy consisting of that city
+    for h in range(N):
+        theta = tmp_params['theta'][h:h+1]
+        city = models.Model(params=dict(tmp_params, theta=theta),
+                            physical_distances=physical_distances,
+                            population=population[h:h+1])
+        city.number_cities = 1
+        residual = city.compute_residual(np.ones(1), Y0[h:h+1], W0[h:h+1],
+                                         M0[h:h+1], population[h:h+1],
+                                         tmp_params['f'], tmp_params['beta'],
+                                         tmp_params['phi'], tmp_params['tau'],
+                                         theta)
+        np.testing.assert_almost_equal(residual, np.zeros(3),
+                                       err_msg="City: {}".format(h))
+
+
+def test_adaptive_stride():
+    """Compare results using HotStartGuess with and without adaptive stride."""
+    # define some number of cities
+    N = np.random.randint(2, 25)
+
+    solutions = []
+    for max_stride in [1, 8]:
+        hot_start = solvers.HotStartGuess(model)
+        hot_start.number_cities = N
+        hot_start.max_stride = max_stride
+        hot_start.solver_backend = 'numpy'
+        hot_start.solver_kwargs = {'method': 'hybr',
+                                   'tol': 1e-12,
+                                   'with_jacobian': True}
+        solutions.append(hot_start.guess)
+
+        # every city should be accounted for by the steps of the hot start
+        nose.tools.assert_equals(sum(step['stride'] for step in hot_start.report),
+                                 N - 1)
+
+    np.testing.assert_almost_equal(solutions[0], solutions[1],
+                                   err_msg="Number of cities: {}".format(N))
+
+
 def test_jacobians():
     """Testing results using finite difference and symbolic jacobians."""
     # define some number of cities
@@ -67,6 +124,368 @@ def test_jacobians():
                                    err_msg="Number of cities: {}".format(N))
 
 
+def test_numpy_backend():
+    """Testing residuals using symbolic and vectorized backends."""
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    # evaluate both backends at the same initial guess
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    symbolic_solver = solvers.Solver(model, backend='sympy')
+    numeric_solver = solvers.Solver(model, backend='numpy')
+
+    np.testing.assert_almost_equal(symbolic_solver.system(initial_guess.guess),
+                                   numeric_solver.system(initial_guess.guess),
+                                   err_msg="Number of cities: {}".format(N))
+
+
+def test_numpy_jacobian():
+    """Testing Jacobians using symbolic and vectorized backends."""
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    # evaluate both Jacobians at the same initial guess
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    symbolic_solver = solvers.Solver(model, backend='sympy')
+    numeric_solver = solvers.Solver(model, backend='numpy')
+
+    np.testing.assert_almost_equal(symbolic_solver.jacobian(initial_guess.guess),
+                                   numeric_solver.jacobian(initial_guess.guess),
+                                   err_msg="Number of cities: {}".format(N))
+
+
+def test_jacobian_blocks():
+    """Testing diagonal blocks against the full Jacobian."""
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    solver = solvers.Solver(model, backend='numpy')
+    X = initial_guess.guess
+
+    # full Jacobian including the (identity) row and column for P[0]
+    jac = np.eye(4 * N)
+    jac[1:, 1:] = solver.jacobian(X)
+
+    P, Y, W, M = solver._split(X)
+    blocks = model.compute_jacobian_blocks(P, Y, W, M, model.population,
+                                           **model.params)
+    for h in range(N):
+        index = np.arange(4) * N + h
+        np.testing.assert_almost_equal(jac[np.ix_(index, index)], blocks[h],
+                                       err_msg="City: {}".format(h))
+
+
+def test_batched_evaluation():
+    """Testing stacked residuals and Jacobians against one point at a time."""
+    # define some number of cities and parameter sets
+    N, K = np.random.randint(1, 25), 5
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    X = initial_guess.guess * np.random.uniform(0.9, 1.1, (K, 4 * N - 1))
+    taus = np.random.uniform(0.01, 0.1, K)
+
+    batched_model = models.Model(params=dict(params, tau=taus),
+                                 physical_distances=physical_distances,
+                                 population=population)
+    batched_model.number_cities = N
+    solver = solvers.Solver(batched_model, backend='numpy')
+    residuals, jacobians = solver.system(X), solver.jacobian(X)
+
+    for k in range(K):
+        batched_model.params = dict(params, tau=taus[k])
+        np.testing.assert_almost_equal(residuals[k], solver.system(X[k]),
+                                       err_msg="Number of cities: {}".format(N))
+        np.testing.assert_almost_equal(jacobians[k], solver.jacobian(X[k]),
+                                       err_msg="Number of cities: {}".format(N))
+
+
+def test_numba_backend():
+    """Testing residuals and Jacobians using vectorized and Numba backends."""
+    if not numba_kernels.available:
+        raise nose.SkipTest("Numba is not installed.")
+
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    # evaluate both backends at the same initial guess
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    numeric_solver = solvers.Solver(model, backend='numpy')
+    jit_solver = solvers.Solver(model, backend='numba')
+
+    np.testing.assert_almost_equal(numeric_solver.system(initial_guess.guess),
+                                   jit_solver.system(initial_guess.guess),
+                                   err_msg="Number of cities: {}".format(N))
+    np.testing.assert_almost_equal(numeric_solver.jacobian(initial_guess.guess),
+                                   jit_solver.jacobian(initial_guess.guess),
+                                   err_msg="Number of cities: {}".format(N))
+
+
+def test_numba_kernels():
+    """Testing the pure Python versions of the Numba kernels."""
+    # define some number of cities (kernels are slow without Numba)
+    N = np.random.randint(1, 8)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    solver = solvers.Solver(model, backend='numpy')
+    X = initial_guess.guess * np.random.uniform(0.9, 1.1, 4 * N - 1)
+    P, Y, W, M = solver._split(X)
+
+    args = (P, Y, W, M, population[:N], params['f'], params['beta'],
+            params['phi'], params['tau'], params['theta'][:N])
+    pairs = [(numba_kernels.compute_residual, model.compute_residual),
+             (numba_kernels.compute_jacobian, model.compute_jacobian)]
+    for kernel, expected in pairs:
+        # jitted kernels keep the original Python function as py_func
+        kernel = getattr(kernel, 'py_func', kernel)
+        actual = kernel(*(args + (model.physical_distances,)))
+        np.testing.assert_almost_equal(actual, expected(*args),
+                                       err_msg="Number of cities: {}".format(N))
+
+
+def test_autowrap_backend():
+    """Testing residuals using symbolic and compiled backends."""
+    try:
+        import Cython
+    except ImportError:
+        raise nose.SkipTest("Cython is required by the autowrap backend.")
+
+    # compile kernels into a temporary cache rather than the home directory
+    cache_dir = tempfile.mkdtemp()
+    compiled_kernels = kernels.compiled_kernels
+    kernels.compiled_kernels = kernels.CompiledKernelCache(cache_dir)
+    kernels.registry.clear()
+    try:
+        initial_guess = solvers.IslandsGuess(model)
+        initial_guess.number_cities = 2
+        symbolic_solver = solvers.Solver(model, backend='sympy')
+        compiled_solver = solvers.Solver(model, backend='autowrap')
+
+        np.testing.assert_almost_equal(symbolic_solver.system(initial_guess.guess),
+                                       compiled_solver.system(initial_guess.guess))
+    finally:
+        kernels.compiled_kernels = compiled_kernels
+        shutil.rmtree(cache_dir)
+
+
+def test_f2py_backend():
+    """Testing residuals using symbolic and Fortran kernels."""
+    if shutil.which('gfortran') is None:
+        raise nose.SkipTest("A Fortran compiler is required by f2py.")
+
+    # compile kernels into a temporary cache rather than the home directory
+    cache_dir = tempfile.mkdtemp()
+    compiled_kernels = kernels.compiled_kernels
+    kernels.compiled_kernels = kernels.CompiledKernelCache(cache_dir,
+                                                           backend='f2py')
+    kernels.registry.clear()
+    try:
+        initial_guess = solvers.IslandsGuess(model)
+        initial_guess.number_cities = 2
+        symbolic_solver = solvers.Solver(model, backend='sympy')
+        compiled_solver = solvers.Solver(model, backend='autowrap')
+
+        np.testing.assert_almost_equal(symbolic_solver.system(initial_guess.guess),
+                                       compiled_solver.system(initial_guess.guess))
+        np.testing.assert_almost_equal(symbolic_solver.jacobian(initial_guess.guess),
+                                       compiled_solver.jacobian(initial_guess.guess))
+
+        # a new cache loads the compiled kernels from disk
+        kernels.compiled_kernels = kernels.CompiledKernelCache(cache_dir,
+                                                               backend='f2py')
+        kernels.registry.clear()
+        compiled_solver = solvers.Solver(model, backend='autowrap')
+        np.testing.assert_almost_equal(symbolic_solver.system(initial_guess.guess),
+                                       compiled_solver.system(initial_guess.guess))
+    finally:
+        kernels.compiled_kernels = compiled_kernels
+        kernels.registry.clear()
+        shutil.rmtree(cache_dir)
+
+
+def test_reduced_model():
+    """Testing solutions of the full and reduced models."""
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    full_solver = solvers.Solver(model, backend='numpy')
+    reduced_solver = solvers.Solver(model, backend='numpy', reduced=True)
+
+    full_result = full_solver.solve(initial_guess.guess, method='hybr',
+                                    tol=1e-12, with_jacobian=True)
+    reduced_result = reduced_solver.solve(initial_guess.guess, method='hybr',
+                                          tol=1e-12, with_jacobian=True)
+
+    np.testing.assert_almost_equal(full_result.x, reduced_result.x,
+                                   err_msg="Number of cities: {}".format(N))
+
+
+def test_reduced_jacobian():
+    """Testing reduced Jacobian against finite differences."""
+    # define some number of cities
+    N = np.random.randint(2, 25)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    solver = solvers.Solver(model, backend='numpy', reduced=True)
+    X = solver.reduce(initial_guess.guess) * np.random.uniform(0.9, 1.1, 2 * N - 1)
+
+    eps = 1e-6
+    steps = eps * np.eye(2 * N - 1)
+    expected_jac = ((solver.reduced_system(X + steps) -
+                     solver.reduced_system(X - steps)) / (2 * eps)).T
+
+    np.testing.assert_allclose(solver.reduced_jacobian(X), expected_jac,
+                               rtol=1e-5, atol=1e-6,
+                               err_msg="Number of cities: {}".format(N))
+
+
+def test_fixed_point_solver():
+    """Testing solutions using hybr and fixed point iteration."""
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    solver = solvers.Solver(model, backend='numpy')
+
+    hybr_result = solver.solve(initial_guess.guess, method='hybr', tol=1e-12,
+                               with_jacobian=True)
+    fixed_point_result = solver.solve(initial_guess.guess,
+                                      method='fixed_point', tol=1e-12)
+
+    nose.tools.assert_true(fixed_point_result.success)
+    np.testing.assert_almost_equal(hybr_result.x, fixed_point_result.x,
+                                   err_msg="Number of cities: {}".format(N))
+
+
+def test_newton_krylov_solver():
+    """Testing solutions using hybr and Newton-Krylov."""
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    solver = solvers.Solver(model, backend='numpy')
+
+    hybr_result = solver.solve(initial_guess.guess, method='hybr', tol=1e-12,
+                               with_jacobian=True)
+    krylov_result = solver.solve(initial_guess.guess, method='newton_krylov',
+                                 tol=1e-10)
+
+    nose.tools.assert_true(krylov_result.success)
+    np.testing.assert_almost_equal(hybr_result.x, krylov_result.x,
+                                   err_msg="Number of cities: {}".format(N))
+
+    # symbolic equations are never built, even with the sympy backend
+    kernels.registry.clear()
+    solver = solvers.Solver(model, backend='sympy')
+    krylov_result = solver.solve(initial_guess.guess, method='newton_krylov',
+                                 tol=1e-10)
+    nose.tools.assert_true(krylov_result.success)
+    nose.tools.assert_equals(kernels.registry.info().misses, 0)
+
+
+def test_sparse_newton_solver():
+    """Testing solutions using hybr and sparse Newton with all pairs trading."""
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    solver = solvers.Solver(model, backend='numpy')
+
+    hybr_result = solver.solve(initial_guess.guess, method='hybr', tol=1e-12,
+                               with_jacobian=True)
+    model.trade_network = model.compute_trade_network(params['tau'],
+                                                      params['theta'],
+                                                      max_distance=np.inf)
+    sparse_result = solver.solve(initial_guess.guess, method='sparse_newton',
+                                 tol=1e-10)
+    model.trade_network = None
+
+    nose.tools.assert_true(sparse_result.success)
+    np.testing.assert_almost_equal(hybr_result.x, sparse_result.x,
+                                   err_msg="Number of cities: {}".format(N))
+
+
+def test_chord_solver():
+    """Testing solutions using hybr and the chord method."""
+    # define some number of cities
+    N = np.random.randint(1, 25)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    solver = solvers.Solver(model, backend='numpy')
+
+    hybr_result = solver.solve(initial_guess.guess, method='hybr', tol=1e-12,
+                               with_jacobian=True)
+    chord_result = solver.solve(initial_guess.guess, method='chord', tol=1e-10)
+
+    nose.tools.assert_true(chord_result.success)
+    nose.tools.assert_true(chord_result.nlu <= chord_result.nit)
+    np.testing.assert_almost_equal(hybr_result.x, chord_result.x,
+                                   err_msg="Number of cities: {}".format(N))
+
+
+def test_sensitivities():
+    """Testing sensitivities against finite differences of solutions."""
+    # define some number of cities
+    N = np.random.randint(2, 25)
+
+    initial_guess = solvers.IslandsGuess(model)
+    initial_guess.number_cities = N
+    solver = solvers.Solver(model, backend='numpy')
+    result = solver.solve(initial_guess.guess, method='hybr', tol=1e-12,
+                          with_jacobian=True)
+    sensitivities = solver.sensitivities(result.x, ['tau', 'L'])
+
+    def perturbed_solution(tau, population):
+        perturbed_params = dict(params, tau=tau)
+        perturbed_model = models.Model(params=perturbed_params,
+                                       physical_distances=physical_distances,
+                                       population=population)
+        perturbed_model.number_cities = N
+        perturbed_solver = solvers.Solver(perturbed_model, backend='numpy')
+        return perturbed_solver.solve(result.x, method='hybr', tol=1e-12,
+                                      with_jacobian=True).x
+
+    h = 1e-6
+    expected = (perturbed_solution(params['tau'] + h, population) -
+                perturbed_solution(params['tau'] - h, population)) / (2 * h)
+    np.testing.assert_allclose(sensitivities['tau'], expected, rtol=1e-4,
+                               atol=1e-4 * np.abs(expected).max())
+
+    k = np.random.randint(N)
+    shock = h * (np.arange(population.size) == k)
+    expected = (perturbed_solution(params['tau'], population + shock) -
+                perturbed_solution(params['tau'], population - shock)) / (2 * h)
+    np.testing.assert_allclose(sensitivities['L'][:, k], expected, rtol=1e-4,
+                               atol=1e-4 * np.abs(expected).max())
+
+    # elasticities are the derivatives rescaled by parameter / variable
+    elasticities = solver.sensitivities(result.x, ['tau'], elasticities=True)
+    np.testing.assert_almost_equal(elasticities['tau'],
+                                   sensitivities['tau'] * params['tau'] / result.x)
+
+    with nose.tools.assert_raises(ValueError):
+        solver.sensitivities(result.x, ['invalid'])
+
+
+def test_validate_backend():
+    """Testing validation method for backend attribute."""
+    with nose.tools.assert_raises(AttributeError):
+        solvers.Solver(model, backend='invalid')
+
+
 def test_not_implemented_methods():
     """Testing unimplemented methods of InitialGuess class."""
     with nose.tools.assert_raises(NotImplementedError):
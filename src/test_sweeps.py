@@ -0,0 +1,59 @@
+"""
+Test suite for the sweeps.py module.
+
+@author : David R. Pugh
+@date : 2014-10-21
+
+"""
+import nose
+
+import numpy as np
+
+import master_data
+import models
+import solvers
+import sweeps
+
+# grab data on physical distances
+physical_distances = np.load('../data/google/normed_vincenty_distance.npy')
+
+# compute the effective labor supply
+raw_data = master_data.panel.minor_xs(2010)
+clean_data = raw_data.sort('GDP_MP', ascending=False).drop([998, 48260])
+population = clean_data['POP_MI'].values
+
+
+def test_parameter_grid():
+    """Testing size of parameter grid."""
+    grid = sweeps.parameter_grid(f=[1.0, 2.0], beta=[1.31], tau=[0.05, 0.1, 0.2])
+    nose.tools.assert_equals(len(grid), 6)
+
+
+def test_sweep():
+    """Compare results of parallel sweep with serial solves."""
+    N = np.random.randint(2, 10)
+    grid = sweeps.parameter_grid(f=[1.0], beta=[1.31], phi=[1.0 / 1.31],
+                                 tau=np.linspace(0.05, 0.5, 4),
+                                 theta=[5.0, 10.0])
+    results = sweeps.sweep(grid, physical_distances, population, N,
+                           processes=2, chunksize=3, tol=1e-12)
+
+    for i, params in enumerate(grid):
+        params['theta'] = np.repeat(params['theta'], N)
+        model = models.Model(params=params,
+                             physical_distances=physical_distances,
+                             population=population)
+        model.number_cities = N
+        solver = solvers.Solver(model, backend='numpy')
+        result = solver.solve(solvers.IslandsGuess(model).guess, tol=1e-12)
+
+        actual = results[sweeps.variable_names(N)].values[i]
+        np.testing.assert_almost_equal(actual, result.x)
+        nose.tools.assert_equals(results['success'][i], result.success)
+
+
+def test_empty_sweep():
+    """Testing sweep over an empty list of parameters."""
+    results = sweeps.sweep([], physical_distances, population, 3, processes=1)
+    nose.tools.assert_equal(len(results), 0)
+    nose.tools.assert_true('success' in results.columns)